@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+/compare エンドポイント用の期間比較
+疾病 × 年 × 週の季節性キューブから、基準週と前年同週・直近N週と前のN週の差と比を
+全疾病分まとめて配列演算で求め、分類ごとの合計も同じ配列から集計します。
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from seasonality import SeasonalityCube
+
+MAX_COMPARE_WINDOW = 26
+COMPARE_SORT_KEYS = ('recent', 'yoy')
+RATIO_DECIMALS = 4
+
+# 比較値の列（this_week, same_week_last_year, recent, previous）
+_METRICS = ('this_week', 'same_week_last_year', 'recent', 'previous')
+
+
+def _period(year: int, week: int) -> Dict:
+    return {"year": year, "week": week}
+
+
+def _rows(labels: Sequence[str], values: np.ndarray, sort: str, key: str,
+          extra: Optional[Sequence[Dict]] = None) -> List[Dict]:
+    """比較値の行列（行 × 4列、NaN は比較対象の週がない）から、差・比を加えた行を変化量の大きい順に作る"""
+    current = values[:, [0, 2]]
+    baseline = values[:, [1, 3]]
+    delta = current - baseline
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(baseline > 0, current / baseline, np.nan)
+    magnitude = np.abs(delta[:, 0 if sort == 'yoy' else 1])
+    # 比較できない行（NaN）は末尾、同じ変化量は名前順
+    order = np.lexsort((np.array(labels, dtype=str), -np.nan_to_num(magnitude, nan=-1.0)))
+
+    def value(x):
+        return None if x != x else int(x)
+
+    def rounded(x):
+        return None if x != x else round(float(x), RATIO_DECIMALS)
+
+    rows = []
+    values_list, delta_list, ratio_list = values.tolist(), delta.tolist(), ratio.tolist()
+    for i in order.tolist():
+        row = {key: labels[i]}
+        if extra is not None:
+            row.update(extra[i])
+        this_week, last_year, recent, previous = values_list[i]
+        row.update({
+            "this_week": value(this_week),
+            "same_week_last_year": value(last_year),
+            "yoy_delta": value(delta_list[i][0]),
+            "yoy_ratio": rounded(ratio_list[i][0]),
+            "recent": value(recent),
+            "previous": value(previous),
+            "recent_delta": value(delta_list[i][1]),
+            "recent_ratio": rounded(ratio_list[i][1]),
+        })
+        rows.append(row)
+    return rows
+
+
+def period_comparison(cube: SeasonalityCube, categories: Dict[str, str], year: Optional[int] = None,
+                      week: Optional[int] = None, window: int = 4, sort: str = 'recent') -> Optional[Dict]:
+    """
+    基準週（省略時はデータの最終週）について全疾病・全分類の比較を返す（基準週がデータになければ None）
+    recent は基準週までの window 週の合計、previous はその前の window 週の合計
+    """
+    periods = np.argwhere(cube.available)
+    if len(periods) == 0:
+        return None
+    keys = cube.years[periods[:, 0]] * 100 + periods[:, 1] + 1
+    if year is None:
+        t = len(keys) - 1
+    else:
+        t = int(np.searchsorted(keys, year * 100 + week))
+        if t >= len(keys) or keys[t] != year * 100 + week:
+            return None
+    year, week = int(keys[t] // 100), int(keys[t] % 100)
+    series = cube.values[:, cube.available]
+
+    metrics = np.full((len(cube.diseases), len(_METRICS)), np.nan)
+    metrics[:, 0] = series[:, t]
+    last_year = np.flatnonzero(cube.years == year - 1)
+    if len(last_year):
+        metrics[:, 1] = cube.values[:, last_year[0], week - 1]
+    if t + 1 >= window:
+        metrics[:, 2] = series[:, t + 1 - window:t + 1].sum(axis=1)
+    if t + 1 >= 2 * window:
+        metrics[:, 3] = series[:, t + 1 - 2 * window:t + 1 - window].sum(axis=1)
+
+    # 分類ごとの合計（疾病の行を分類コードで足し込む）
+    disease_categories = [categories.get(name, "") for name in cube.diseases]
+    category_names, codes = np.unique(np.array(disease_categories, dtype=str), return_inverse=True)
+    category_metrics = np.zeros((len(category_names), len(_METRICS)))
+    np.add.at(category_metrics, codes.reshape(-1), metrics)
+    disease_counts = np.bincount(codes.reshape(-1), minlength=len(category_names)).tolist()
+
+    recent_start = keys[t + 1 - window] if t + 1 >= window else None
+    previous = (keys[t + 1 - 2 * window], keys[t - window]) if t + 1 >= 2 * window else None
+    return {
+        "reference": _period(year, week),
+        "window_weeks": window,
+        "periods": {
+            "same_week_last_year": _period(year - 1, week) if len(last_year) else None,
+            "recent": {
+                "start": _period(int(recent_start // 100), int(recent_start % 100)),
+                "end": _period(year, week),
+            } if recent_start is not None else None,
+            "previous": {
+                "start": _period(int(previous[0] // 100), int(previous[0] % 100)),
+                "end": _period(int(previous[1] // 100), int(previous[1] % 100)),
+            } if previous is not None else None,
+        },
+        "sort": sort,
+        "diseases": _rows(cube.diseases, metrics, sort, "disease_name",
+                          [{"category": category} for category in disease_categories]),
+        "categories": _rows([str(name) for name in category_names], category_metrics, sort, "category",
+                            [{"disease_count": count} for count in disease_counts]),
+    }
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+/correlations エンドポイント用の疾病間相関・ラグ分析
+疾病・年・週ごとの合計から「週 × 疾病」の行列を1度だけ組み立て、
+全疾病の組み合わせの相関をラグ（週数）ごとに行列積1回で求めます。
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+# ラグを探索する最大週数の上限
+MAX_LAG_WEEKS = 26
+CORRELATION_DECIMALS = 4
+
+
+class WeeklyMatrix(NamedTuple):
+    """週 × 疾病の報告数の行列（報告のない週は0）"""
+    diseases: List[str]
+    years: np.ndarray
+    weeks: np.ndarray
+    values: np.ndarray
+
+
+class CorrelationResult(NamedTuple):
+    """
+    全疾病の組み合わせの相関
+    best[i, j] は疾病 i と、lag[i, j] 週後の疾病 j との相関（ラグ探索範囲内で最大のもの）
+    zero_lag[i, j] はラグなしの相関
+    """
+    diseases: List[str]
+    weeks: int
+    best: np.ndarray
+    lag: np.ndarray
+    zero_lag: np.ndarray
+
+
+def weekly_matrix(names: Sequence[str], totals: Dict[str, Sequence[int]]) -> WeeklyMatrix:
+    """
+    疾病・年・週ごとの合計（ColumnarTable / SQLiteStore の weekly_totals）から週 × 疾病の行列を作る
+    行はデータに現れる (年, 週) の昇順、列はデータに現れる疾病
+    """
+    diseases = np.asarray(totals['disease'], dtype=np.int64)
+    years = np.asarray(totals['year'], dtype=np.int64)
+    weeks = np.asarray(totals['week'], dtype=np.int64)
+    periods, rows = np.unique(years * 100 + weeks, return_inverse=True)
+    codes, columns = np.unique(diseases, return_inverse=True)
+    values = np.zeros((len(periods), len(codes)), dtype=np.float64)
+    values[rows.reshape(-1), columns.reshape(-1)] = np.asarray(totals['total'], dtype=np.float64)
+    return WeeklyMatrix([names[c] for c in codes.tolist()], periods // 100, periods % 100, values)
+
+
+def _standardize(values: np.ndarray) -> np.ndarray:
+    """列ごとに平均0・標準偏差1にする（変動のない列は NaN）"""
+    centered = values - values.mean(axis=0)
+    std = centered.std(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return centered / np.where(std > 0, std, np.nan)
+
+
+def lagged_correlations(matrix: WeeklyMatrix, max_lag: int = 0) -> CorrelationResult:
+    """
+    0〜max_lag 週のラグごとに全組み合わせの相関を求め、組み合わせごとに最も高い相関とそのラグを残す
+    ラグ k の相関行列 r[i, j] = corr(疾病 i の t 週, 疾病 j の t+k 週)。負のラグは転置で得られる
+    """
+    values = matrix.values
+    periods, count = values.shape
+    best = np.full((count, count), -np.inf)
+    lag = np.zeros((count, count), dtype=np.int64)
+    zero_lag = np.full((count, count), np.nan)
+    for k in range(min(max_lag, periods - 2) + 1):
+        leading = _standardize(values[:periods - k])
+        lagging = _standardize(values[k:])
+        r = leading.T @ lagging / (periods - k)
+        if k == 0:
+            zero_lag = r
+        # i が j より k 週先行する場合と、j が i より k 週先行する場合（転置）の両方を比べる
+        for candidate, sign in ((r, 1), (r.T, -1)):
+            better = candidate > best
+            best[better] = candidate[better]
+            lag[better] = sign * k
+    best[np.isinf(best)] = np.nan
+    return CorrelationResult(matrix.diseases, periods, best, lag, zero_lag)
+
+
+def correlation_pairs(result: CorrelationResult, diseases: Optional[Sequence[str]] = None,
+                      top: int = 20, min_correlation: Optional[float] = None) -> List[Dict]:
+    """
+    相関の高い組み合わせの一覧（相関の降順）
+    diseases を指定するとその疾病を含む組み合わせに限る。lag が正なら disease_a が先行する
+    """
+    count = len(result.diseases)
+    first, second = np.triu_indices(count, k=1)
+    if diseases:
+        index = {name: i for i, name in enumerate(result.diseases)}
+        selected = np.zeros(count, dtype=bool)
+        selected[[index[name] for name in diseases if name in index]] = True
+        keep = selected[first] | selected[second]
+        first, second = first[keep], second[keep]
+    values = result.best[first, second]
+    keep = ~np.isnan(values)
+    if min_correlation is not None:
+        keep &= values >= min_correlation
+    first, second, values = first[keep], second[keep], values[keep]
+    order = np.argsort(-values, kind='stable')[:top]
+
+    pairs = []
+    for i, j in zip(first[order].tolist(), second[order].tolist()):
+        pairs.append({
+            "disease_a": result.diseases[i],
+            "disease_b": result.diseases[j],
+            "correlation": round(float(result.best[i, j]), CORRELATION_DECIMALS),
+            "lag_weeks": int(result.lag[i, j]),
+            "correlation_at_zero_lag": round(float(result.zero_lag[i, j]), CORRELATION_DECIMALS),
+        })
+    return pairs
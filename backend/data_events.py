@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+データの版の変更を Server-Sent Events で配信する
+load_data が新しい版を公開するたびに、版と変わった疾病・週をまとめたイベントを1つ作り、
+接続中のクライアントすべてに送ります。待機中の接続は共有の asyncio.Event を待つだけなので、
+数千の接続でもスレッドやポーリングは増えません。
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+EVENT_NAME = "data_version"
+
+
+def format_event(event: Dict) -> str:
+    """SSEのイベント1件（id は版。再接続時の Last-Event-ID で受信済みかを判定する）"""
+    data = json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event['data_version']}\nevent: {EVENT_NAME}\ndata: {data}\n\n"
+
+
+class DataVersionBroadcaster:
+    """
+    最新のイベントを1件だけ保持し、公開時に待機中の接続をまとめて起こす
+    publish は読み込みを実行するワーカースレッドからも呼べる（イベントループ上で反映する）
+    """
+
+    def __init__(self, registry=None, keepalive_seconds: float = 25.0, retry_ms: int = 10000):
+        self.registry = registry
+        self.keepalive_seconds = keepalive_seconds
+        self.retry_ms = retry_ms
+        self.latest: Optional[Dict] = None
+        self.connections = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """配信に使うイベントループ（アプリの起動時に設定する）"""
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    def publish(self, data_version: str, previous_version: str, diseases: Optional[List[str]] = None,
+                weeks: Optional[List[Dict]] = None):
+        """
+        新しい版を公開する
+        diseases / weeks が None のときは変わった範囲が分からない（全体を取り直す）ことを表す
+        """
+        event = {
+            "data_version": data_version,
+            "previous_version": previous_version or None,
+            "published_at": datetime.now().isoformat(),
+            "full": diseases is None or weeks is None,
+            "diseases": diseases or [],
+            "weeks": weeks or [],
+        }
+        if self._loop is None or self._loop.is_closed():
+            self.latest = event
+            return
+        if _running_loop() is self._loop:
+            self._set_latest(event)
+        else:
+            self._loop.call_soon_threadsafe(self._set_latest, event)
+
+    def _set_latest(self, event: Dict):
+        self.latest = event
+        # 待機中の接続をすべて起こし、次の公開用に新しい Event に差し替える
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        if self.registry is not None:
+            self.registry.inc_counter("data_events_published_total", 1, "配信したデータの版の変更イベント数")
+
+    def _record_connections(self):
+        if self.registry is not None:
+            self.registry.set_gauge("data_events_connections", self.connections, "接続中のSSEクライアント数")
+
+    def open(self, last_event_id: Optional[str], max_connections: int) -> Optional["EventStream"]:
+        """
+        接続数が上限未満なら1接続分の枠を確保してイベント列を返す（上限に達していれば None）
+        確認と加算の間に await を挟まないため、同時に届いた接続が上限を超えることはない
+        """
+        if self.connections >= max_connections:
+            return None
+        self.connections += 1
+        self._record_connections()
+        return EventStream(self, last_event_id)
+
+    def _release(self):
+        self.connections -= 1
+        self._record_connections()
+
+
+class EventStream:
+    """
+    1接続分のイベント列（接続数の枠は確保済み）
+    枠は送信の終了時に返す。送信を始める前に接続が切れて破棄された場合も返す
+    """
+
+    def __init__(self, broadcaster: DataVersionBroadcaster, last_event_id: Optional[str]):
+        self._broadcaster = broadcaster
+        self._last_event_id = last_event_id
+        self._released = False
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._events()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._broadcaster._release()
+
+    def __del__(self):
+        self.release()
+
+    async def _events(self) -> AsyncIterator[str]:
+        """
+        接続時に最新の版を送り（Last-Event-ID が最新の版と同じなら送らない）、以降は公開のたびに送る。
+        公開がない間は keepalive のコメント行だけを送る
+        """
+        broadcaster = self._broadcaster
+        try:
+            yield f"retry: {broadcaster.retry_ms}\n\n"
+            sent = self._last_event_id
+            while True:
+                changed = broadcaster._changed
+                event = broadcaster.latest
+                if event is not None and event["data_version"] != sent:
+                    sent = event["data_version"]
+                    yield format_event(event)
+                    continue
+                if changed is None:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), broadcaster.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.release()
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
@@ -4,23 +4,34 @@
 CSVファイルを読み込み、統合されたデータセットを生成します。
 """
 
+import argparse
+import io
 import os
 import pandas as pd
 import json
 import re
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import logging
 
+from input_sources import InputSource, input_name, iter_input_files, read_input
+from partitions import PARTITION_DIR_NAME, write_partitioned_dataset
+from profiling import NULL_PROFILER, add_profile_arguments, profile_session, timed_lines
+from sqlite_store import SQLITE_FILE_NAME, write_sqlite_database
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class InfectiousDiseaseDataProcessor:
-    def __init__(self, csv_dir: str = "csv_list", output_dir: str = "processed_data"):
+    def __init__(self, csv_dir: str = "csv_list", output_dir: str = "processed_data", profiler=None,
+                 partition_by_category: bool = False):
         self.csv_dir = csv_dir
         self.output_dir = output_dir
         self.disease_categories = self._load_disease_categories()
+        self.profiler = profiler or NULL_PROFILER
+        self.partition_by_category = partition_by_category
         
         # 出力ディレクトリ作成
         os.makedirs(self.output_dir, exist_ok=True)
@@ -66,27 +77,25 @@ class InfectiousDiseaseDataProcessor:
     
     def _extract_date_from_filename(self, filename: str) -> Optional[tuple]:
         """ファイル名から年と週番号を抽出"""
-        pattern = r'notifiable_weekly_(\d{4})_(\d+)_\d+_raw\.csv'
+        # notifiable_weekly_2000_1_20250703_031821_raw.csv の形式
+        pattern = r'notifiable_weekly_(\d{4})_(\d+)_\d+_\d+_raw\.csv'
         match = re.match(pattern, filename)
         if match:
             return int(match.group(1)), int(match.group(2))
         return None
     
     def _week_to_date(self, year: int, week: int) -> datetime:
-        """年と週番号から日付を計算"""
-        # 年の1月1日を基準に週数を計算
-        jan1 = datetime(year, 1, 1)
-        # 1月1日の曜日を考慮して週の開始日を計算
-        days_to_first_monday = (7 - jan1.weekday()) % 7
-        first_monday = jan1 + timedelta(days=days_to_first_monday)
-        target_date = first_monday + timedelta(weeks=week-1)
-        return target_date
+        """年とISO週番号から、その週の月曜日の日付を計算"""
+        # 第1週は1月4日を含む週（月曜始まり）
+        jan4 = datetime(year, 1, 4)
+        week1_monday = jan4 - timedelta(days=jan4.weekday())
+        return week1_monday + timedelta(weeks=week-1)
     
-    def process_csv_file(self, filepath: str) -> Optional[pd.DataFrame]:
-        """単一のCSVファイルを処理"""
+    def process_csv_file(self, filepath: InputSource) -> Optional[pd.DataFrame]:
+        """単一のCSVファイル（パスまたはアーカイブのメンバー）を処理"""
         try:
             # ファイル名から年と週を抽出
-            filename = os.path.basename(filepath)
+            filename = input_name(filepath)
             date_info = self._extract_date_from_filename(filename)
             if not date_info:
                 logger.warning(f"日付情報を抽出できませんでした: {filename}")
@@ -96,44 +105,57 @@ class InfectiousDiseaseDataProcessor:
             report_date = self._week_to_date(year, week)
             
             # CSVファイルを読み込み（Shift-JIS エンコーディング）
-            with open(filepath, 'r', encoding='shift_jis') as f:
-                lines = f.readlines()
+            with self.profiler.stage('read'):
+                raw = read_input(filepath)
+            # 全体を文字列や行のリストにせず、先頭から順にデコードしながら読む
+            # （decode の時間はヘッダー探索・行の解析のステージから除いて記録する）
+            lines = timed_lines(io.TextIOWrapper(io.BytesIO(raw), encoding='shift_jis'), self.profiler.timer('decode'))
             
             # 疾病データの開始行を見つける
-            data_start = None
-            for i, line in enumerate(lines):
-                if '疾病名' in line and '報告数' in line:
-                    data_start = i + 1
-                    break
+            with self.profiler.stage('header_search'):
+                data_start = None
+                for i, line in enumerate(lines):
+                    if '疾病名' in line and '報告数' in line:
+                        data_start = i + 1
+                        break
             
             if data_start is None:
                 logger.warning(f"疾病データが見つかりませんでした: {filename}")
                 return None
             
             # 疾病データを抽出
-            disease_data = []
-            for line in lines[data_start:]:
-                line = line.strip()
-                if line and ',' in line:
-                    parts = line.split(',')
-                    if len(parts) >= 2:
-                        disease_name = parts[0].strip('"')
-                        try:
-                            count = int(parts[1].strip('"'))
-                            if disease_name:  # 空の疾病名は除外
-                                disease_data.append({
-                                    'disease_name': disease_name,
-                                    'count': count,
-                                    'year': year,
-                                    'week': week,
-                                    'report_date': report_date,
-                                    'category': self._get_disease_category(disease_name)
-                                })
-                        except ValueError:
-                            continue
+            # 分類の判定は行ごとに stage() で囲むと計測の負荷で結果が歪むため、時間を合計してファイルごとに記録する
+            # （row_parse の中で記録し、row_parse の時間からは除く）
+            categorize_seconds = 0.0
+            with self.profiler.stage('row_parse'):
+                disease_data = []
+                for line in lines:
+                    line = line.strip()
+                    if line and ',' in line:
+                        parts = line.split(',')
+                        if len(parts) >= 2:
+                            disease_name = parts[0].strip('"')
+                            try:
+                                count = int(parts[1].strip('"'))
+                                if disease_name:  # 空の疾病名は除外
+                                    categorize_start = time.perf_counter()
+                                    category = self._get_disease_category(disease_name)
+                                    categorize_seconds += time.perf_counter() - categorize_start
+                                    disease_data.append({
+                                        'disease_name': disease_name,
+                                        'count': count,
+                                        'year': year,
+                                        'week': week,
+                                        'report_date': report_date,
+                                        'category': category
+                                    })
+                            except ValueError:
+                                continue
+                self.profiler.add_time('categorize', categorize_seconds)
             
             if disease_data:
-                return pd.DataFrame(disease_data)
+                with self.profiler.stage('frame_build'):
+                    return pd.DataFrame(disease_data)
             else:
                 logger.warning(f"有効な疾病データが見つかりませんでした: {filename}")
                 return None
@@ -153,24 +175,35 @@ class InfectiousDiseaseDataProcessor:
         """すべてのCSVファイルを処理"""
         logger.info("CSVファイルの処理を開始します...")
         
-        csv_files = [f for f in os.listdir(self.csv_dir) if f.endswith('_raw.csv')]
-        logger.info(f"処理対象ファイル数: {len(csv_files)}")
+        # アーカイブ内のメンバーは展開せずに順に読み込むため、件数は処理しながら数える
+        csv_files = iter_input_files(
+            self.csv_dir, lambda name: name.startswith('notifiable_weekly_') and name.endswith('_raw.csv')
+        )
         
         all_data = []
         processed_count = 0
+        file_count = 0
         
-        for filename in csv_files:
-            filepath = os.path.join(self.csv_dir, filename)
-            df = self.process_csv_file(filepath)
+        while True:
+            with self.profiler.stage('list_files'):
+                source = next(csv_files, None)
+            if source is None:
+                break
+            file_count += 1
+            file_start, file_cpu_start = time.perf_counter(), time.process_time()
+            df = self.process_csv_file(source)
+            self.profiler.record_file(input_name(source), time.perf_counter() - file_start, time.process_time() - file_cpu_start)
             if df is not None:
                 all_data.append(df)
                 processed_count += 1
                 
                 if processed_count % 100 == 0:
-                    logger.info(f"処理済み: {processed_count}/{len(csv_files)}")
+                    logger.info(f"処理済み: {processed_count}")
+        logger.info(f"処理対象ファイル数: {file_count}")
         
         if all_data:
-            combined_df = pd.concat(all_data, ignore_index=True)
+            with self.profiler.stage('concat'):
+                combined_df = pd.concat(all_data, ignore_index=True)
             logger.info(f"統合完了: {len(combined_df)} レコード")
             return combined_df
         else:
@@ -205,40 +238,72 @@ class InfectiousDiseaseDataProcessor:
         
         # メインデータセットを保存
         main_file = os.path.join(self.output_dir, 'infectious_diseases_data.csv')
-        df.to_csv(main_file, index=False, encoding='utf-8')
+        with self.profiler.stage('write_main_csv'):
+            df.to_csv(main_file, index=False, encoding='utf-8')
         logger.info(f"メインデータセットを保存しました: {main_file}")
         
         # サマリー統計を保存
-        summary = self.generate_summary_statistics(df)
+        with self.profiler.stage('summary'):
+            summary = self.generate_summary_statistics(df)
         summary_file = os.path.join(self.output_dir, 'summary_statistics.json')
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2)
+        with self.profiler.stage('json_dump'):
+            with open(summary_file, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
         logger.info(f"サマリー統計を保存しました: {summary_file}")
         
         # 疾病リストを保存
-        disease_list = sorted(df['disease_name'].unique().tolist())
+        with self.profiler.stage('disease_list'):
+            disease_list = sorted(df['disease_name'].unique().tolist())
         disease_file = os.path.join(self.output_dir, 'disease_list.json')
-        with open(disease_file, 'w', encoding='utf-8') as f:
-            json.dump(disease_list, f, ensure_ascii=False, indent=2)
+        with self.profiler.stage('json_dump'):
+            with open(disease_file, 'w', encoding='utf-8') as f:
+                json.dump(disease_list, f, ensure_ascii=False, indent=2)
         logger.info(f"疾病リストを保存しました: {disease_file}")
         
-        # 年別データを保存
-        for year in df['year'].unique():
-            year_df = df[df['year'] == year]
-            year_file = os.path.join(self.output_dir, f'data_{year}.csv')
-            year_df.to_csv(year_file, index=False, encoding='utf-8')
+        # SQLiteデータベースを保存（APIサーバーの STORAGE_BACKEND=sqlite 用）
+        sqlite_file = os.path.join(self.output_dir, SQLITE_FILE_NAME)
+        with self.profiler.stage('sqlite'):
+            write_sqlite_database(sqlite_file, zip(
+                df['disease_name'].tolist(),
+                df['count'].tolist(),
+                df['year'].tolist(),
+                df['week'].tolist(),
+                df['report_date'].dt.strftime('%Y-%m-%d').tolist(),
+                df['category'].tolist()
+            ))
+        logger.info(f"SQLiteデータベースを保存しました: {sqlite_file}")
+        
+        # 年別（任意で分類別）のパーティションを1回の走査で保存
+        partition_dir = os.path.join(self.output_dir, PARTITION_DIR_NAME)
+        with self.profiler.stage('partitions'):
+            index = write_partitioned_dataset(partition_dir, zip(
+                df['disease_name'].tolist(),
+                df['count'].tolist(),
+                df['year'].tolist(),
+                df['week'].tolist(),
+                df['report_date'].dt.strftime('%Y-%m-%d').tolist(),
+                df['category'].tolist()
+            ), by_category=self.partition_by_category)
+        logger.info(f"パーティションを保存しました: {partition_dir} ({len(index['partitions'])} パーティション)")
         
         logger.info("データ処理が完了しました")
 
 def main():
     """メイン実行関数"""
-    processor = InfectiousDiseaseDataProcessor()
-    
-    # すべてのファイルを処理
-    df = processor.process_all_files()
+    parser = argparse.ArgumentParser(description="東京都感染症データ処理")
+    parser.add_argument('--partition-by-category', action='store_true',
+                        help='パーティションを年に加えて感染症分類でも分割する')
+    add_profile_arguments(parser, os.path.join("processed_data", "profile_report.json"))
+    args = parser.parse_args()
     
-    # 処理済みデータを保存
-    processor.save_processed_data(df)
+    with profile_session(args, "data_processor") as profiler:
+        processor = InfectiousDiseaseDataProcessor(profiler=profiler, partition_by_category=args.partition_by_category)
+        
+        # すべてのファイルを処理
+        df = processor.process_all_files()
+        
+        # 処理済みデータを保存
+        processor.save_processed_data(df)
     
     print("\n=== 処理結果 ===")
     if not df.empty:
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+処理済みデータセットのレジストリ
+processed_data/ 内のデータセット（CSV・年別パーティションなど）を見つけて登録し、
+初回アクセス時に読み込みます。読み込み済みデータセットのメモリ使用量を記録し、
+合計がメモリ予算を超えたら最後に参照されてから最も時間が経ったものから解放します（LRU）。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from partitions import PARTITION_DIR_NAME, read_partition_index
+
+logger = logging.getLogger(__name__)
+
+
+def load_csv_table(path: str):
+    """CSVをDataFrameとして読み込む（文字列列はカテゴリ型にして重複文字列を持たない）"""
+    import pandas as pd
+
+    df = pd.read_csv(path)
+    for column in df.columns:
+        if df[column].dtype == object or str(df[column].dtype) in ('str', 'string'):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def value_nbytes(value: Any) -> int:
+    """読み込んだデータセットのメモリ使用量（バイト）"""
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    nbytes = getattr(value, 'nbytes', 0)
+    return int(nbytes() if callable(nbytes) else nbytes)
+
+
+class DatasetEntry:
+    """登録済みのデータセット（value は読み込むまで None）"""
+
+    __slots__ = ('name', 'path', 'kind', 'loader', 'signature', 'value', 'nbytes', 'loaded_at', 'hits', 'lock')
+
+    def __init__(self, name: str, path: str, kind: str, loader: Callable[[str], Any]):
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.loader = loader
+        self.signature = _file_signature(path)
+        self.value = None
+        self.nbytes = 0
+        self.loaded_at: Optional[float] = None
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def describe(self) -> Dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "path": self.path,
+            "file_bytes": self.signature[1] if self.signature else None,
+            "loaded": self.value is not None,
+            "memory_bytes": self.nbytes if self.value is not None else None,
+            "hits": self.hits,
+        }
+
+
+def _file_signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class DatasetRegistry:
+    """
+    名前からデータセットを引くレジストリ（スレッドセーフ）
+    読み込みはデータセットごとのロックで1度だけ行い、読み込み済みのものはLRU順に保持する
+    """
+
+    def __init__(self, memory_budget_bytes: int, registry=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.registry = registry
+        self._entries: Dict[str, DatasetEntry] = {}
+        # 読み込み済みのデータセット（末尾が最後に参照されたもの）
+        self._resident: "OrderedDict[str, DatasetEntry]" = OrderedDict()
+        # 直前の discover で登録した名前（次の discover で見つからなければ外す）
+        self._discovered: set = set()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, path: str, loader: Callable[[str], Any], kind: str = "table"):
+        """データセットを登録（同じ名前・同じファイルのものは読み込み済みの内容を引き継ぐ）"""
+        entry = DatasetEntry(name, path, kind, loader)
+        with self._lock:
+            previous = self._entries.get(name)
+            if previous is not None and previous.path == path and previous.signature == entry.signature:
+                return
+            self._entries[name] = entry
+            if previous is not None:
+                self._resident.pop(name, None)
+
+    def discover(self, data_dir: str, loaders: Optional[Dict[str, Tuple[Callable[[str], Any], str]]] = None,
+                 exclude: Iterable[str] = ()) -> int:
+        """
+        data_dir 内のデータセットを登録し直す（消えたファイルの登録は外す）
+        直下のファイルは拡張子ごとの (読み込み関数, 種類)（既定はCSVのみ）でファイル名（拡張子なし）の名前に、
+        年別パーティションは 'partitions/year=2020'、分類別に分割したものは 'partitions/year=2020/category-05'
+        （パーティションのパスから拡張子を除いたもの）の形の名前で登録する
+        exclude のファイル名（APIが別の形で保持しているメインデータなど）は登録しない
+        """
+        loaders = loaders or {'.csv': (load_csv_table, "table")}
+        excluded = set(exclude)
+        found = set()
+        if os.path.isdir(data_dir):
+            for entry in sorted(os.listdir(data_dir)):
+                path = os.path.join(data_dir, entry)
+                name, suffix = os.path.splitext(entry)
+                if suffix in loaders and entry not in excluded and os.path.isfile(path):
+                    loader, kind = loaders[suffix]
+                    self.register(name, path, loader, kind=kind)
+                    found.add(name)
+
+        partition_dir = os.path.join(data_dir, PARTITION_DIR_NAME)
+        index = read_partition_index(partition_dir)
+        for partition in (index or {}).get('partitions', []):
+            # 年別は1年1ファイルなので年のディレクトリ名、分類別は同じ年に複数あるためファイル名まで含める
+            relative = partition['path'] if partition.get('category') is not None else os.path.dirname(partition['path'])
+            name = f"{PARTITION_DIR_NAME}/{os.path.splitext(relative)[0]}"
+            self.register(name, os.path.join(partition_dir, partition['path']), load_csv_table, kind="partition")
+            found.add(name)
+
+        with self._lock:
+            for name in self._discovered - found:
+                self._entries.pop(name, None)
+                self._resident.pop(name, None)
+            self._discovered = found
+        self._record_resident()
+        return len(found)
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def get(self, name: str) -> Any:
+        """データセットを返す（未読み込みなら読み込み、予算を超えた分は古いものから解放）。未登録なら KeyError"""
+        with self._lock:
+            entry = self._entries[name]
+            if entry.value is not None:
+                self._resident.move_to_end(name)
+                entry.hits += 1
+                self._record_cache(True)
+                return entry.value
+
+        # 同じデータセットの同時アクセスは1度だけ読み込む
+        with entry.lock:
+            value = entry.value
+            if value is None:
+                started = time.perf_counter()
+                value = entry.loader(entry.path)
+                nbytes = value_nbytes(value)
+                seconds = time.perf_counter() - started
+                logger.info(f"データセットを読み込みました: {name} ({nbytes:,} バイト, {seconds * 1000:.0f}ms)")
+                if self.registry is not None:
+                    self.registry.inc_counter("dataset_registry_loads_total", 1, "データセットの読み込み回数", dataset=name)
+                self._record_cache(False)
+                with self._lock:
+                    entry.value = value
+                    entry.nbytes = nbytes
+                    entry.loaded_at = time.time()
+                    if self._entries.get(name) is entry:
+                        self._resident[name] = entry
+                        self._evict(keep=name)
+            else:
+                self._record_cache(True)
+            entry.hits += 1
+            return value
+
+    def _evict(self, keep: str):
+        """合計が予算に収まるまで、最後の参照が古いものから解放する（呼び出し側で self._lock を保持）"""
+        total = sum(e.nbytes for e in self._resident.values())
+        for name in list(self._resident):
+            if total <= self.memory_budget_bytes:
+                break
+            if name == keep:
+                continue
+            entry = self._resident.pop(name)
+            total -= entry.nbytes
+            entry.value = None
+            logger.info(f"データセットを解放しました: {name} ({entry.nbytes:,} バイト)")
+            if self.registry is not None:
+                self.registry.inc_counter("dataset_registry_evictions_total", 1, "メモリ予算による解放の回数", dataset=name)
+        if total > self.memory_budget_bytes:
+            logger.warning(f"データセットがメモリ予算を超えています: {total:,} / {self.memory_budget_bytes:,} バイト")
+        self._record_resident(total)
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes for e in self._resident.values())
+
+    def describe(self) -> List[Dict]:
+        with self._lock:
+            return [self._entries[name].describe() for name in sorted(self._entries)]
+
+    def _record_cache(self, hit: bool):
+        if self.registry is not None:
+            self.registry.record_cache("dataset_registry", hit)
+
+    def _record_resident(self, total: Optional[int] = None):
+        if self.registry is None:
+            return
+        if total is None:
+            total = self.resident_bytes()
+        self.registry.set_gauge("dataset_registry_resident_bytes", total, "レジストリで読み込み済みのデータセットの合計サイズ（バイト）")
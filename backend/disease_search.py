@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+/diseases/search エンドポイント用の疾病名検索インデックス
+疾病名を正規化（NFKC・英字の大文字小文字・カタカナとひらがな）したうえで、
+先頭一致用のソート済み配列と文字n-gram（1文字・2文字）の転置インデックスを読み込み時に1度だけ作成します。
+検索時は候補の積集合をとって部分一致を確かめるだけなので、疾病数や入力の長さによらず短時間で応答します。
+"""
+
+import bisect
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+# カタカナ（ァ〜ヶ）をひらがなに寄せる変換表
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+SEARCH_MAX_LIMIT = 100
+
+
+def normalize_name(text: str) -> str:
+    """
+    検索用の正規化
+    全角英数字・半角カナは NFKC で揃え、英字は小文字、カタカナはひらがなにし、空白は除く
+    （例: 'Ａ群溶血性レンサ球菌咽頭炎' → 'a群溶血性れんさ球菌咽頭炎'）
+    """
+    normalized = unicodedata.normalize('NFKC', text).casefold().translate(_KATAKANA_TO_HIRAGANA)
+    return "".join(normalized.split())
+
+
+class SearchEntry(NamedTuple):
+    disease_name: str
+    total_count: int
+    category: str
+    source: str
+
+
+class DiseaseSearchIndex:
+    """
+    疾病名の検索インデックス
+    結果は先頭一致を部分一致より前に並べ、それぞれ報告数の合計の降順（同数は疾病名順）
+    """
+
+    def __init__(self, entries: Iterable[SearchEntry]):
+        # 報告数の多い順に番号を振り、番号の小さい順をそのまま並び順に使う
+        self.entries: List[SearchEntry] = sorted(entries, key=lambda e: (-e.total_count, e.disease_name, e.source))
+        self._names = [normalize_name(e.disease_name) for e in self.entries]
+        self._prefix = sorted((name, i) for i, name in enumerate(self._names))
+        self._prefix_keys = [name for name, _ in self._prefix]
+        self._grams: Dict[str, Set[int]] = {}
+        for i, name in enumerate(self._names):
+            for size in (1, 2):
+                for start in range(len(name) - size + 1):
+                    self._grams.setdefault(name[start:start + size], set()).add(i)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _prefix_matches(self, query: str) -> List[int]:
+        start = bisect.bisect_left(self._prefix_keys, query)
+        # query の直後の文字列（末尾に最大のコードポイントを足したもの）までが先頭一致
+        stop = bisect.bisect_left(self._prefix_keys, query + '\U0010ffff', start)
+        return [i for _, i in self._prefix[start:stop]]
+
+    def _substring_matches(self, query: str) -> Set[int]:
+        if len(query) == 1:
+            return self._grams.get(query, set())
+        postings = []
+        for start in range(len(query) - 1):
+            posting = self._grams.get(query[start:start + 2])
+            if not posting:
+                return set()
+            postings.append(posting)
+        # 小さい集合から積をとり、2文字の並びが飛び飛びに一致しただけの候補は部分一致で確かめる
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                return candidates
+        return {i for i in candidates if query in self._names[i]}
+
+    def search(self, query: str, limit: int = 10, source: Optional[str] = None) -> Dict:
+        """検索して {'normalized': 正規化した入力, 'total_matches': 件数, 'results': [...]} を返す"""
+        normalized = normalize_name(query)
+        if normalized:
+            prefix = self._prefix_matches(normalized)
+            ranked = sorted(prefix) + sorted(self._substring_matches(normalized).difference(prefix))
+        else:
+            # 入力が空なら報告数の多い順
+            prefix = []
+            ranked = range(len(self.entries))
+        if source is not None:
+            ranked = [i for i in ranked if self.entries[i].source == source]
+        prefix_set = set(prefix)
+        results = []
+        for i in ranked[:limit]:
+            match = 'prefix' if i in prefix_set else 'substring' if normalized else None
+            results.append(dict(self.entries[i]._asdict(), match=match))
+        return {"normalized": normalized, "total_matches": len(ranked), "results": results}
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+/export.xlsx エンドポイント用のExcelブック作成
+openpyxl の書き込み専用モードで行をバッチ単位で追記し、ブックのモデルをメモリに保持せずに作成します。
+出力先は一定サイズまでメモリ、それを超えるとディスクに書き出す一時ファイル（SpooledTemporaryFile）です。
+"""
+
+import tempfile
+from datetime import date
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from export import EXPORT_COLUMNS
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# この大きさまではメモリ上に保持し、超えたら一時ファイルに書き出す
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+# 応答時に一時ファイルから読み出す単位
+READ_CHUNK_BYTES = 64 * 1024
+# Excelの1シートの最大行数（見出し行を含む）。超えた分は続きのシートに書く
+MAX_SHEET_ROWS = 1048576
+SHEET_TITLE_MAX_LENGTH = 31
+INVALID_TITLE_CHARACTERS = '[]:*?/\\'
+
+HEADERS = {
+    'disease_name': '疾病名',
+    'count': '報告数',
+    'year': '年',
+    'week': '週',
+    'report_date': '報告日',
+    'category': '分類',
+}
+
+
+def sheet_title(name: str, used: set) -> str:
+    """Excelのシート名の制約（31文字以内・使用できない文字・重複不可）に合わせる"""
+    base = "".join('_' if c in INVALID_TITLE_CHARACTERS else c for c in name).strip("'") or "Sheet"
+    title = base[:SHEET_TITLE_MAX_LENGTH]
+    number = 2
+    while title.lower() in used:
+        suffix = f" ({number})"
+        title = base[:SHEET_TITLE_MAX_LENGTH - len(suffix)] + suffix
+        number += 1
+    used.add(title.lower())
+    return title
+
+
+def write_workbook(output, sheets: Iterable[Tuple[str, Callable[[], Iterable[List[tuple]]]]]) -> Dict[str, int]:
+    """
+    シートごとの行バッチをブックに書き込む
+    sheets は (シート名, バッチを返す関数) の並び。シートを書く直前に呼び出すので、同時に保持するのは1バッチ分だけ
+    戻り値はシート名ごとの行数
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    workbook = Workbook(write_only=True)
+    used_titles: set = set()
+    row_counts: Dict[str, int] = {}
+    header = [HEADERS[name] for name in EXPORT_COLUMNS]
+    date_index = EXPORT_COLUMNS.index('report_date')
+    dates: Dict[str, date] = {}
+
+    def new_sheet(name: str):
+        title = sheet_title(name, used_titles)
+        worksheet = workbook.create_sheet(title=title)
+        worksheet.freeze_panes = 'A2'
+        header_cells = []
+        for value in header:
+            cell = WriteOnlyCell(worksheet, value=value)
+            cell.font = Font(bold=True)
+            header_cells.append(cell)
+        worksheet.append(header_cells)
+        row_counts[title] = 0
+        return worksheet, title
+
+    for name, batches in sheets:
+        worksheet, title = new_sheet(name)
+        for batch in batches():
+            for row in batch:
+                if row_counts[title] >= MAX_SHEET_ROWS - 1:
+                    worksheet, title = new_sheet(name)
+                row = list(row)
+                # 日付はExcelの日付セルとして書き込む（変換結果は日付ごとに使い回す）
+                day = row[date_index]
+                converted = dates.get(day)
+                if converted is None:
+                    converted = dates[day] = date.fromisoformat(day[:10])
+                row[date_index] = converted
+                worksheet.append(row)
+                row_counts[title] += 1
+
+    if not row_counts:
+        # シートが1枚もないブックは開けないため、見出しだけのシートを作る
+        new_sheet("データなし")
+    workbook.save(output)
+    return row_counts
+
+
+def build_workbook_file(sheets: Iterable[Tuple[str, Callable[[], Iterable[List[tuple]]]]]):
+    """ブックを一時ファイルに書き出し、(先頭に巻き戻したファイル, バイト数, シート別行数) を返す"""
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix=".xlsx")
+    try:
+        row_counts = write_workbook(output, sheets)
+        size = output.seek(0, 2)
+        output.seek(0)
+    except Exception:
+        output.close()
+        raise
+    return output, size, row_counts
+
+
+def iter_file(output, chunk_size: int = READ_CHUNK_BYTES) -> Iterator[bytes]:
+    """一時ファイルを読み出して送信し、終わったら閉じる"""
+    try:
+        while True:
+            chunk = output.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        output.close()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+/export エンドポイント用のストリーミング出力
+レコードを一定件数ずつのバッチで取り出し、CSVまたはNDJSONに変換しながら送信します。
+結果全体を組み立てないため、エクスポートの件数によらずメモリ使用量は一定です。
+（simple_main.py からも使うため、numpy は列配列を扱う関数の中でだけimportします）
+"""
+
+import csv
+import io
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ['disease_name', 'count', 'year', 'week', 'report_date', 'category']
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+# 1回に変換・送信する行数
+BATCH_ROWS = 5000
+# 出力順はどのバックエンドでも 疾病名 → 報告日（同じ疾病・日付の行は元データの順）
+
+# (disease_name, count, year, week, report_date 'YYYY-MM-DD', category)
+ExportRow = Tuple[str, int, int, int, str, str]
+
+
+def export_sort_key(row: ExportRow) -> Tuple[str, str]:
+    """行を出力順に並べるキー（安定ソートで使う）"""
+    return row[0], row[4]
+
+
+def record_order(columns: Dict[str, "np.ndarray"]) -> "np.ndarray":
+    """
+    コード化した列配列の行を出力順に並べる添字
+    コード表が名前・日付の昇順であること（カテゴリ型・factorize(sort=True) の結果はそうなる）
+    """
+    import numpy as np
+    
+    return np.lexsort((columns['report_date'], columns['disease_name']))
+
+
+def batched(rows: Iterable[ExportRow], size: int = BATCH_ROWS) -> Iterator[List[ExportRow]]:
+    """行をバッチにまとめる"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_coded_batches(columns: Dict[str, "np.ndarray"], code_tables: Dict[str, List[str]],
+                       start: int = 0, stop: Optional[int] = None,
+                       disease_code: Optional[int] = None, category_code: Optional[int] = None,
+                       start_year: Optional[int] = None, end_year: Optional[int] = None,
+                       size: int = BATCH_ROWS, order: Optional["np.ndarray"] = None) -> Iterator[List[ExportRow]]:
+    """
+    コード化した列配列の [start, stop) の範囲をバッチ単位で絞り込み、行に戻す
+    disease_name / category / report_date はコード表（日付は 'YYYY-MM-DD'）へのコード
+    order（record_order の結果）を渡すと、その順の [start, stop) 番目の行を返す
+    """
+    import numpy as np
+    
+    stop = len(columns['count']) if stop is None else stop
+    diseases = code_tables['disease_name']
+    categories = code_tables['category']
+    dates = code_tables['report_date']
+    for offset in range(start, stop, size):
+        chunk = slice(offset, min(offset + size, stop))
+        if order is not None:
+            chunk = order[chunk]
+        years = columns['year'][chunk]
+        mask = np.ones(len(years), dtype=bool)
+        if disease_code is not None:
+            mask &= columns['disease_name'][chunk] == disease_code
+        if category_code is not None:
+            mask &= columns['category'][chunk] == category_code
+        if start_year:
+            mask &= years >= start_year
+        if end_year:
+            mask &= years <= end_year
+        if not mask.any():
+            continue
+        yield [
+            (diseases[d], c, y, w, dates[r], categories[k])
+            for d, c, y, w, r, k in zip(
+                columns['disease_name'][chunk][mask].tolist(),
+                columns['count'][chunk][mask].tolist(),
+                years[mask].tolist(),
+                columns['week'][chunk][mask].tolist(),
+                columns['report_date'][chunk][mask].tolist(),
+                columns['category'][chunk][mask].tolist(),
+            )
+        ]
+
+
+def coded_columns_from_dataframe(df) -> Tuple[Dict[str, "np.ndarray"], Dict[str, List[str]]]:
+    """カテゴリ型のDataFrameから列配列とコード表を取り出す（コード列はコピーしない）"""
+    columns = {}
+    code_tables = {}
+    for name in ('disease_name', 'category', 'report_date'):
+        values = df[name].astype('category')
+        columns[name] = values.cat.codes.to_numpy()
+        if name == 'report_date':
+            code_tables[name] = values.cat.categories.strftime('%Y-%m-%d').tolist()
+        else:
+            code_tables[name] = [str(v) for v in values.cat.categories]
+    for name in ('count', 'year', 'week'):
+        columns[name] = df[name].to_numpy()
+    return columns, code_tables
+
+
+def export_metrics_recorder(registry, export_format: str) -> Callable[[int, float], None]:
+    """エクスポートの行数とスループットをメトリクスに記録する関数を返す"""
+    def record(rows: int, seconds: float):
+        registry.inc_counter("export_rows_total", rows, "エクスポートした行数", format=export_format)
+        if seconds > 0:
+            registry.set_gauge(
+                "export_rows_per_second", rows / seconds,
+                "直近のエクスポートのスループット（行/秒）", format=export_format
+            )
+    return record
+
+
+def _csv_chunks(batches: Iterable[List[ExportRow]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(batches: Iterable[List[ExportRow]]) -> Iterator[str]:
+    # 行ごとに辞書を作らず、文字列値だけをJSONエンコードしてテンプレートに埋め込む
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    template = "{{" + ",".join(f'"{name}":{{}}' for name in EXPORT_COLUMNS) + "}}\n"
+    for batch in batches:
+        yield "".join(
+            template.format(encode(d), c, y, w, encode(r), encode(k))
+            for d, c, y, w, r, k in batch
+        )
+
+
+def stream_export(batches: Iterable[List[ExportRow]], export_format: str,
+                  on_complete: Optional[Callable[[int, float], None]] = None) -> Iterator[bytes]:
+    """
+    バッチを指定形式のバイト列に変換しながら返すジェネレーター
+    送信完了時に on_complete(行数, 秒数) を呼ぶ（スループットの記録用）
+    """
+    rows = 0
+    started = time.perf_counter()
+
+    def counted():
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch)
+            yield batch
+
+    chunks = _csv_chunks(counted()) if export_format == 'csv' else _ndjson_chunks(counted())
+    for chunk in chunks:
+        yield chunk.encode('utf-8')
+
+    seconds = time.perf_counter() - started
+    logger.info(f"エクスポート完了: {rows} 行, {rows / seconds if seconds else 0:,.0f} 行/秒 ({export_format})")
+    if on_complete is not None:
+        on_complete(rows, seconds)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+/forecast エンドポイント用の季節ベースライン予測
+疾病 × 年 × 週の季節性キューブから、全疾病の今後数週間の期待報告数と予測区間を一括で求めます。
+期待値は過去数年の同じ週（前後1週を含む）の平均に、直近の実績と過去平均の比（トレンド）を掛けたものです。
+疾病ごとのループはなく、予測する週ごとに全疾病分を配列演算で計算します。
+"""
+
+import json
+import os
+import warnings
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from seasonality import SeasonalityCube
+from shared_dataset import write_json_atomic
+
+FORECAST_HORIZON_WEEKS = 4
+# 同じ週の平均に使う過去の年数と、前後に含める週数
+HISTORY_YEARS = 5
+HISTORY_WEEK_WINDOW = 1
+# トレンド（直近の実績 / 過去平均）を求める週数と、その上下限
+TREND_WEEKS = 8
+TREND_LIMITS = (0.25, 4.0)
+# 予測区間（正規近似の95%区間）
+INTERVAL_Z = 1.96
+FORECAST_DECIMALS = 1
+FORECAST_FILE_PREFIX = "forecast_"
+# 保存する予測の形式（変えたら上げる。形式の異なる保存済みの予測は使わずに作り直す）
+FORECAST_FORMAT = 2
+# 予測方法（疾病ごとの method は、週によって方法が異なれば mixed）
+SEASONAL_METHOD = "seasonal_baseline"
+RECENT_METHOD = "recent_mean"
+MIXED_METHOD = "mixed"
+
+
+def weeks_in_year(year: int) -> int:
+    """ISO年の週数（52 または 53）"""
+    return date(year, 12, 28).isocalendar()[1]
+
+
+def next_weeks(year: int, week: int, horizon: int) -> List[Tuple[int, int]]:
+    """(年, 週) の次の週から horizon 週分"""
+    weeks = []
+    for _ in range(horizon):
+        week += 1
+        if week > weeks_in_year(year):
+            year, week = year + 1, 1
+        weeks.append((year, week))
+    return weeks
+
+
+def _same_week_history(cube: SeasonalityCube, year: int, week: int,
+                       history_years: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """全疾病の、year より前の history_years 年の同じ週（前後の週を含む）の平均・標準偏差・データ数"""
+    years = (cube.years >= year - history_years) & (cube.years < year)
+    weeks = np.arange(week - HISTORY_WEEK_WINDOW, week + HISTORY_WEEK_WINDOW + 1)
+    weeks = weeks[(weeks >= 1) & (weeks <= cube.values.shape[2])] - 1
+    cells = cube.values[:, years][:, :, weeks].reshape(len(cube.diseases), -1)
+    counts = (~np.isnan(cells)).sum(axis=1)
+    with warnings.catch_warnings():
+        # データのない疾病は NaN のままにする
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(cells, axis=1), np.nanstd(cells, axis=1), counts
+
+
+def _round(values: np.ndarray) -> List[float]:
+    return np.round(values, FORECAST_DECIMALS).tolist()
+
+
+def seasonal_forecast(cube: SeasonalityCube, horizon: int = FORECAST_HORIZON_WEEKS,
+                      history_years: int = HISTORY_YEARS, trend_weeks: int = TREND_WEEKS) -> List[Dict]:
+    """
+    キューブの全疾病について、データの最終週の翌週から horizon 週分を予測する
+    同じ週の過去データが2件未満の週は、直近 trend_weeks 週の平均（トレンドなし）で予測する
+    予測方法は週ごとに method に示し、疾病の method は週によって異なれば "mixed" とする
+    """
+    periods = np.argwhere(cube.available)
+    if len(cube.diseases) == 0 or len(periods) == 0:
+        return []
+    series = cube.values[:, cube.available]
+    recent_periods = periods[-trend_weeks:]
+    recent = series[:, -trend_weeks:]
+
+    # トレンド: 直近の実績の合計と、同じ週の過去平均の合計の比
+    baseline = np.zeros(len(cube.diseases))
+    for year_index, week_index in recent_periods.tolist():
+        mean, _, _ = _same_week_history(cube, int(cube.years[year_index]), week_index + 1, history_years)
+        baseline += mean
+    trend = np.where(np.isnan(baseline), 1.0, np.clip((recent.sum(axis=1) + 1) / (baseline + 1), *TREND_LIMITS))
+
+    last_year, last_week = int(cube.years[periods[-1][0]]), int(periods[-1][1]) + 1
+    targets = next_weeks(last_year, last_week, horizon)
+    expected, lower, upper, seasonal_weeks = [], [], [], []
+    for year, week in targets:
+        mean, std, counts = _same_week_history(cube, year, week, history_years)
+        seasonal = counts >= 2
+        center = np.where(seasonal, mean * trend, recent.mean(axis=1))
+        spread = np.where(seasonal, std * trend, recent.std(axis=1))
+        # 過去の同じ週のばらつきと、ポアソン分布としてのばらつきを合わせる
+        sd = np.sqrt(spread ** 2 + np.maximum(center, 0))
+        expected.append(center)
+        lower.append(np.maximum(center - INTERVAL_Z * sd, 0))
+        upper.append(center + INTERVAL_Z * sd)
+        seasonal_weeks.append(seasonal)
+
+    expected, lower, upper = (_round(np.stack(values, axis=1)) for values in (expected, lower, upper))
+    seasonal_weeks = np.stack(seasonal_weeks, axis=1)
+    all_seasonal, any_seasonal = seasonal_weeks.all(axis=1).tolist(), seasonal_weeks.any(axis=1).tolist()
+    seasonal_weeks = seasonal_weeks.tolist()
+    last_counts = series[:, -1].astype(np.int64).tolist()
+    trend_values = np.round(trend, 3).tolist()
+    results = []
+    for i, disease_name in enumerate(cube.diseases):
+        results.append({
+            "disease_name": disease_name,
+            "method": SEASONAL_METHOD if all_seasonal[i] else MIXED_METHOD if any_seasonal[i] else RECENT_METHOD,
+            # トレンドは季節ベースラインで予測した週にだけ掛かる
+            "trend": trend_values[i] if any_seasonal[i] else None,
+            "last_observed": {"year": last_year, "week": last_week, "count": last_counts[i]},
+            "forecast": [
+                {"year": year, "week": week, "method": SEASONAL_METHOD if seasonal_weeks[i][h] else RECENT_METHOD,
+                 "expected": expected[i][h], "lower": lower[i][h], "upper": upper[i][h]}
+                for h, (year, week) in enumerate(targets)
+            ],
+        })
+    return results
+
+
+def build_forecasts(data_version: str, cubes: Dict[str, Optional[SeasonalityCube]]) -> Dict:
+    """対象（notifiable / sentinel）ごとのキューブから全疾病の予測をまとめる"""
+    return {
+        "data_version": data_version,
+        "format": FORECAST_FORMAT,
+        "generated_at": datetime.now().isoformat(),
+        "horizon_weeks": FORECAST_HORIZON_WEEKS,
+        "history_years": HISTORY_YEARS,
+        "trend_weeks": TREND_WEEKS,
+        "interval": 0.95,
+        "sources": {
+            source: seasonal_forecast(cube) if cube is not None else []
+            for source, cube in cubes.items()
+        },
+    }
+
+
+def forecast_path(directory: str, data_version: str) -> str:
+    return os.path.join(directory, f"{FORECAST_FILE_PREFIX}{data_version}.json")
+
+
+def load_forecasts(directory: str, data_version: str) -> Optional[Dict]:
+    """保存済みの予測（同じデータの版・形式のものがなければ None）"""
+    try:
+        with open(forecast_path(directory, data_version), 'r', encoding='utf-8') as f:
+            forecasts = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if forecasts.get('data_version') != data_version or forecasts.get('format') != FORECAST_FORMAT:
+        return None
+    return forecasts
+
+
+def save_forecasts(directory: str, forecasts: Dict, keep: int = 5) -> str:
+    """
+    データの版ごとのファイルに保存し（プロセスごとの一時ファイルから置き換え）、古い版のものは keep 件を残して削除する
+    複数のワーカーが同時に保存・削除しても、書きかけのファイルを読まれたり例外になったりしない
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = forecast_path(directory, forecasts['data_version'])
+    write_json_atomic(path, forecasts)
+
+    def modified(entry: str) -> float:
+        try:
+            return os.path.getmtime(os.path.join(directory, entry))
+        except OSError:
+            return 0.0
+
+    saved = sorted(
+        (entry for entry in os.listdir(directory) if entry.startswith(FORECAST_FILE_PREFIX) and entry.endswith('.json')),
+        key=modified
+    )
+    for entry in saved[:-keep]:
+        try:
+            os.remove(os.path.join(directory, entry))
+        except OSError:
+            pass
+    return path
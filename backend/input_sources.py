@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+データ処理スクリプトの入力ファイル列挙
+ディレクトリ内のCSVファイルに加えて、.zip / .tar.gz（.tgz, .tar）アーカイブのメンバーと
+gzip圧縮ファイル（.csv.gz）を、ディスクに展開せずにそのまま読み込めるようにします（標準ライブラリのみ）。
+"""
+
+import fnmatch
+import gzip
+import os
+import posixpath
+import tarfile
+import zipfile
+from typing import Callable, Iterator, Union
+
+TAR_SUFFIXES = ('.tar.gz', '.tgz', '.tar')
+
+
+class InputFile:
+    """
+    入力ファイル（ディレクトリ上のファイル、またはアーカイブのメンバー）
+    name はディレクトリを除いたファイル名（メンバー名）で、ファイル名からの日付の抽出に使う
+    アーカイブのメンバーは、列挙を次に進める前に read_bytes() で読み込むこと
+    """
+
+    __slots__ = ('name', 'path', '_reader')
+
+    def __init__(self, name: str, path: str, reader: Callable[[], bytes]):
+        self.name = name
+        self.path = path
+        self._reader = reader
+
+    def read_bytes(self) -> bytes:
+        return self._reader()
+
+    def __str__(self) -> str:
+        return self.path
+
+    def __repr__(self) -> str:
+        return f"InputFile({self.path!r})"
+
+
+InputSource = Union[str, InputFile]
+
+
+def input_name(source: InputSource) -> str:
+    """ファイル名（アーカイブのメンバーはメンバー名）"""
+    return source.name if isinstance(source, InputFile) else os.path.basename(source)
+
+
+def read_input(source: InputSource) -> bytes:
+    """入力ファイルの内容（パス文字列も受け付ける）"""
+    if isinstance(source, InputFile):
+        return source.read_bytes()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def _read_file(path: str) -> Callable[[], bytes]:
+    def read() -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+
+def _read_gzip(path: str) -> Callable[[], bytes]:
+    def read() -> bytes:
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    return read
+
+
+def _iter_zip(path: str, match: Callable[[str], bool]) -> Iterator[InputFile]:
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = posixpath.basename(info.filename)
+            if info.is_dir() or not match(name):
+                continue
+            yield InputFile(name, f"{path}!{info.filename}", lambda info=info: archive.read(info))
+
+
+def _iter_tar(path: str, match: Callable[[str], bool]) -> Iterator[InputFile]:
+    # ストリームモードで先頭から順に読む（gzipを巻き戻して読み直さない）
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            name = posixpath.basename(member.name)
+            if not member.isfile() or not match(name):
+                continue
+            data = archive.extractfile(member).read()
+            yield InputFile(name, f"{path}!{member.name}", lambda data=data: data)
+
+
+def iter_input_files(directory: str, match: Callable[[str], bool]) -> Iterator[InputFile]:
+    """
+    ディレクトリ内の入力ファイルを列挙（match はファイル名・メンバー名を受け取り対象かどうかを返す）
+    アーカイブは中のメンバーを、.gz ファイルは拡張子を除いた名前で判定する
+    """
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if not os.path.isfile(path):
+            continue
+        lower = entry.lower()
+        if lower.endswith('.zip'):
+            yield from _iter_zip(path, match)
+        elif lower.endswith(TAR_SUFFIXES):
+            yield from _iter_tar(path, match)
+        elif lower.endswith('.gz'):
+            name = entry[:-len('.gz')]
+            if match(name):
+                yield InputFile(name, path, _read_gzip(path))
+        elif match(entry):
+            yield InputFile(entry, path, _read_file(path))
+
+
+def pattern_matcher(pattern: str) -> Callable[[str], bool]:
+    """glob形式のパターン（例: sentinel_weekly_gender_*_raw.csv）でファイル名を判定する関数"""
+    return lambda name: fnmatch.fnmatchcase(name, pattern)
@@ -2,19 +2,64 @@
 """
 感染症ダッシュボード バックエンドAPI
 FastAPIを使用したRESTful API
+
+起動を速くするため pandas はモジュール読み込み時にはimportせず、
+DataFrameが必要になった時点で読み込みます。
 """
 
-from fastapi import FastAPI, HTTPException, Query
+import time
+
+# 起動フェーズ計測用（import に要した時間をログに出す）
+_IMPORT_START = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import pandas as pd
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import functools
+import gc
+import hashlib
+import hmac
+import io
 import json
 import os
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from datetime import datetime, date
 from pydantic import BaseModel
 import logging
 
+from comparison import COMPARE_SORT_KEYS, MAX_COMPARE_WINDOW, period_comparison
+from correlation import MAX_LAG_WEEKS, correlation_pairs, lagged_correlations, weekly_matrix
+from data_events import DataVersionBroadcaster
+from dataset_registry import DatasetRegistry, load_csv_table
+from disease_search import SEARCH_MAX_LIMIT, DiseaseSearchIndex, SearchEntry
+from forecast import build_forecasts, load_forecasts, save_forecasts
+from excel_export import XLSX_MEDIA_TYPE, build_workbook_file, iter_file
+from export import (
+    EXPORT_FORMATS, coded_columns_from_dataframe, export_metrics_recorder, iter_coded_batches, record_order,
+    stream_export
+)
+from memory_report import AllocationTracker, array_columns, deep_sizeof, frame_columns, live_objects
+from metrics import MetricsMiddleware, MetricsRegistry, process_resident_memory_bytes, process_uptime_seconds
+from partitions import (
+    PARTITION_DIR_NAME, partition_paths, read_partition_index, resolve_year_range, select_partitions
+)
+from query_engine import ColumnarTable, PlanCache, estimate_groups, normalize_plan
+from request_profiler import RequestProfilerMiddleware, current_profile, load_profile, profiled_call
+from seasonality import SeasonalityCube, changed_cells
+from sentinel_cube import AGE_CUBE_NAME, REGION_CUBE_NAME, REGION_LEVELS, load_cube
+from single_flight import SingleFlight
+from shared_dataset import SharedDataset, source_fingerprint
+from snapshot import SNAPSHOT_DIR_NAME, StartupSnapshot, load_or_build
+from sqlite_store import SQLITE_FILE_NAME, SQLiteStore, StoreBusyError
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,16 +79,126 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# メトリクス収集
+metrics = MetricsRegistry()
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
+@app.exception_handler(StoreBusyError)
+async def store_busy_handler(request: Request, exc: StoreBusyError):
+    """SQLiteの接続プールが空かないときは503を返す"""
+    metrics.inc_counter("sqlite_pool_timeouts_total", 1, "SQLiteの接続プールの空き待ちがタイムアウトした件数")
+    logger.warning(f"SQLiteの接続待ちがタイムアウトしました: {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "データベースが混み合っています。しばらくしてから再実行してください"},
+        headers={"Retry-After": "1"}
+    )
+
 # データファイルのパス
 DATA_DIR = "processed_data"
 MAIN_DATA_FILE = os.path.join(DATA_DIR, "infectious_diseases_data.csv")
 SUMMARY_FILE = os.path.join(DATA_DIR, "summary_statistics.json")
 DISEASE_LIST_FILE = os.path.join(DATA_DIR, "disease_list.json")
+SENTINEL_SUMMARY_FILE = os.path.join(DATA_DIR, "sentinel_summary_statistics.json")
+SENTINEL_DATASET = "sentinel_diseases_data"
+SENTINEL_DATA_FILE = os.path.join(DATA_DIR, f"{SENTINEL_DATASET}.csv")
+FORECAST_DIR = os.path.join(DATA_DIR, "forecasts")
+SQLITE_FILE = os.path.join(DATA_DIR, SQLITE_FILE_NAME)
+SNAPSHOT_DIR = os.path.join(DATA_DIR, SNAPSHOT_DIR_NAME)
+PARTITION_DIR = os.path.join(DATA_DIR, PARTITION_DIR_NAME)
+
+# ストレージバックエンド（memory: pandasで全件を保持 / sqlite: SQLiteを読み取り専用で参照）
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+
+# 共有データセット（memoryバックエンドで、1度だけ変換した列データをワーカー間でメモリマップ共有）
+USE_SHARED_DATASET = os.environ.get("SHARED_DATASET", "0") == "1"
+SHARED_DATASET_DIR = os.environ.get("SHARED_DATASET_DIR") or None
+SHARED_DATASET_POLL_SECONDS = float(os.environ.get("SHARED_DATASET_POLL_SECONDS", "10"))
+
+# 起動用スナップショット（memoryバックエンドの既定。元CSVのハッシュで管理し、起動時はメモリマップのみ）
+USE_STARTUP_SNAPSHOT = os.environ.get("STARTUP_SNAPSHOT", "1") == "1"
+
+# 読み込む期間（指定するとパーティションインデックスを参照し、期間にかかるパーティションだけを読み込む）
+DATA_START_YEAR = int(os.environ["DATA_START_YEAR"]) if os.environ.get("DATA_START_YEAR") else None
+DATA_END_YEAR = int(os.environ["DATA_END_YEAR"]) if os.environ.get("DATA_END_YEAR") else None
+DATA_RECENT_YEARS = int(os.environ["DATA_RECENT_YEARS"]) if os.environ.get("DATA_RECENT_YEARS") else None
+
+# /query の設定（キャッシュするプラン数、上位N件の上限、top 未指定時に許す結果グループ数の上限）
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "256"))
+QUERY_MAX_TOP = int(os.environ.get("QUERY_MAX_TOP", "1000"))
+QUERY_MAX_GROUPS = int(os.environ.get("QUERY_MAX_GROUPS", "10000"))
+
+# 起動時のウォームアップ（初期画面の応答を事前に計算する。時系列は上位N疾病分）と、集計応答のキャッシュ件数
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1") == "1"
+WARMUP_TOP_DISEASES = int(os.environ.get("WARMUP_TOP_DISEASES", "10"))
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "512"))
+
+# データセットレジストリ（processed_data/ 内の各データセットを初回アクセス時に読み込む）のメモリ予算
+DATASET_MEMORY_BUDGET_MB = float(os.environ.get("DATASET_MEMORY_BUDGET_MB", "256"))
+DATASET_MAX_ROWS = 10000
+
+# /events/data-version（SSE）の keepalive 間隔・同時接続数の上限と、イベントに載せる変更週数の上限（超えたら全体の再取得を促す）
+DATA_EVENTS_KEEPALIVE_SECONDS = float(os.environ.get("DATA_EVENTS_KEEPALIVE_SECONDS", "25"))
+DATA_EVENTS_MAX_CONNECTIONS = int(os.environ.get("DATA_EVENTS_MAX_CONNECTIONS", "10000"))
+DATA_EVENTS_MAX_CHANGES = int(os.environ.get("DATA_EVENTS_MAX_CHANGES", "500"))
+
+# リクエスト単位のプロファイル（X-Profile-Token ヘッダーで有効化。トークン未設定時はミドルウェアを組み込まない）
+REQUEST_PROFILE_TOKEN = os.environ.get("REQUEST_PROFILE_TOKEN", "")
+REQUEST_PROFILE_DIR = os.environ.get("REQUEST_PROFILE_DIR", "request_profiles")
+REQUEST_PROFILE_KEEP = int(os.environ.get("REQUEST_PROFILE_KEEP", "20"))
+if REQUEST_PROFILE_TOKEN:
+    app.add_middleware(RequestProfilerMiddleware, token=REQUEST_PROFILE_TOKEN, output_dir=REQUEST_PROFILE_DIR,
+                       keep=REQUEST_PROFILE_KEEP, registry=metrics)
+
+# /debug/memory 用に、データを読み込むたびに tracemalloc のスナップショットを取る（割り当ての追跡は負荷があるため既定は無効）
+MEMORY_TRACE = os.environ.get("MEMORY_TRACE", "0") == "1"
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "1"))
+
+# /correlations の結果をキャッシュする条件（データの版・期間・ラグ）の数
+CORRELATION_CACHE_SIZE = int(os.environ.get("CORRELATION_CACHE_SIZE", "32"))
+
+# /export.xlsx の同時作成数（超えたリクエストは空きが出るまで待つ）
+XLSX_EXPORT_CONCURRENCY = int(os.environ.get("XLSX_EXPORT_CONCURRENCY", "2"))
+
+# 文字列列はカテゴリ型で読み込む（疾病名・分類の重複文字列を持たない）
+CATEGORY_DTYPES = {'disease_name': 'category', 'category': 'category'}
 
 # グローバルデータ変数
-main_data: Optional[pd.DataFrame] = None
+main_data: Optional["pd.DataFrame"] = None
 summary_stats: Optional[Dict] = None
 disease_list: Optional[List[str]] = None
+dataset_memory_bytes: int = 0
+sqlite_store: Optional[SQLiteStore] = None
+shared_dataset: Optional[SharedDataset] = None
+startup_snapshot: Optional[StartupSnapshot] = None
+# 読み込んだデータの版（元データが変わると変わる。キャッシュキーに使う）
+data_version: str = ""
+query_table: Optional[ColumnarTable] = None
+# メインデータのコード化した列配列とコード表（/export 用。スナップショット・SQLiteでは None）
+coded_columns: Optional[Tuple[Dict[str, "np.ndarray"], Dict[str, List[str]]]] = None
+# /export 用の行の並び（(元の列配列, 疾病名 → 報告日 の添字)。初回のエクスポート時に作成）
+export_order: Optional[Tuple[Dict[str, "np.ndarray"], "np.ndarray"]] = None
+query_cache = PlanCache(QUERY_CACHE_SIZE)
+correlation_cache = PlanCache(CORRELATION_CACHE_SIZE)
+response_cache = PlanCache(RESPONSE_CACHE_SIZE)
+dataset_registry = DatasetRegistry(int(DATASET_MEMORY_BUDGET_MB * 1024 * 1024), metrics)
+search_index: Optional[DiseaseSearchIndex] = None
+seasonality_cube: Optional[SeasonalityCube] = None
+sentinel_seasonality_cube: Optional[SeasonalityCube] = None
+# 全疾病の予測（データの版ごとに1度だけ計算して FORECAST_DIR に保存する）
+forecasts: Optional[Dict] = None
+xlsx_export_semaphore = asyncio.Semaphore(XLSX_EXPORT_CONCURRENCY)
+# 再読み込み（/reload-data と共有データセットの監視）を1つずつ行う
+data_load_lock = asyncio.Lock()
+allocation_tracker = AllocationTracker(MEMORY_TRACE, MEMORY_TRACE_FRAMES)
+# データの版が変わったことを SSE で接続中のクライアントに知らせる
+data_events = DataVersionBroadcaster(metrics, DATA_EVENTS_KEEPALIVE_SECONDS)
+# 同時に届いた同一の集計リクエストは1回だけ計算する
+single_flight = SingleFlight(metrics)
+# 起動の進捗（starting → loading → warming → ready。読み込みに失敗すると failed）
+startup_state: Dict = {"phase": "starting", "started_at": datetime.now().isoformat(), "load_phases": {},
+                       "warmup": {"completed": 0, "total": 0}, "error": None}
+startup_task: Optional["asyncio.Task"] = None
 
 # Pydanticモデル
 class DiseaseData(BaseModel):
@@ -71,46 +226,519 @@ class SummaryResponse(BaseModel):
     top_diseases: Dict[str, int]
     yearly_totals: Dict[str, int]
 
-def load_data():
-    """データファイルを読み込み"""
-    global main_data, summary_stats, disease_list
+def _open_sqlite_store() -> Optional[SQLiteStore]:
+    """
+    SQLiteストアを開く（置き換えは _install_data で行う）
+    旧ストアは閉じずに参照を外すだけにする（スレッドプールで実行中のクエリが旧ストアの接続を使い終えた時点で、
+    参照カウントが0になり接続も閉じられる）
+    """
+    if not os.path.exists(SQLITE_FILE):
+        logger.warning(f"SQLiteデータベースが見つかりません: {SQLITE_FILE}")
+        return None
+    store = SQLiteStore(SQLITE_FILE)
+    logger.info(f"SQLiteデータベースを開きました: {store.record_count} レコード")
+    metrics.set_gauge("sqlite_file_bytes", store.file_size(), "SQLiteデータベースのファイルサイズ（バイト）")
+    return store
+
+def _query_store():
+    """集計済みデータで応答できるストア（SQLiteまたは起動用スナップショット）"""
+    return sqlite_store if sqlite_store is not None else startup_snapshot
+
+def _records_count() -> int:
+    """読み込み済みレコード数"""
+    store = _query_store()
+    if store is not None:
+        return store.record_count
+    return len(main_data) if main_data is not None else 0
+
+def _compact_frame(df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    メインデータを省メモリな型に変換
+    文字列列はカテゴリ型、日付は一意な日付だけを解析した順序付きカテゴリ、整数列は値域に収まる最小の型にする
+    """
+    import pandas as pd
     
-    try:
-        if os.path.exists(MAIN_DATA_FILE):
-            main_data = pd.read_csv(MAIN_DATA_FILE)
-            main_data['report_date'] = pd.to_datetime(main_data['report_date'])
-            logger.info(f"メインデータを読み込みました: {len(main_data)} レコード")
-        else:
-            logger.warning(f"メインデータファイルが見つかりません: {MAIN_DATA_FILE}")
-            main_data = pd.DataFrame()
+    dates = df['report_date'].astype('category')
+    dates = dates.cat.rename_categories(pd.to_datetime(dates.cat.categories))
+    df['report_date'] = dates.cat.reorder_categories(dates.cat.categories.sort_values(), ordered=True)
+    for column in ('year', 'week'):
+        df[column] = pd.to_numeric(df[column], downcast='integer')
+    # 件数は合計時の桁あふれを避けるため int32 以上にする
+    df['count'] = pd.to_numeric(df['count'], downcast='integer').astype(
+        'int64' if df['count'].max() > 2 ** 31 - 1 else 'int32'
+    )
+    return df
+
+def _query_table() -> Optional[ColumnarTable]:
+    """/query 用の列配列（load_data で作成。スナップショット・共有データセットはコピーせずに参照）"""
+    return query_table
+
+def _coded_columns():
+    """メインデータの列配列とコード表（共有データセットはセグメントを、それ以外はカテゴリコードを参照）"""
+    return coded_columns
+
+def _export_order(columns) -> "np.ndarray":
+    """
+    メインデータの行を出力順に並べる添字（スナップショット・SQLiteと同じ順にする）
+    再読み込みと同時に呼ばれても別の版の列配列に使わないよう、作成元の列配列と組にして保持する
+    """
+    global export_order
+    cached = export_order
+    if cached is None or cached[0] is not columns:
+        cached = export_order = (columns, record_order(columns))
+    return cached[1]
+
+def _disease_exists(disease_name: str) -> bool:
+    store = _query_store()
+    if store is not None:
+        return store.disease_exists(disease_name)
+    return main_data is not None and disease_name in main_data['disease_name'].cat.categories
+
+def _record_batches(disease_name: Optional[str] = None, start_year: Optional[int] = None,
+                    end_year: Optional[int] = None, category: Optional[str] = None):
+    """条件に一致するレコードをバッチ単位で返す（/export 用。全件を組み立てない）"""
+    store = _query_store()
+    if store is not None:
+        return store.iter_records(disease_name, start_year, end_year, category)
+    if main_data is None or main_data.empty:
+        return iter(())
+    columns, code_tables = _coded_columns()
+    codes = {}
+    for name, value in (('disease_name', disease_name), ('category', category)):
+        if value is not None:
+            if value not in code_tables[name]:
+                return iter(())
+            codes[name] = code_tables[name].index(value)
+    return iter_coded_batches(columns, code_tables, disease_code=codes.get('disease_name'),
+                              category_code=codes.get('category'), start_year=start_year, end_year=end_year,
+                              order=_export_order(columns))
+
+def _unknown_diseases(diseases: List[str]) -> List[str]:
+    """データにない疾病名（ストアへの問い合わせを含むためスレッドプールで実行する）"""
+    return [d for d in diseases if not _disease_exists(d)]
+
+def _category_names() -> List[str]:
+    """データに含まれる感染症分類"""
+    store = _query_store()
+    if store is not None:
+        return [c['category'] for c in store.categories()]
+    if main_data is None or main_data.empty:
+        return []
+    return _coded_columns()[1]['category']
+
+def _build_search_index(engine, diseases: List[str]) -> DiseaseSearchIndex:
+    """届出疾病（報告数の合計つき）と定点把握疾病の名前から検索インデックスを作成"""
+    entries = {}
+    if engine is not None:
+        for row in engine.execute(normalize_plan(group_by=['disease', 'category'])):
+            name = row['disease_name']
+            if name in entries:
+                entries[name] = entries[name]._replace(total_count=entries[name].total_count + row['value'])
+            else:
+                entries[name] = SearchEntry(name, row['value'], row['category'], 'notifiable')
+    for name in diseases:
+        if name not in entries:
+            entries[name] = SearchEntry(name, 0, "", 'notifiable')
+    
+    search_entries = list(entries.values())
+    if os.path.exists(SENTINEL_SUMMARY_FILE):
+        with open(SENTINEL_SUMMARY_FILE, 'r', encoding='utf-8') as f:
+            statistics = json.load(f).get('disease_statistics', {})
+        for name, stats in statistics.items():
+            search_entries.append(SearchEntry(name, int(stats.get('total_cases', 0)), "定点把握", 'sentinel'))
+    return DiseaseSearchIndex(search_entries)
+
+async def _coalesced(route: str, func, *args):
+    """func(*args) をスレッドプールで実行（同じデータの版・ルート・引数の計算が実行中ならその結果を共有）"""
+    if current_profile() is not None:
+        # 計測対象のリクエストは他のリクエストと共有せず、スレッドプール側も計測しながら計算する
+        return await run_in_threadpool(profiled_call, func, *args)
+    return await single_flight.run(route, (data_version,) + args, func, *args)
+
+async def _cached(route: str, func, *args):
+    """_coalesced の結果をデータの版・ルート・引数ごとにキャッシュする（ダッシュボードの集計応答用）"""
+    if current_profile() is not None:
+        return await _coalesced(route, func, *args)
+    key = (route, data_version) + args
+    cached = response_cache.get(key)
+    metrics.record_cache("response", cached is not None)
+    if cached is not None:
+        return cached
+    result = await _coalesced(route, func, *args)
+    response_cache.put(key, result)
+    return result
+
+def _read_data() -> Tuple[Dict[str, float], Dict]:
+    """
+    データファイルを読み込み、置き換え後の状態を作る（フェーズ別の所要時間と状態を返す）
+    スレッドプールで実行するため、応答に使うグローバル変数はここでは書き換えない
+    """
+    global shared_dataset
+    
+    phases = {'read': 0.0, 'parse': 0.0, 'metadata': 0.0, 'index': 0.0}
+    frame = None
+    snapshot = None
+    store = None
+    columns = None
+    version_source = ""
+    
+    partition_index = None
+    if STORAGE_BACKEND != "sqlite" and (DATA_START_YEAR or DATA_END_YEAR or DATA_RECENT_YEARS):
+        partition_index = read_partition_index(PARTITION_DIR)
+        if partition_index is None:
+            logger.warning(f"パーティションインデックスが見つからないため全期間を読み込みます: {PARTITION_DIR}")
+    
+    if STORAGE_BACKEND == "sqlite":
+        # レコードはSQLiteから都度参照するため、メモリには読み込まない
+        phase_start = time.perf_counter()
+        store = _open_sqlite_store()
+        phases['read'] = time.perf_counter() - phase_start
+        if store is not None:
+            version_source = f"sqlite:{source_fingerprint(SQLITE_FILE)}"
+    elif partition_index is not None:
+        # 対象期間にかかるパーティションだけを読み込む
+        import pandas as pd
+        
+        start_year, end_year = resolve_year_range(partition_index, DATA_START_YEAR, DATA_END_YEAR, DATA_RECENT_YEARS)
+        entries = select_partitions(partition_index, start_year, end_year)
+        phase_start = time.perf_counter()
+        chunks = []
+        for i, path in enumerate(partition_paths(PARTITION_DIR, entries)):
+            with open(path, 'rb') as f:
+                raw = f.read()
+            # 2つ目以降のパーティションはヘッダー行を除いて連結する
+            chunks.append(raw if i == 0 else raw.split(b"\n", 1)[1])
+        phases['read'] = time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
+        if chunks:
+            frame = _compact_frame(pd.read_csv(io.BytesIO(b"".join(chunks)), dtype=CATEGORY_DTYPES))
+        del chunks
+        phases['parse'] = time.perf_counter() - phase_start
+        version_source = f"partitions:{partition_index['generated_at']}:{start_year}:{end_year}"
+        metrics.set_gauge("dataset_partitions_loaded", len(entries), "読み込んだパーティション数")
+        logger.info(
+            f"パーティションを読み込みました: {len(entries)}/{len(partition_index['partitions'])} "
+            f"({start_year or '-'}〜{end_year or '-'}年, {len(frame) if frame is not None else 0} レコード)"
+        )
+    elif USE_SHARED_DATASET and os.path.exists(MAIN_DATA_FILE):
+        # 他のワーカーが公開済みならアタッチのみ（CSVの解析は全ワーカーで1度だけ）
+        # アタッチ中のセグメントはプロセスごとに1つなので、共有データセットの参照はプロセスで1つを使い続ける
+        if shared_dataset is None:
+            shared_dataset = SharedDataset(SHARED_DATASET_DIR)
+        header = shared_dataset.attach(MAIN_DATA_FILE, phases)
+        columns = (shared_dataset.columns(), header['code_tables'])
+        frame = shared_dataset.to_dataframe()
+        version_source = f"shared:{header['fingerprint']}"
+        metrics.set_gauge("shared_segment_bytes", shared_dataset.nbytes(), "アタッチ中の共有セグメントのサイズ（バイト）")
+        logger.info(f"共有データセットにアタッチしました: {shared_dataset.segment} ({len(frame)} レコード)")
+    elif USE_STARTUP_SNAPSHOT and os.path.exists(MAIN_DATA_FILE):
+        # ハッシュが一致すればCSVは解析せずメモリマップのみ
+        snapshot_phases: Dict[str, float] = {}
+        snapshot = load_or_build(MAIN_DATA_FILE, SNAPSHOT_DIR, snapshot_phases)
+        phases['read'] = snapshot_phases.get('hash', 0.0) + snapshot_phases.get('map', 0.0)
+        phases['parse'] = snapshot_phases.get('build', 0.0)
+        version_source = f"snapshot:{snapshot.sha256}"
+        metrics.set_gauge("snapshot_bytes", snapshot.nbytes(), "起動用スナップショットのサイズ（バイト）")
+        logger.info(f"起動用スナップショットを読み込みました: {snapshot.segment} ({snapshot.record_count} レコード)")
+    elif os.path.exists(MAIN_DATA_FILE):
+        import pandas as pd
         
-        if os.path.exists(SUMMARY_FILE):
-            with open(SUMMARY_FILE, 'r', encoding='utf-8') as f:
-                summary_stats = json.load(f)
-            logger.info("サマリー統計を読み込みました")
-        else:
-            logger.warning(f"サマリーファイルが見つかりません: {SUMMARY_FILE}")
-            summary_stats = {}
+        phase_start = time.perf_counter()
+        with open(MAIN_DATA_FILE, 'rb') as f:
+            raw = f.read()
+        phases['read'] = time.perf_counter() - phase_start
         
-        if os.path.exists(DISEASE_LIST_FILE):
-            with open(DISEASE_LIST_FILE, 'r', encoding='utf-8') as f:
-                disease_list = json.load(f)
-            logger.info(f"疾病リストを読み込みました: {len(disease_list)} 疾病")
-        else:
-            logger.warning(f"疾病リストファイルが見つかりません: {DISEASE_LIST_FILE}")
-            disease_list = []
-            
+        phase_start = time.perf_counter()
+        frame = _compact_frame(pd.read_csv(io.BytesIO(raw), dtype=CATEGORY_DTYPES))
+        del raw
+        version_source = f"csv:{source_fingerprint(MAIN_DATA_FILE)}"
+        phases['parse'] = time.perf_counter() - phase_start
+        logger.info(f"メインデータを読み込みました: {len(frame)} レコード")
+    else:
+        logger.warning(f"メインデータファイルが見つかりません: {MAIN_DATA_FILE}")
+    
+    phase_start = time.perf_counter()
+    # メモリ使用量はスクレイプごとではなく読み込み時に一度だけ計測する
+    if frame is not None:
+        memory_bytes = int(frame.memory_usage(deep=True).sum())
+    elif snapshot is not None:
+        memory_bytes = snapshot.nbytes()
+    else:
+        memory_bytes = 0
+    
+    if os.path.exists(SUMMARY_FILE):
+        with open(SUMMARY_FILE, 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+        logger.info("サマリー統計を読み込みました")
+    else:
+        logger.warning(f"サマリーファイルが見つかりません: {SUMMARY_FILE}")
+        summary = {}
+    
+    if os.path.exists(DISEASE_LIST_FILE):
+        with open(DISEASE_LIST_FILE, 'r', encoding='utf-8') as f:
+            diseases = json.load(f)
+        logger.info(f"疾病リストを読み込みました: {len(diseases)} 疾病")
+    else:
+        logger.warning(f"疾病リストファイルが見つかりません: {DISEASE_LIST_FILE}")
+        diseases = []
+    
+    # メインデータはストア・スナップショットから応答するため、2つ目のコピーを読み込まないよう登録しない
+    datasets = dataset_registry.discover(DATA_DIR, {
+        '.csv': (load_csv_table, "table"),
+        '.npy': (load_cube, "cube"),
+    }, exclude=(os.path.basename(MAIN_DATA_FILE),))
+    logger.info(f"データセットを登録しました: {datasets} 件")
+    phases['metadata'] = time.perf_counter() - phase_start
+    
+    phase_start = time.perf_counter()
+    # /query・/export 用の列配列（スナップショット・共有データセットはコピーせずに参照）
+    table = None
+    if snapshot is not None:
+        table = ColumnarTable(snapshot.arrays, snapshot.code_tables)
+    elif frame is not None and not frame.empty:
+        if columns is None:
+            columns = coded_columns_from_dataframe(frame)
+        table = ColumnarTable(*columns)
+    engine = store if store is not None else table
+    index = _build_search_index(engine, diseases)
+    logger.info(f"疾病名検索インデックスを作成しました: {len(index)} 件")
+    
+    # 疾病 × 年 × 週の季節性キューブ（/seasonality はこの切り出しで応答する）
+    cubes = {
+        'notifiable': SeasonalityCube(*engine.weekly_totals()) if engine is not None else None,
+        'sentinel': _sentinel_seasonality(),
+    }
+    if cubes['notifiable'] is not None:
+        metrics.set_gauge("seasonality_cube_bytes", cubes['notifiable'].nbytes(), "季節性キューブのサイズ（バイト）")
+        logger.info(
+            f"季節性キューブを作成しました: {len(cubes['notifiable'].diseases)} 疾病 × {len(cubes['notifiable'].years)} 年"
+        )
+    if cubes['sentinel'] is not None:
+        # 予測などは定点把握データからも作るため、データの版には定点把握データの更新も含める
+        version_source += f"|sentinel:{source_fingerprint(SENTINEL_DATA_FILE)}"
+    phases['index'] = time.perf_counter() - phase_start
+    
+    version = hashlib.sha1(version_source.encode('utf-8')).hexdigest()[:12] if version_source else ""
+    return phases, {
+        'main_data': frame,
+        'startup_snapshot': snapshot,
+        'sqlite_store': store,
+        'coded_columns': columns,
+        'query_table': table,
+        'dataset_memory_bytes': memory_bytes,
+        'summary_stats': summary,
+        'disease_list': diseases,
+        'search_index': index,
+        'seasonality_cube': cubes['notifiable'],
+        'sentinel_seasonality_cube': cubes['sentinel'],
+        'data_version': version,
+        'forecasts': _load_or_build_forecasts(version, cubes) if version else None,
+    }
+
+def _install_data(phases: Dict[str, float], state: Dict):
+    """
+    _read_data が作った状態にグローバル変数をまとめて置き換える
+    イベントループ上で途中に await を挟まずに実行するため、応答中のリクエストから新旧の混ざった状態は見えない
+    """
+    global main_data, summary_stats, disease_list, dataset_memory_bytes, sqlite_store, startup_snapshot
+    global coded_columns, export_order, data_version, query_table, search_index
+    global seasonality_cube, sentinel_seasonality_cube, forecasts
+    
+    previous_version, previous_cubes = data_version, (seasonality_cube, sentinel_seasonality_cube)
+    main_data = state['main_data']
+    startup_snapshot = state['startup_snapshot']
+    sqlite_store = state['sqlite_store']
+    coded_columns = state['coded_columns']
+    query_table = state['query_table']
+    export_order = None
+    dataset_memory_bytes = state['dataset_memory_bytes']
+    summary_stats = state['summary_stats']
+    disease_list = state['disease_list']
+    search_index = state['search_index']
+    seasonality_cube = state['seasonality_cube']
+    sentinel_seasonality_cube = state['sentinel_seasonality_cube']
+    data_version = state['data_version']
+    forecasts = state['forecasts']
+    del state
+    
+    query_cache.clear()
+    correlation_cache.clear()
+    response_cache.clear()
+    metrics.record_load_phases(phases)
+    metrics.set_gauge("dataset_records", _records_count(), "読み込み済みレコード数")
+    metrics.set_gauge("dataset_memory_bytes", dataset_memory_bytes, "読み込み済みデータセットのメモリ使用量（バイト）")
+    if data_version != previous_version:
+        _publish_data_version(previous_version, previous_cubes)
+    # 旧キューブへの参照を外してから、読み込み後の割り当てを記録する
+    del previous_cubes
+    allocation_tracker.take(f"load {datetime.now().strftime('%H:%M:%S')} ({data_version or '-'})")
+
+async def load_data() -> Dict[str, float]:
+    """
+    データファイルを読み込み（フェーズ別の所要時間を返す）
+    読み込みはイベントループを止めないようスレッドプールで行い、読み込みが終わってから一度に置き換える
+    読み込みに失敗した場合は例外を送出し、読み込み済みのデータをそのまま使い続ける
+    """
+    async with data_load_lock:
+        try:
+            phases, state = await run_in_threadpool(_read_data)
+        except Exception as e:
+            logger.error(f"データ読み込みエラー: {str(e)}")
+            raise
+        _install_data(phases, state)
+    return phases
+
+def _sentinel_seasonality() -> Optional[SeasonalityCube]:
+    """定点把握疾病の 疾病 × 年 × 週 のキューブ（処理済みの定点把握データがなければ None）"""
+    if SENTINEL_DATASET not in dataset_registry:
+        return None
+    try:
+        df = dataset_registry.get(SENTINEL_DATASET)
+    except (KeyError, OSError, ValueError) as e:
+        logger.warning(f"定点把握データの読み込みエラー: {str(e)}")
+        return None
+    if not {'disease_name', 'year', 'week', 'total_count'} <= set(df.columns):
+        return None
+    names = df['disease_name'].astype('category')
+    return SeasonalityCube([str(name) for name in names.cat.categories], {
+        'disease': names.cat.codes.to_numpy(),
+        'year': df['year'].to_numpy(),
+        'week': df['week'].to_numpy(),
+        'total': df['total_count'].to_numpy(),
+    })
+
+def _load_or_build_forecasts(version: str, cubes: Dict[str, Optional[SeasonalityCube]]) -> Optional[Dict]:
+    """データの版の予測を読み込む（保存済みでなければ全疾病分を一括で計算して保存）"""
+    phase_start = time.perf_counter()
+    try:
+        result = load_forecasts(FORECAST_DIR, version)
+        if result is not None:
+            logger.info(f"保存済みの予測を読み込みました: {version}")
+            return result
+        result = build_forecasts(version, cubes)
+        path = save_forecasts(FORECAST_DIR, result)
+        count = sum(len(items) for items in result['sources'].values())
+        logger.info(f"予測を作成しました: {count} 疾病, {(time.perf_counter() - phase_start) * 1000:.1f}ms ({path})")
+        return result
+    except Exception as e:
+        logger.warning(f"予測の作成エラー: {str(e)}")
+        return None
+
+def _publish_data_version(previous_version: str, previous_cubes: Tuple[Optional[SeasonalityCube], ...]):
+    """
+    新しい版を SSE で配信
+    変わった疾病・週は届出・定点把握それぞれの季節性キューブの差分を合わせたもの（求められなければ全体の再取得を促す）
+    """
+    diseases: Optional[List[str]] = []
+    weeks: Optional[List[Dict]] = []
+    compared = False
+    for previous, current in zip(previous_cubes, (seasonality_cube, sentinel_seasonality_cube)):
+        if previous is None and current is None:
+            continue
+        if previous is None or current is None:
+            diseases = weeks = None
+            break
+        changed_diseases, changed_weeks = changed_cells(previous, current)
+        diseases += changed_diseases
+        weeks += changed_weeks
+        compared = True
+    if not compared or weeks is None:
+        diseases = weeks = None
+    else:
+        diseases = list(dict.fromkeys(diseases))
+        weeks = [{"year": year, "week": week} for year, week in sorted({(w["year"], w["week"]) for w in weeks})]
+        if len(weeks) > DATA_EVENTS_MAX_CHANGES:
+            diseases = weeks = None
+    data_events.publish(data_version, previous_version, diseases, weeks)
+    logger.info(
+        f"データの版を公開しました: {previous_version or '-'} → {data_version or '-'}"
+        + (f" ({len(diseases)} 疾病, {len(weeks)} 週)" if weeks is not None else " (全体)")
+    )
+
+async def _watch_shared_dataset():
+    """他のワーカーが公開した新しい共有セグメントを検知して再アタッチ"""
+    while True:
+        await asyncio.sleep(SHARED_DATASET_POLL_SECONDS)
+        try:
+            if shared_dataset is not None and shared_dataset.is_stale(MAIN_DATA_FILE):
+                logger.info("共有データセットの更新を検知しました")
+                await load_data()
+                await _warm_up()
+        except Exception as e:
+            logger.error(f"共有データセットの確認エラー: {str(e)}")
+
+async def _warm_up():
+    """初期画面の応答（上位疾病・年次推移・分類別・上位疾病の時系列）を計算してキャッシュしておく"""
+    if not STARTUP_WARMUP or _records_count() == 0:
+        return
+    try:
+        await _warm_up_responses()
     except Exception as e:
-        logger.error(f"データ読み込みエラー: {str(e)}")
-        main_data = pd.DataFrame()
-        summary_stats = {}
-        disease_list = []
+        # ウォームアップに失敗しても、応答は各リクエストで計算できる
+        logger.warning(f"ウォームアップエラー: {str(e)}")
+
+async def _warm_up_responses():
+    phase_start = time.perf_counter()
+    progress = startup_state["warmup"]
+    steps = [("diseases_top", _top_diseases, 10, None), ("yearly_trends", _yearly_trends), ("categories", _categories)]
+    progress.update(completed=0, total=len(steps) + WARMUP_TOP_DISEASES)
+    top = None
+    for route, func, *args in steps:
+        result = await _cached(route, func, *args)
+        if route == "diseases_top":
+            top = result
+        progress["completed"] += 1
+    
+    # 上位疾病の全期間の時系列（/diseases/top の既定件数を超える分は改めて取得する）
+    if WARMUP_TOP_DISEASES > 10:
+        top = await _cached("diseases_top", _top_diseases, WARMUP_TOP_DISEASES, None)
+    diseases = [d["disease_name"] for d in top["top_diseases"][:WARMUP_TOP_DISEASES]]
+    progress["total"] = len(steps) + len(diseases)
+    for disease_name in diseases:
+        await _cached("timeseries", _disease_timeseries, disease_name, None, None)
+        progress["completed"] += 1
+    
+    seconds = time.perf_counter() - phase_start
+    metrics.set_gauge("warmup_duration_seconds", seconds, "直近のウォームアップの所要時間（秒）")
+    logger.info(f"ウォームアップ完了: {progress['completed']} 件, {seconds * 1000:.0f}ms")
+
+async def _start_up():
+    """データの読み込みとウォームアップ（バックグラウンドで実行）"""
+    try:
+        startup_state["phase"] = "loading"
+        phases = await load_data()
+        startup_state["load_phases"] = {name: round(seconds, 3) for name, seconds in phases.items()}
+        uptime = process_uptime_seconds()
+        logger.info(
+            "起動フェーズ: "
+            f"import={_IMPORT_SECONDS * 1000:.0f}ms, "
+            + ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in phases.items())
+            + (f", プロセス起動からの経過={uptime * 1000:.0f}ms" if uptime is not None else "")
+        )
+        if USE_SHARED_DATASET and STORAGE_BACKEND != "sqlite":
+            asyncio.create_task(_watch_shared_dataset())
+        
+        startup_state["phase"] = "warming"
+        await _warm_up()
+        startup_state["phase"] = "ready"
+    except Exception as e:
+        logger.error(f"起動処理エラー: {str(e)}")
+        startup_state.update(phase="failed", error=str(e))
+    metrics.set_gauge("ready", 1 if _is_ready() else 0, "トラフィックを受け付けられる状態か（1: 可）")
+
+def _is_ready() -> bool:
+    """読み込みとウォームアップが完了し、データがあるか"""
+    return startup_state["phase"] == "ready" and _records_count() > 0
 
 @app.on_event("startup")
 async def startup_event():
-    """アプリケーション起動時の処理"""
+    """アプリケーション起動時の処理（読み込み完了までは /health/ready が503を返す）"""
+    global startup_task
     logger.info("アプリケーションを開始しています...")
-    load_data()
+    metrics.set_gauge("ready", 0, "トラフィックを受け付けられる状態か（1: 可）")
+    data_events.bind(asyncio.get_running_loop())
+    startup_task = asyncio.create_task(_start_up())
 
 @app.get("/")
 async def root():
@@ -121,12 +749,42 @@ async def root():
 async def health_check():
     """ヘルスチェックエンドポイント"""
     return {
-        "status": "healthy",
-        "data_loaded": main_data is not None and not main_data.empty,
-        "records_count": len(main_data) if main_data is not None else 0,
+        "status": "healthy" if _is_ready() else startup_state["phase"],
+        "ready": _is_ready(),
+        "startup": startup_state,
+        "data_loaded": _records_count() > 0,
+        "records_count": _records_count(),
+        "storage_backend": STORAGE_BACKEND,
+        "data_version": data_version,
+        "bytes_per_row": round(dataset_memory_bytes / _records_count(), 2) if _records_count() else None,
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/health/live")
+async def liveness_check():
+    """生存確認（プロセスが応答できれば読み込み中でも200）"""
+    uptime = process_uptime_seconds()
+    return {"status": "alive", "phase": startup_state["phase"], "uptime_seconds": round(uptime, 3) if uptime is not None else None}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """受け入れ可否（読み込みとウォームアップが完了するまでは503。進捗を返す）"""
+    body = {
+        "ready": _is_ready(),
+        "phase": startup_state["phase"],
+        "load_phases": startup_state["load_phases"],
+        "warmup": startup_state["warmup"],
+        "records_count": _records_count(),
+        "data_version": data_version,
+        "error": startup_state["error"]
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus形式のメトリクスを取得"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/summary", response_model=SummaryResponse)
 async def get_summary():
     """サマリー統計を取得"""
@@ -143,6 +801,21 @@ async def get_diseases():
     
     return {"diseases": disease_list}
 
+@app.get("/diseases/search")
+async def search_diseases(
+    q: str = Query("", description="疾病名の一部（全角・半角、カタカナ・ひらがなを区別しない）"),
+    limit: int = Query(10, description="取得件数", ge=1, le=SEARCH_MAX_LIMIT),
+    source: Optional[str] = Query(None, description="対象（notifiable: 届出疾病, sentinel: 定点把握疾病）")
+):
+    """疾病名の候補を検索（先頭一致を優先し、報告数の多い順）"""
+    if search_index is None or not len(search_index):
+        raise HTTPException(status_code=404, detail="疾病リストが見つかりません")
+    if source is not None and source not in ('notifiable', 'sentinel'):
+        raise HTTPException(status_code=400, detail="source は notifiable または sentinel を指定してください")
+    
+    result = search_index.search(q, limit, source)
+    return dict(result, query=q)
+
 @app.get("/diseases/{disease_name}/timeseries")
 async def get_disease_timeseries(
     disease_name: str,
@@ -150,11 +823,28 @@ async def get_disease_timeseries(
     end_year: Optional[int] = Query(None, description="終了年")
 ):
     """特定疾病の時系列データを取得"""
+    return await _cached("timeseries", _disease_timeseries, disease_name, start_year, end_year)
+
+def _disease_timeseries(disease_name: str, start_year: Optional[int], end_year: Optional[int]) -> Dict:
+    """/diseases/{disease_name}/timeseries の応答を作成"""
+    store = _query_store()
+    if store is not None:
+        if not store.disease_exists(disease_name):
+            raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' のデータが見つかりません")
+        timeseries_data = store.disease_timeseries(disease_name, start_year, end_year)
+        if not timeseries_data:
+            raise HTTPException(status_code=404, detail="指定された条件のデータが見つかりません")
+        return {
+            "disease_name": disease_name,
+            "data": timeseries_data,
+            "total_records": len(timeseries_data)
+        }
+    
     if main_data is None or main_data.empty:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
     # 疾病名でフィルタリング
-    disease_data = main_data[main_data['disease_name'] == disease_name].copy()
+    disease_data = main_data[main_data['disease_name'] == disease_name]
     
     if disease_data.empty:
         raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' のデータが見つかりません")
@@ -171,13 +861,12 @@ async def get_disease_timeseries(
     # 日付でソート
     disease_data = disease_data.sort_values('report_date')
     
-    # 時系列データを作成
-    timeseries_data = []
-    for _, row in disease_data.iterrows():
-        timeseries_data.append({
-            "date": row['report_date'].strftime('%Y-%m-%d'),
-            "value": row['count']
-        })
+    # 時系列データを作成（行ごとではなく列単位で変換）
+    dates = disease_data['report_date'].astype('datetime64[ns]').dt.strftime('%Y-%m-%d').tolist()
+    timeseries_data = [
+        {"date": d, "value": v}
+        for d, v in zip(dates, disease_data['count'].tolist())
+    ]
     
     return {
         "disease_name": disease_name,
@@ -185,32 +874,65 @@ async def get_disease_timeseries(
         "total_records": len(timeseries_data)
     }
 
+@app.get("/seasonality/{disease_name}")
+async def get_seasonality(
+    disease_name: str,
+    start_year: Optional[int] = Query(None, description="開始年"),
+    end_year: Optional[int] = Query(None, description="終了年")
+):
+    """疾病の季節性（年 × 週のヒートマップと、週ごとの複数年の平均・パーセンタイル帯）を取得"""
+    if seasonality_cube is None:
+        raise HTTPException(status_code=404, detail="データが見つかりません")
+    if disease_name not in seasonality_cube:
+        raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' のデータが見つかりません")
+    
+    result = seasonality_cube.disease(disease_name, start_year, end_year)
+    if result is None:
+        raise HTTPException(status_code=404, detail="指定された条件のデータが見つかりません")
+    return dict({"disease_name": disease_name}, **result, data_version=data_version)
+
 @app.get("/diseases/top")
 async def get_top_diseases(
     limit: int = Query(10, description="取得件数"),
     year: Optional[int] = Query(None, description="対象年")
 ):
     """報告数上位の疾病を取得"""
+    return await _cached("diseases_top", _top_diseases, limit, year)
+
+def _top_diseases(limit: int, year: Optional[int]) -> Dict:
+    """/diseases/top の応答を作成"""
+    store = _query_store()
+    if store is not None:
+        result = store.top_diseases(limit, year)
+        if year and not result:
+            raise HTTPException(status_code=404, detail=f"{year}年のデータが見つかりません")
+        return {
+            "top_diseases": result,
+            "year": year,
+            "total_diseases": len(result)
+        }
+    
     if main_data is None or main_data.empty:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
-    data = main_data.copy()
-    
-    # 年でフィルタリング
+    # 年でフィルタリング（全体のコピーは作らない）
+    data = main_data
     if year:
         data = data[data['year'] == year]
         if data.empty:
             raise HTTPException(status_code=404, detail=f"{year}年のデータが見つかりません")
     
-    # 疾病別合計を計算
-    top_diseases = data.groupby('disease_name')['count'].sum().sort_values(ascending=False).head(limit)
+    # 疾病別合計と分類を1回の集計で求める
+    top_diseases = data.groupby('disease_name', observed=True).agg(
+        total=('count', 'sum'), category=('category', 'first')
+    ).sort_values('total', ascending=False, kind='stable').head(limit)
     
     result = []
-    for disease, count in top_diseases.items():
+    for disease, total, category in zip(top_diseases.index, top_diseases['total'].tolist(), top_diseases['category']):
         result.append({
-            "disease_name": disease,
-            "total_count": int(count),
-            "category": data[data['disease_name'] == disease]['category'].iloc[0]
+            "disease_name": str(disease),
+            "total_count": int(total),
+            "category": str(category)
         })
     
     return {
@@ -222,10 +944,18 @@ async def get_top_diseases(
 @app.get("/categories")
 async def get_categories():
     """感染症分類別統計を取得"""
+    return await _cached("categories", _categories)
+
+def _categories() -> Dict:
+    """/categories の応答を作成"""
+    store = _query_store()
+    if store is not None:
+        return {"categories": store.categories()}
+    
     if main_data is None or main_data.empty:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
-    category_stats = main_data.groupby('category').agg({
+    category_stats = main_data.groupby('category', observed=True).agg({
         'count': 'sum',
         'disease_name': 'nunique'
     }).round().astype(int)
@@ -233,9 +963,9 @@ async def get_categories():
     result = []
     for category, stats in category_stats.iterrows():
         result.append({
-            "category": category,
-            "total_count": stats['count'],
-            "disease_count": stats['disease_name']
+            "category": str(category),
+            "total_count": int(stats['count']),
+            "disease_count": int(stats['disease_name'])
         })
     
     return {"categories": result}
@@ -243,10 +973,18 @@ async def get_categories():
 @app.get("/yearly-trends")
 async def get_yearly_trends():
     """年別感染症発生動向を取得"""
+    return await _cached("yearly_trends", _yearly_trends)
+
+def _yearly_trends() -> Dict:
+    """/yearly-trends の応答を作成"""
+    store = _query_store()
+    if store is not None:
+        return {"yearly_trends": store.yearly_trends()}
+    
     if main_data is None or main_data.empty:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
-    yearly_data = main_data.groupby('year')['count'].sum().sort_index()
+    yearly_data = main_data.groupby('year', observed=True)['count'].sum().sort_index()
     
     result = []
     for year, count in yearly_data.items():
@@ -257,14 +995,499 @@ async def get_yearly_trends():
     
     return {"yearly_trends": result}
 
+@app.get("/export.xlsx")
+async def export_workbook(
+    disease: Optional[List[str]] = Query(None, description="疾病名（指定した疾病ごとにシートを作成。省略時は分類ごと）"),
+    start_year: Optional[int] = Query(None, description="開始年"),
+    end_year: Optional[int] = Query(None, description="終了年")
+):
+    """レコードをExcelブック（分類別または疾病別のシート）で出力"""
+    if _query_store() is None and (main_data is None or main_data.empty):
+        raise HTTPException(status_code=404, detail="データが見つかりません")
+    
+    if disease:
+        diseases = list(dict.fromkeys(d.strip() for value in disease for d in value.split(',') if d.strip()))
+        unknown = await run_in_threadpool(_unknown_diseases, diseases)
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"疾病 '{', '.join(unknown)}' のデータが見つかりません")
+        sheets = [(name, functools.partial(_record_batches, name, start_year, end_year)) for name in diseases]
+    else:
+        sheets = [
+            (name, functools.partial(_record_batches, None, start_year, end_year, name))
+            for name in await run_in_threadpool(_category_names)
+        ]
+    
+    # ブックの作成はCPUを使うためスレッドプールで実行し、同時作成数を制限する
+    async with xlsx_export_semaphore:
+        phase_start = time.perf_counter()
+        output, size, row_counts = await run_in_threadpool(build_workbook_file, sheets)
+        seconds = time.perf_counter() - phase_start
+    rows = sum(row_counts.values())
+    export_metrics_recorder(metrics, "xlsx")(rows, seconds)
+    logger.info(f"Excelブックを作成しました: {len(row_counts)} シート, {rows} 行, {size} バイト, {seconds * 1000:.0f}ms")
+    
+    return StreamingResponse(
+        iter_file(output),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": 'attachment; filename="infectious_diseases.xlsx"',
+            "Content-Length": str(size)
+        }
+    )
+
+@app.get("/query")
+async def run_query(
+    disease: Optional[List[str]] = Query(None, description="疾病名（複数指定・カンマ区切り可）"),
+    category: Optional[List[str]] = Query(None, description="感染症分類（複数指定・カンマ区切り可）"),
+    start_year: Optional[int] = Query(None, description="開始年"),
+    end_year: Optional[int] = Query(None, description="終了年"),
+    start_week: Optional[int] = Query(None, description="開始週"),
+    end_week: Optional[int] = Query(None, description="終了週"),
+    group_by: Optional[List[str]] = Query(None, description="グループ化（disease, category, year, week の組み合わせ）"),
+    agg: str = Query("sum", description="集計方法（sum, mean, max）"),
+    top: Optional[int] = Query(None, description="集計値の上位N件のみ取得", le=QUERY_MAX_TOP)
+):
+    """絞り込み・グループ化・集計を指定して報告数を集計"""
+    try:
+        plan = normalize_plan(disease, category, start_year, end_year, start_week, end_week, group_by, agg, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    cache_key = (data_version, plan)
+    cached = query_cache.get(cache_key)
+    metrics.record_cache("query_plan", cached is not None)
+    if cached is not None:
+        return dict(cached, cached=True)
+    
+    if sqlite_store is not None:
+        engine = sqlite_store
+    else:
+        engine = _query_table()
+    if engine is None:
+        raise HTTPException(status_code=404, detail="データが見つかりません")
+    
+    # 結果の件数が上限を超えうるクエリは、上位N件の指定か条件の絞り込みを求める
+    estimated = estimate_groups(plan, await run_in_threadpool(engine.dimensions))
+    if plan.top is None and estimated > QUERY_MAX_GROUPS:
+        metrics.inc_counter("query_rejected_total", 1, "コスト上限により拒否した /query の件数")
+        raise HTTPException(
+            status_code=400,
+            detail=f"結果が最大 {estimated:,} 件になるため実行できません（上限 {QUERY_MAX_GROUPS:,} 件）。"
+                   "top を指定するか、条件を絞り込んでください"
+        )
+    
+    rows = await _coalesced("query", engine.execute, plan)
+    result = {
+        "plan": plan.to_dict(),
+        "rows": rows,
+        "row_count": len(rows),
+        "estimated_groups": estimated,
+        "data_version": data_version
+    }
+    query_cache.put(cache_key, result)
+    metrics.set_gauge("query_cache_entries", len(query_cache), "/query のキャッシュ済みプラン数")
+    return dict(result, cached=False)
+
+def _compute_correlations(start_year: Optional[int], end_year: Optional[int], max_lag: int):
+    """週 × 疾病の行列を組み立てて全組み合わせの相関を求める（スレッドプールで実行）"""
+    engine = sqlite_store if sqlite_store is not None else _query_table()
+    if engine is None:
+        return None
+    names, totals = engine.weekly_totals(start_year, end_year)
+    return lagged_correlations(weekly_matrix(names, totals), max_lag)
+
+@app.get("/correlations")
+async def get_correlations(
+    disease: Optional[List[str]] = Query(None, description="疾病名（指定した疾病を含む組み合わせのみ。複数指定・カンマ区切り可）"),
+    start_year: Optional[int] = Query(None, description="開始年"),
+    end_year: Optional[int] = Query(None, description="終了年"),
+    max_lag: int = Query(0, description="探索するラグの最大週数（前後とも）", ge=0, le=MAX_LAG_WEEKS),
+    min_correlation: Optional[float] = Query(None, description="相関係数の下限", ge=-1, le=1),
+    top: int = Query(20, description="取得件数", ge=1, le=QUERY_MAX_TOP)
+):
+    """疾病間の週別報告数の相関（ラグ付き）を相関の高い順に取得"""
+    if start_year is not None and end_year is not None and start_year > end_year:
+        raise HTTPException(status_code=400, detail="start_year は end_year 以下を指定してください")
+    diseases = list(dict.fromkeys(d.strip() for value in disease or [] for d in value.split(',') if d.strip()))
+    unknown = await run_in_threadpool(_unknown_diseases, diseases) if diseases else []
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"疾病 '{', '.join(unknown)}' のデータが見つかりません")
+    
+    # 全組み合わせの相関はデータの版・期間・ラグごとに1度だけ計算し、疾病の絞り込みと上位N件は都度行う
+    cache_key = (data_version, start_year, end_year, max_lag)
+    result = correlation_cache.get(cache_key)
+    metrics.record_cache("correlations", result is not None)
+    cached = result is not None
+    if result is None:
+        result = await _coalesced("correlations", _compute_correlations, start_year, end_year, max_lag)
+        if result is None:
+            raise HTTPException(status_code=404, detail="データが見つかりません")
+        correlation_cache.put(cache_key, result)
+    if result.weeks < 3:
+        raise HTTPException(status_code=404, detail="指定された条件のデータが見つかりません")
+    
+    pairs = correlation_pairs(result, diseases, top, min_correlation)
+    return {
+        "start_year": start_year,
+        "end_year": end_year,
+        "max_lag": max_lag,
+        "weeks": result.weeks,
+        "disease_count": len(result.diseases),
+        "pairs": pairs,
+        "data_version": data_version,
+        "cached": cached
+    }
+
+@app.get("/export")
+async def export_records(
+    export_format: str = Query("csv", alias="format", description="出力形式（csv, ndjson）"),
+    disease_name: Optional[str] = Query(None, description="疾病名（省略時は全疾病）"),
+    start_year: Optional[int] = Query(None, description="開始年"),
+    end_year: Optional[int] = Query(None, description="終了年")
+):
+    """レコードをCSVまたはNDJSONでストリーミング出力"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"出力形式は {', '.join(EXPORT_FORMATS)} のいずれかを指定してください")
+    
+    if _query_store() is None and (main_data is None or main_data.empty):
+        raise HTTPException(status_code=404, detail="データが見つかりません")
+    if disease_name is not None and not await run_in_threadpool(_disease_exists, disease_name):
+        raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' のデータが見つかりません")
+    batches = _record_batches(disease_name, start_year, end_year)
+    
+    return StreamingResponse(
+        stream_export(batches, export_format, export_metrics_recorder(metrics, export_format)),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="infectious_diseases.{export_format}"'}
+    )
+
+@app.get("/datasets")
+async def list_datasets():
+    """処理済みデータセットの一覧（読み込み状態とメモリ使用量）"""
+    return {
+        "datasets": dataset_registry.describe(),
+        "resident_bytes": dataset_registry.resident_bytes(),
+        "memory_budget_bytes": dataset_registry.memory_budget_bytes
+    }
+
+def _dataset_records(name: str, limit: int, offset: int, disease_name: Optional[str]) -> Dict:
+    """/datasets/{name} の応答を作成（未読み込みのデータセットはここで読み込む）"""
+    try:
+        df = dataset_registry.get(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"データセット '{name}' が見つかりません")
+    if not hasattr(df, 'iloc'):
+        raise HTTPException(status_code=400, detail=f"データセット '{name}' は表形式ではありません")
+    if disease_name is not None:
+        if 'disease_name' not in df.columns:
+            raise HTTPException(status_code=400, detail=f"データセット '{name}' は疾病名で絞り込めません")
+        df = df[df['disease_name'] == disease_name]
+    page = df.iloc[offset:offset + limit]
+    return {
+        "name": name,
+        "columns": [str(c) for c in df.columns],
+        "total_rows": len(df),
+        "offset": offset,
+        "limit": limit,
+        "rows": json.loads(page.to_json(orient='records', force_ascii=False))
+    }
+
+@app.get("/datasets/{name:path}")
+async def get_dataset(
+    name: str,
+    limit: int = Query(100, description="取得件数", ge=1, le=DATASET_MAX_ROWS),
+    offset: int = Query(0, description="開始位置", ge=0),
+    disease_name: Optional[str] = Query(None, description="疾病名で絞り込み")
+):
+    """データセットのレコードを取得（初回アクセス時に読み込み、メモリ予算を超えたら古いものから解放）"""
+    if name not in dataset_registry:
+        raise HTTPException(status_code=404, detail=f"データセット '{name}' が見つかりません")
+    return await _coalesced("datasets", _dataset_records, name, limit, offset, disease_name)
+
+def _sentinel_cube(name: str):
+    """定点把握データのキューブ（データセットレジストリ経由でメモリマップ）"""
+    try:
+        return dataset_registry.get(name)
+    except (KeyError, OSError, ValueError):
+        raise HTTPException(status_code=404, detail="定点把握データのキューブが見つかりません。sentinel_data_processor.py を実行してください")
+
+def _sentinel_age(disease_name: str, start_year: Optional[int], start_week: Optional[int],
+                  end_year: Optional[int], end_week: Optional[int]) -> Dict:
+    """/sentinel/{disease_name}/age の応答を作成（週の範囲を切り出して年齢階級ごとに合計）"""
+    cube = _sentinel_cube(AGE_CUBE_NAME)
+    if disease_name not in cube:
+        raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' の定点把握データが見つかりません")
+    periods = cube.period_range(start_year, start_week, end_year, end_week)
+    if periods.start == periods.stop:
+        raise HTTPException(status_code=404, detail="指定された条件のデータが見つかりません")
+    
+    counts = cube.breakdown(disease_name, periods)
+    total = sum(counts)
+    return {
+        "disease_name": disease_name,
+        "start": cube.period_label(periods.start),
+        "end": cube.period_label(periods.stop - 1),
+        "weeks": periods.stop - periods.start,
+        "total_count": total,
+        "age_bands": [
+            {"age_band": label, "count": count, "share": round(count / total, 4) if total else None}
+            for label, count in zip(cube.labels, counts)
+        ]
+    }
+
+@app.get("/sentinel/{disease_name}/age")
+async def get_sentinel_age(
+    disease_name: str,
+    start_year: Optional[int] = Query(None, description="開始年"),
+    start_week: Optional[int] = Query(None, description="開始週（開始年の何週目から）", ge=1, le=53),
+    end_year: Optional[int] = Query(None, description="終了年"),
+    end_week: Optional[int] = Query(None, description="終了週（終了年の何週目まで）", ge=1, le=53)
+):
+    """定点把握疾病の年齢階級別の報告数（指定した週の範囲の合計）"""
+    if (start_week is not None and start_year is None) or (end_week is not None and end_year is None):
+        raise HTTPException(status_code=400, detail="週を指定する場合は年も指定してください")
+    return await _coalesced("sentinel_age", _sentinel_age, disease_name, start_year, start_week, end_year, end_week)
+
+def _region_cube(disease_name: Optional[str] = None):
+    cube = _sentinel_cube(REGION_CUBE_NAME)
+    if disease_name is not None and disease_name not in cube:
+        raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' の定点把握データが見つかりません")
+    return cube
+
+@app.get("/sentinel/regions")
+async def get_sentinel_regions():
+    """地域の階層（二次保健医療圏 → 保健所）"""
+    cube = _region_cube()
+    return {
+        "levels": list(REGION_LEVELS),
+        "medical_districts": cube.meta.get('hierarchy', []),
+        "start": cube.period_label(0) if cube.periods else None,
+        "end": cube.period_label(len(cube.periods) - 1) if cube.periods else None,
+    }
+
+@app.get("/sentinel/{disease_name}/regions")
+async def get_sentinel_region_map(
+    disease_name: str,
+    year: Optional[int] = Query(None, description="年（省略時は最新の週）"),
+    week: Optional[int] = Query(None, description="週", ge=1, le=53),
+    level: str = Query('health_center', description="地域の階層（health_center: 保健所, medical_district: 二次保健医療圏）")
+):
+    """1週分の地域別の報告数（地図の塗り分け用）"""
+    if level not in REGION_LEVELS:
+        raise HTTPException(status_code=400, detail="level は health_center または medical_district を指定してください")
+    if (year is None) != (week is None):
+        raise HTTPException(status_code=400, detail="年と週は両方指定してください")
+    cube = _region_cube(disease_name)
+    if not cube.periods:
+        raise HTTPException(status_code=404, detail="指定された条件のデータが見つかりません")
+    period = len(cube.periods) - 1 if year is None else cube.period_index(year, week)
+    if period is None:
+        raise HTTPException(status_code=404, detail=f"{year}年第{week}週のデータが見つかりません")
+    
+    counts = cube.week_map(disease_name, period, level)
+    if level == 'medical_district':
+        regions = [{"region": name, "count": count} for name, count in zip(cube.groups, counts)]
+    else:
+        regions = [
+            {"region": name, "medical_district": parent, "count": count}
+            for name, parent, count in zip(cube.labels, cube.parents, counts)
+        ]
+    return {
+        "disease_name": disease_name,
+        "level": level,
+        **cube.period_label(period),
+        "total_count": sum(counts),
+        "max_count": max(counts, default=0),
+        "regions": regions
+    }
+
+@app.get("/sentinel/{disease_name}/regions/{region}/series")
+async def get_sentinel_region_series(
+    disease_name: str,
+    region: str,
+    start_year: Optional[int] = Query(None, description="開始年"),
+    start_week: Optional[int] = Query(None, description="開始週", ge=1, le=53),
+    end_year: Optional[int] = Query(None, description="終了年"),
+    end_week: Optional[int] = Query(None, description="終了週", ge=1, le=53)
+):
+    """地域（保健所または二次保健医療圏）の週別の報告数"""
+    if (start_week is not None and start_year is None) or (end_week is not None and end_year is None):
+        raise HTTPException(status_code=400, detail="週を指定する場合は年も指定してください")
+    cube = _region_cube(disease_name)
+    found = cube.region(region)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"地域 '{region}' が見つかりません")
+    level, columns = found
+    periods = cube.period_range(start_year, start_week, end_year, end_week)
+    if periods.start == periods.stop:
+        raise HTTPException(status_code=404, detail="指定された条件のデータが見つかりません")
+    
+    counts = cube.series(disease_name, columns, periods)
+    return {
+        "disease_name": disease_name,
+        "region": region,
+        "level": level,
+        "medical_district": cube.parents[columns.start] if level == 'health_center' else None,
+        "health_centers": cube.labels[columns] if level == 'medical_district' else None,
+        "data": [
+            {**cube.period_label(periods.start + i), "count": count}
+            for i, count in enumerate(counts)
+        ]
+    }
+
+def _compare(source: str, year: Optional[int], week: Optional[int], window: int, sort: str) -> Dict:
+    """/compare の応答を作成（季節性キューブから全疾病・全分類の比較を一括で計算）"""
+    if source == 'sentinel':
+        cube = sentinel_seasonality_cube
+        categories = {name: "定点把握" for name in cube.diseases} if cube is not None else {}
+    else:
+        cube = seasonality_cube
+        categories = {
+            entry.disease_name: entry.category
+            for entry in (search_index.entries if search_index is not None else []) if entry.source == 'notifiable'
+        }
+    if cube is None:
+        raise HTTPException(status_code=404, detail="データが見つかりません")
+    result = period_comparison(cube, categories, year, week, window, sort)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"{year}年第{week}週のデータが見つかりません")
+    return dict(result, source=source, data_version=data_version)
+
+@app.get("/compare")
+async def get_compare(
+    source: str = Query('notifiable', description="対象（notifiable: 届出疾病, sentinel: 定点把握疾病）"),
+    year: Optional[int] = Query(None, description="基準週の年（省略時はデータの最終週）"),
+    week: Optional[int] = Query(None, description="基準週", ge=1, le=53),
+    window: int = Query(4, description="直近N週と前のN週を比べる週数", ge=1, le=MAX_COMPARE_WINDOW),
+    sort: str = Query('recent', description="並び順（recent: 直近N週の変化量, yoy: 前年同週からの変化量）")
+):
+    """全疾病・全分類の期間比較（基準週と前年同週、直近N週と前のN週の差と比。変化量の大きい順）"""
+    if source not in ('notifiable', 'sentinel'):
+        raise HTTPException(status_code=400, detail="source は notifiable または sentinel を指定してください")
+    if sort not in COMPARE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail="sort は recent または yoy を指定してください")
+    if (year is None) != (week is None):
+        raise HTTPException(status_code=400, detail="年と週は両方指定してください")
+    return await _cached("compare", _compare, source, year, week, window, sort)
+
+@app.get("/forecast")
+async def get_forecast(
+    source: Optional[str] = Query(None, description="対象（notifiable: 届出疾病, sentinel: 定点把握疾病）"),
+    disease_name: Optional[str] = Query(None, description="疾病名")
+):
+    """全疾病（または指定した疾病）の今後4週間の期待報告数と95%予測区間（データの読み込み時に計算済み）"""
+    if source is not None and source not in ('notifiable', 'sentinel'):
+        raise HTTPException(status_code=400, detail="source は notifiable または sentinel を指定してください")
+    if forecasts is None:
+        raise HTTPException(status_code=503, detail="予測がまだ作成されていません")
+    
+    items = [
+        dict(item, source=name)
+        for name, entries in forecasts['sources'].items() if source is None or name == source
+        for item in entries if disease_name is None or item['disease_name'] == disease_name
+    ]
+    if disease_name is not None and not items:
+        raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' の予測が見つかりません")
+    return {
+        "data_version": forecasts['data_version'],
+        "generated_at": forecasts['generated_at'],
+        "horizon_weeks": forecasts['horizon_weeks'],
+        "interval": forecasts['interval'],
+        "forecasts": items
+    }
+
+@app.get("/events/data-version")
+async def data_version_events(request: Request):
+    """
+    データの版の変更イベント（Server-Sent Events）
+    接続時に現在の版を送り、以降は新しい版が公開されるたびに版と変わった疾病・週を送る
+    """
+    events = data_events.open(request.headers.get("last-event-id"), DATA_EVENTS_MAX_CONNECTIONS)
+    if events is None:
+        raise HTTPException(status_code=503, detail="接続数が上限に達しています。しばらくしてから再接続してください")
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # プロキシでバッファリングさせない
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _require_debug_token(request: Request):
+    """/debug/* は Authorization: Bearer <REQUEST_PROFILE_TOKEN> のリクエストだけに応答する"""
+    authorization = request.headers.get("authorization", "")
+    if not REQUEST_PROFILE_TOKEN or not hmac.compare_digest(
+            authorization.encode('utf-8'), f"Bearer {REQUEST_PROFILE_TOKEN}".encode('utf-8')):
+        raise HTTPException(status_code=403, detail="/debug の参照には REQUEST_PROFILE_TOKEN が必要です")
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_request_profile(profile_id: str, request: Request):
+    """X-Profile-Token で計測したリクエストの詳細（Authorization: Bearer <トークン> が必要）"""
+    _require_debug_token(request)
+    profile = load_profile(REQUEST_PROFILE_DIR, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"プロファイル '{profile_id}' が見つかりません")
+    return profile
+
+def _memory_report(top: int) -> Dict:
+    """/debug/memory の応答を作成（GCで回収してから各構造のサイズを測る）"""
+    phase_start = time.perf_counter()
+    gc.collect()
+    structures = {
+        "main_data": frame_columns(main_data),
+        "startup_snapshot": dict(
+            array_columns(startup_snapshot.arrays), segment=startup_snapshot.segment, mapped_bytes=startup_snapshot.nbytes()
+        ) if startup_snapshot is not None else None,
+        "shared_dataset": {"segment": shared_dataset.segment, "mapped_bytes": shared_dataset.nbytes()}
+        if shared_dataset is not None and shared_dataset.header is not None else None,
+        "query_table": dict(
+            array_columns(query_table.columns), code_tables_bytes=deep_sizeof(query_table.code_tables)
+        ) if query_table is not None else None,
+        "summary_stats": deep_sizeof(summary_stats),
+        "disease_list": deep_sizeof(disease_list),
+        "search_index": deep_sizeof(search_index) if search_index is not None else None,
+        "seasonality_cube": seasonality_cube.nbytes() if seasonality_cube is not None else None,
+        "dataset_registry": {
+            "resident_bytes": dataset_registry.resident_bytes(),
+            "datasets": [d for d in dataset_registry.describe() if d["loaded"]],
+        },
+    }
+    caches = {
+        name: {"entries": len(cache), "max_entries": cache.max_entries, "bytes": deep_sizeof(cache)}
+        for name, cache in (("query", query_cache), ("correlation", correlation_cache), ("response", response_cache))
+    }
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "data_version": data_version,
+        "process_resident_bytes": process_resident_memory_bytes(),
+        "structures": structures,
+        "caches": caches,
+        "live_objects": live_objects(),
+        "allocations": allocation_tracker.report(top),
+        "report_ms": round((time.perf_counter() - phase_start) * 1000, 1),
+    }
+
+@app.get("/debug/memory")
+async def get_debug_memory(
+    request: Request,
+    top: int = Query(20, description="割り当ての差分を表示する件数", ge=1, le=200)
+):
+    """
+    読み込み済みのデータ・インデックス・キャッシュのメモリ使用量と、
+    データ読み込みごとの tracemalloc スナップショットの差分（MEMORY_TRACE=1 のとき）
+    """
+    _require_debug_token(request)
+    return await run_in_threadpool(_memory_report, top)
+
 @app.get("/reload-data")
 async def reload_data():
     """データの再読み込み"""
     try:
-        load_data()
+        await load_data()
+        # 再読み込みでキャッシュは空になるため、初期画面の応答をバックグラウンドで計算し直す
+        asyncio.create_task(_warm_up())
         return {
             "message": "データを再読み込みしました",
-            "records_count": len(main_data) if main_data is not None else 0,
+            "records_count": _records_count(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+/debug/memory 用のメモリ使用量の調査
+読み込み済みの各構造のサイズ（DataFrameは列ごと、辞書・リスト・オブジェクトは中身を含めた概算）と、
+データを読み込むたびに取る tracemalloc のスナップショットの差分を返します。
+再読み込みの前後で増え続けている割り当て元があれば、旧データが解放されていないことが分かります。
+"""
+
+import gc
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# 生存数を数える型（クラス名）
+TRACKED_TYPES = ('DataFrame', 'Series', 'ColumnarTable', 'StartupSnapshot', 'SharedDataset',
+                 'SeasonalityCube', 'SentinelCube', 'DiseaseSearchIndex')
+
+
+def deep_sizeof(value: Any) -> int:
+    """
+    オブジェクトが参照する中身を含めたサイズの概算（バイト）
+    numpy配列は nbytes（メモリマップは割り当て済みの大きさ）、pandas はディープな memory_usage を使う
+    """
+    seen = set()
+    stack = [value]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if hasattr(obj, 'memory_usage') and hasattr(obj, 'dtypes'):
+            usage = obj.memory_usage(deep=True)
+            total += int(usage.sum() if hasattr(usage, 'sum') else usage)
+            continue
+        if isinstance(obj, np.ndarray):
+            # 自前のバッファを持つ配列は getsizeof にバッファが含まれる
+            total += sys.getsizeof(obj) + (0 if obj.flags.owndata else int(obj.nbytes))
+            continue
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, int, float, bool, type(None))):
+            continue
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for slot in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return total
+
+
+def frame_columns(df) -> Optional[Dict]:
+    """DataFrameの列ごとの型とメモリ使用量"""
+    if df is None:
+        return None
+    usage = df.memory_usage(deep=True)
+    return {
+        "rows": len(df),
+        "bytes": int(usage.sum()),
+        "columns": {
+            str(name): {"dtype": str(df[name].dtype) if name in df.columns else "index", "bytes": int(size)}
+            for name, size in usage.items()
+        },
+    }
+
+
+def array_columns(arrays: Dict[str, Any]) -> Dict:
+    """numpy配列の辞書（列データ）の配列ごとのサイズ"""
+    return {
+        "bytes": int(sum(int(a.nbytes) for a in arrays.values())),
+        "columns": {name: {"dtype": str(a.dtype), "bytes": int(a.nbytes)} for name, a in arrays.items()},
+    }
+
+
+def live_objects(type_names: Iterable[str] = TRACKED_TYPES) -> Dict[str, int]:
+    """GCが追跡しているオブジェクトのうち、指定したクラス名のものの生存数（旧データの残留の確認用）"""
+    wanted = set(type_names)
+    counts = Counter(
+        type(obj).__name__ for obj in gc.get_objects() if type(obj).__name__ in wanted
+    )
+    return {name: counts.get(name, 0) for name in type_names}
+
+
+class AllocationTracker:
+    """
+    データの読み込みごとに tracemalloc のスナップショットを取る
+    保持するのは最初・直前・最新の3つだけ（スナップショット自体もメモリを使うため）
+    """
+
+    def __init__(self, enabled: bool = False, frames: int = 1):
+        self.enabled = enabled
+        self.frames = frames
+        self.first: Optional[Dict] = None
+        self.previous: Optional[Dict] = None
+        self.latest: Optional[Dict] = None
+        self.count = 0
+        self._lock = threading.Lock()
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def take(self, label: str):
+        """不要になったオブジェクトを回収してからスナップショットを取る"""
+        if not self.enabled:
+            return
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        current, _ = tracemalloc.get_traced_memory()
+        entry = {"label": label, "taken_at": datetime.now().isoformat(), "traced_bytes": current, "snapshot": snapshot}
+        with self._lock:
+            self.count += 1
+            if self.first is None:
+                self.first = entry
+            else:
+                self.previous = self.latest
+            self.latest = entry
+
+    @staticmethod
+    def _compare(newer: Dict, older: Dict, top: int) -> Dict:
+        stats = newer["snapshot"].compare_to(older["snapshot"], 'lineno')
+        return {
+            "from": older["label"],
+            "to": newer["label"],
+            "size_diff_bytes": sum(stat.size_diff for stat in stats),
+            "count_diff": sum(stat.count_diff for stat in stats),
+            "top": [
+                {
+                    "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff_bytes": stat.size_diff,
+                    "size_bytes": stat.size,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[:top]
+            ],
+        }
+
+    def report(self, top: int = 20) -> Dict:
+        if not self.enabled:
+            return {"enabled": False}
+        with self._lock:
+            first, previous, latest, count = self.first, self.previous, self.latest, self.count
+        current, peak = tracemalloc.get_traced_memory()
+        entries = [entry for entry in (first, previous, latest) if entry is not None]
+        snapshots: List[Dict] = [
+            {key: entry[key] for key in ("label", "taken_at", "traced_bytes")}
+            for i, entry in enumerate(entries) if all(entry is not other for other in entries[:i])
+        ]
+        return {
+            "enabled": True,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "snapshots_taken": count,
+            "snapshots": snapshots,
+            "since_previous": self._compare(latest, previous, top) if previous is not None else None,
+            "since_first": self._compare(latest, first, top) if latest is not None and latest is not first else None,
+        }
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Prometheusテキスト形式のメトリクス収集
+main.py / simple_main.py の両方から利用する軽量実装（標準ライブラリのみ）
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# リクエストレイテンシのヒストグラム境界（秒）
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# ルーティングに一致しなかったリクエストのラベル（パスをそのままラベルにしない）
+UNMATCHED_ROUTE = "<unmatched>"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _escape_label_value(value: str) -> str:
+    """ラベル値をPrometheusテキスト形式用にエスケープ"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    """ラベルを {a="1",b="2"} 形式に整形"""
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    """数値をPrometheusテキスト形式に整形"""
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """固定バケットの累積ヒストグラム"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """(上限, 累積件数) のリストを返す（最後は +Inf）"""
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+class MetricsRegistry:
+    """APIサーバー1プロセス分のメトリクスを保持"""
+
+    def __init__(self, prefix: str = "idsc"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._latency: Dict[LabelKey, Histogram] = {}
+        self._requests: Dict[LabelKey, int] = {}
+        self._in_flight: Dict[LabelKey, int] = {}
+        self._cache: Dict[str, List[int]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._help: Dict[str, str] = {}
+        self.started_at = time.time()
+
+    # --- リクエスト ---
+
+    def request_started(self, method: str, route: str):
+        key = (("method", method), ("route", route))
+        with self._lock:
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def request_finished(self, method: str, route: str, status: int, seconds: float):
+        key = (("method", method), ("route", route))
+        status_key = key + (("status", str(status)),)
+        with self._lock:
+            self._in_flight[key] -= 1
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            histogram.observe(seconds)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+
+    # --- キャッシュ ---
+
+    def record_cache(self, name: str, hit: bool):
+        """キャッシュの参照結果を記録（name はキャッシュ名）"""
+        with self._lock:
+            stats = self._cache.get(name)
+            if stats is None:
+                stats = self._cache[name] = [0, 0]
+            stats[0 if hit else 1] += 1
+
+    # --- 汎用カウンター / ゲージ ---
+
+    def inc_counter(self, name: str, value: float = 1, help_text: str = "", **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def set_gauge(self, name: str, value: float, help_text: str = "", **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def record_load_phases(self, phases: Dict[str, float]):
+        """load_data のフェーズ別所要時間（秒）を記録"""
+        for phase, seconds in phases.items():
+            self.set_gauge(
+                "data_load_phase_seconds", seconds,
+                "直近の load_data のフェーズ別所要時間（秒）", phase=phase
+            )
+        self.set_gauge(
+            "data_load_duration_seconds", sum(phases.values()),
+            "直近の load_data の合計所要時間（秒）"
+        )
+        self.set_gauge(
+            "data_load_timestamp_seconds", time.time(),
+            "直近の load_data の完了時刻（UNIX秒）"
+        )
+        self.inc_counter("data_loads_total", 1, "load_data の実行回数")
+
+    # --- 出力 ---
+
+    def render(self) -> str:
+        """Prometheusテキスト形式（version 0.0.4）で出力"""
+        p = self.prefix
+        lines: List[str] = []
+        with self._lock:
+            latency = {k: (h.cumulative(), h.sum, h.count) for k, h in self._latency.items()}
+            requests = dict(self._requests)
+            in_flight = dict(self._in_flight)
+            cache = {k: tuple(v) for k, v in self._cache.items()}
+            counters = {k: dict(v) for k, v in self._counters.items()}
+            gauges = {k: dict(v) for k, v in self._gauges.items()}
+            help_texts = dict(self._help)
+
+        name = f"{p}_http_request_duration_seconds"
+        lines.append(f"# HELP {name} エンドポイント別のリクエスト処理時間（秒）")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, (buckets, total, count) in sorted(latency.items()):
+            for bound, cumulative in buckets:
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        name = f"{p}_http_requests_total"
+        lines.append(f"# HELP {name} エンドポイント・ステータス別のリクエスト数")
+        lines.append(f"# TYPE {name} counter")
+        for labels, count in sorted(requests.items()):
+            lines.append(f"{name}{_format_labels(labels)} {count}")
+
+        name = f"{p}_http_requests_in_flight"
+        lines.append(f"# HELP {name} エンドポイント別の処理中リクエスト数")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, count in sorted(in_flight.items()):
+            lines.append(f"{name}{_format_labels(labels)} {count}")
+
+        lines.append(f"# HELP {p}_cache_requests_total キャッシュ参照数（result=hit|miss）")
+        lines.append(f"# TYPE {p}_cache_requests_total counter")
+        for cache_name, (hits, misses) in sorted(cache.items()):
+            lines.append(f'{p}_cache_requests_total{{cache="{cache_name}",result="hit"}} {hits}')
+            lines.append(f'{p}_cache_requests_total{{cache="{cache_name}",result="miss"}} {misses}')
+        lines.append(f"# HELP {p}_cache_hit_ratio キャッシュヒット率")
+        lines.append(f"# TYPE {p}_cache_hit_ratio gauge")
+        for cache_name, (hits, misses) in sorted(cache.items()):
+            total = hits + misses
+            ratio = hits / total if total else 0.0
+            lines.append(f'{p}_cache_hit_ratio{{cache="{cache_name}"}} {_format_value(ratio)}')
+
+        for kind, series_by_name in (("counter", counters), ("gauge", gauges)):
+            for metric, series in sorted(series_by_name.items()):
+                name = f"{p}_{metric}"
+                if metric in help_texts:
+                    lines.append(f"# HELP {name} {help_texts[metric]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        rss = process_resident_memory_bytes()
+        if rss is not None:
+            lines.append(f"# HELP {p}_process_resident_memory_bytes プロセスの常駐メモリ量（バイト）")
+            lines.append(f"# TYPE {p}_process_resident_memory_bytes gauge")
+            lines.append(f"{p}_process_resident_memory_bytes {rss}")
+        lines.append(f"# HELP {p}_process_start_time_seconds プロセス起動時刻（UNIX秒）")
+        lines.append(f"# TYPE {p}_process_start_time_seconds gauge")
+        lines.append(f"{p}_process_start_time_seconds {_format_value(self.started_at)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def process_resident_memory_bytes() -> Optional[int]:
+    """プロセスの常駐メモリ量を取得（Linux以外では None）"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_uptime_seconds() -> Optional[float]:
+    """プロセス起動からの経過秒数（Linux以外では None）"""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # comm にスペースや括弧が含まれる場合があるため、最後の ')' 以降を分割する
+            fields = f.read().rsplit(')', 1)[1].split()
+        start_ticks = int(fields[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MetricsMiddleware:
+    """
+    リクエストごとのレイテンシと処理中件数を記録するASGIミドルウェア
+    ラベルはURLではなくルートのパステンプレート（例: /diseases/{disease_name}/timeseries）を使う
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    @staticmethod
+    def _route_template(scope) -> str:
+        from starlette.routing import Match
+
+        app = scope.get("app")
+        router = getattr(app, "router", None)
+        if router is None:
+            return UNMATCHED_ROUTE
+        for route in router.routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return getattr(route, "path", UNMATCHED_ROUTE)
+        return UNMATCHED_ROUTE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route_template(scope)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        self.registry.request_started(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.request_finished(method, route, status[0], time.perf_counter() - start)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+年（と任意で感染症分類）単位のパーティション分割データセット
+データ処理スクリプトがレコードを1回走査するだけで全パーティションを書き出し、
+行数と日付範囲を記録したインデックスを保存します。APIサーバーはインデックスを見て、
+対象期間にかかるパーティションだけを読み込みます（標準ライブラリのみ）。
+
+ディレクトリ構成:
+    partition_index.json        パーティション一覧（年・分類・行数・最小/最大日付）
+    year=<年>/part.csv          分類で分割しない場合
+    year=<年>/category-<n>.csv  分類で分割する場合（n は分類の通し番号）
+"""
+
+import csv
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PARTITION_DIR_NAME = "partitions"
+INDEX_NAME = "partition_index.json"
+# 配置やインデックスの構成を変えたら上げる
+PARTITION_FORMAT = 1
+
+COLUMNS = ['disease_name', 'count', 'year', 'week', 'report_date', 'category']
+
+# (disease_name, count, year, week, report_date, category)
+RecordTuple = Tuple[str, int, int, int, str, str]
+
+
+class _Partition:
+    __slots__ = ('path', 'year', 'category', 'file', 'writer', 'rows', 'min_date', 'max_date')
+
+    def __init__(self, root: str, path: str, year: int, category: Optional[str]):
+        self.path = path
+        self.year = year
+        self.category = category
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        self.file = open(full_path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+        self.rows = 0
+        self.min_date: Optional[str] = None
+        self.max_date: Optional[str] = None
+
+
+class PartitionedWriter:
+    """
+    レコードを1回の走査でパーティションごとのCSVに振り分ける
+    一時ディレクトリに書き出し、close() でインデックスを保存してから置き換える
+    """
+
+    def __init__(self, directory: str, by_category: bool = False):
+        self.directory = directory
+        self.by_category = by_category
+        self._tmp_directory = directory + ".tmp"
+        self._partitions: Dict[Tuple[int, Optional[str]], _Partition] = {}
+        self._category_numbers: Dict[str, int] = {}
+        if os.path.exists(self._tmp_directory):
+            shutil.rmtree(self._tmp_directory)
+        os.makedirs(self._tmp_directory)
+
+    def _partition(self, year: int, category: str) -> _Partition:
+        key = (year, category if self.by_category else None)
+        partition = self._partitions.get(key)
+        if partition is None:
+            if self.by_category:
+                number = self._category_numbers.setdefault(category, len(self._category_numbers))
+                path = f"year={year}/category-{number:02d}.csv"
+            else:
+                path = f"year={year}/part.csv"
+            partition = self._partitions[key] = _Partition(self._tmp_directory, path, year, key[1])
+        return partition
+
+    def write(self, record: RecordTuple):
+        disease_name, count, year, week, report_date, category = record
+        partition = self._partition(int(year), category)
+        partition.writer.writerow(record)
+        partition.rows += 1
+        day = report_date[:10]
+        if partition.min_date is None or day < partition.min_date:
+            partition.min_date = day
+        if partition.max_date is None or day > partition.max_date:
+            partition.max_date = day
+
+    def write_many(self, records: Iterable[RecordTuple]):
+        for record in records:
+            self.write(record)
+
+    def close(self) -> Dict:
+        """ファイルを閉じてインデックスを保存し、出力先を置き換える"""
+        entries = []
+        for partition in sorted(self._partitions.values(), key=lambda p: (p.year, p.path)):
+            partition.file.close()
+            entries.append({
+                'path': partition.path,
+                'year': partition.year,
+                'category': partition.category,
+                'rows': partition.rows,
+                'min_date': partition.min_date,
+                'max_date': partition.max_date,
+                'bytes': os.path.getsize(os.path.join(self._tmp_directory, partition.path))
+            })
+        self._partitions = {}
+
+        index = {
+            'format': PARTITION_FORMAT,
+            'columns': COLUMNS,
+            'partition_by': ['year', 'category'] if self.by_category else ['year'],
+            'total_rows': sum(e['rows'] for e in entries),
+            'generated_at': datetime.now().isoformat(),
+            'partitions': entries
+        }
+        with open(os.path.join(self._tmp_directory, INDEX_NAME), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+
+        # ディレクトリは原子的に置き換えられないため、旧ディレクトリを退避してから入れ替える
+        old_directory = self.directory + ".old"
+        if os.path.exists(old_directory):
+            shutil.rmtree(old_directory)
+        if os.path.exists(self.directory):
+            os.rename(self.directory, old_directory)
+        os.rename(self._tmp_directory, self.directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+        return index
+
+    def abort(self):
+        """書き込みを中止して一時ディレクトリを削除（出力先は変更しない）"""
+        for partition in self._partitions.values():
+            partition.file.close()
+        self._partitions = {}
+        shutil.rmtree(self._tmp_directory, ignore_errors=True)
+
+
+def write_partitioned_dataset(directory: str, records: Iterable[RecordTuple], by_category: bool = False) -> Dict:
+    """レコードをパーティション分割して保存し、インデックスを返す"""
+    writer = PartitionedWriter(directory, by_category)
+    writer.write_many(records)
+    return writer.close()
+
+
+def read_partition_index(directory: str) -> Optional[Dict]:
+    """パーティションインデックスを読み込む（存在しない・形式が古い場合は None）"""
+    try:
+        with open(os.path.join(directory, INDEX_NAME), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get('format') == PARTITION_FORMAT else None
+
+
+def resolve_year_range(index: Dict, start_year: Optional[int] = None, end_year: Optional[int] = None,
+                       recent_years: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+    """
+    読み込む年範囲を決める
+    recent_years を指定した場合は、インデックス上の最新年から数えた直近N年を対象にする
+    """
+    if recent_years:
+        years = [e['year'] for e in index['partitions']]
+        if years:
+            latest = end_year if end_year is not None else max(years)
+            start_year = max(start_year or 0, latest - recent_years + 1)
+            end_year = latest
+    return start_year, end_year
+
+
+def select_partitions(index: Dict, start_year: Optional[int] = None, end_year: Optional[int] = None,
+                      categories: Optional[List[str]] = None, start_date: Optional[str] = None,
+                      end_date: Optional[str] = None) -> List[Dict]:
+    """条件にかかるパーティションだけを返す（年・分類・日付範囲で枝刈り）"""
+    selected = []
+    for entry in index['partitions']:
+        if start_year is not None and entry['year'] < start_year:
+            continue
+        if end_year is not None and entry['year'] > end_year:
+            continue
+        if categories is not None and entry['category'] is not None and entry['category'] not in categories:
+            continue
+        if start_date is not None and entry['max_date'] is not None and entry['max_date'] < start_date:
+            continue
+        if end_date is not None and entry['min_date'] is not None and entry['min_date'] > end_date:
+            continue
+        selected.append(entry)
+    return selected
+
+
+def partition_paths(directory: str, entries: List[Dict]) -> List[str]:
+    """パーティションのファイルパス"""
+    return [os.path.join(directory, entry['path']) for entry in entries]
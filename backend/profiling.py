@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+データ処理パイプラインのステージ別プロファイラ
+各プロセッサの --profile オプションから利用します（標準ライブラリのみ）
+"""
+
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """ソート済みリストのパーセンタイル（線形補間）"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class _StageFrame:
+    __slots__ = ('name', 'wall_start', 'cpu_start', 'mem_start', 'max_peak', 'child_wall', 'child_cpu')
+
+    def __init__(self, name: str, mem_start: int, max_peak: int):
+        self.name = name
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.mem_start = mem_start
+        self.max_peak = max_peak
+        # 実行中に記録された子ステージ（入れ子の stage() と add_time()）の時間
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+
+
+class NullProfiler:
+    """プロファイル無効時に使う何もしないプロファイラ"""
+
+    enabled = False
+    _null_context = contextlib.nullcontext()
+
+    def stage(self, name: str):
+        return self._null_context
+
+    def add_time(self, name: str, wall_seconds: float, cpu_seconds: float = 0.0, calls: int = 1):
+        pass
+
+    def timer(self, name: str):
+        return None
+
+    def record_file(self, filename: str, wall_seconds: float, cpu_seconds: float = 0.0):
+        pass
+
+
+class StageProfiler:
+    """
+    ステージごとの経過時間・CPU時間・メモリ割り当て量を集計する
+    ステージは入れ子にでき、時間は子ステージ（入れ子の stage() と実行中の add_time()）の分を親ステージから除く
+    （各ステージの時間は重複せず、wall_share の合計は100%を超えない。メモリ割り当て量は子ステージの分も含む）
+    """
+
+    enabled = True
+
+    def __init__(self, name: str, trace_allocations: bool = True):
+        self.name = name
+        self.trace_allocations = trace_allocations
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.files: List[tuple] = []
+        self._stack: List[_StageFrame] = []
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _traced_memory(self):
+        if self.trace_allocations:
+            return tracemalloc.get_traced_memory()
+        return 0, 0
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        current, peak = self._traced_memory()
+        if self._stack:
+            # reset_peak で親ステージのピークが失われないよう退避しておく
+            parent = self._stack[-1]
+            parent.max_peak = max(parent.max_peak, peak)
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+        frame = _StageFrame(name, current, current)
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - frame.wall_start
+            cpu = time.process_time() - frame.cpu_start
+            current, peak = self._traced_memory()
+            absolute_peak = max(frame.max_peak, peak)
+            self._stack.pop()
+            if self._stack:
+                parent = self._stack[-1]
+                parent.max_peak = max(parent.max_peak, absolute_peak)
+                parent.child_wall += wall
+                parent.child_cpu += cpu
+
+            stats = self._stage_stats(name)
+            stats['calls'] += 1
+            stats['wall_seconds'] += wall - frame.child_wall
+            stats['cpu_seconds'] += cpu - frame.child_cpu
+            stats['net_alloc_bytes'] += current - frame.mem_start
+            stats['peak_alloc_bytes'] = max(stats['peak_alloc_bytes'], absolute_peak - frame.mem_start)
+
+    def _stage_stats(self, name: str) -> Dict[str, float]:
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = {
+                'calls': 0,
+                'wall_seconds': 0.0,
+                'cpu_seconds': 0.0,
+                'net_alloc_bytes': 0,
+                'peak_alloc_bytes': 0
+            }
+        return stats
+
+    def add_time(self, name: str, wall_seconds: float, cpu_seconds: float = 0.0, calls: int = 1):
+        """
+        呼び出し側で計測した時間をステージに加算する（メモリ割り当ては計測しない）
+        ループ内の細かい処理を stage() で囲むと計測自体の負荷で結果が歪むため、
+        perf_counter で合計した時間をまとめて記録するのに使う
+        実行中のステージの中で計測した時間なら、そのステージの時間からは除く
+        """
+        if self._stack:
+            frame = self._stack[-1]
+            frame.child_wall += wall_seconds
+            frame.child_cpu += cpu_seconds
+        stats = self._stage_stats(name)
+        stats['calls'] += calls
+        stats['wall_seconds'] += wall_seconds
+        stats['cpu_seconds'] += cpu_seconds
+
+    def timer(self, name: str) -> Callable[[float, float], None]:
+        """name のステージに (経過時間, CPU時間) を加算する関数（timed_lines の record 用）"""
+        return lambda wall_seconds, cpu_seconds: self.add_time(name, wall_seconds, cpu_seconds)
+
+    def record_file(self, filename: str, wall_seconds: float, cpu_seconds: float = 0.0):
+        """ファイル単位の処理時間を記録"""
+        self.files.append((filename, wall_seconds, cpu_seconds))
+
+    def report(self) -> Dict:
+        """JSONシリアライズ可能なレポートを生成"""
+        total_wall = time.perf_counter() - self._wall_start
+        total_cpu = time.process_time() - self._cpu_start
+
+        stages = {}
+        for name, stats in sorted(self.stages.items(), key=lambda x: x[1]['wall_seconds'], reverse=True):
+            stages[name] = dict(stats)
+            stages[name]['wall_share'] = stats['wall_seconds'] / total_wall if total_wall else 0.0
+
+        walls = sorted(f[1] for f in self.files)
+        cpus = sorted(f[2] for f in self.files)
+        files = {
+            'count': len(self.files),
+            'wall_seconds': {
+                'p50': _percentile(walls, 0.50),
+                'p90': _percentile(walls, 0.90),
+                'p99': _percentile(walls, 0.99),
+                'max': walls[-1] if walls else 0.0,
+                'mean': sum(walls) / len(walls) if walls else 0.0
+            },
+            'cpu_seconds': {
+                'p50': _percentile(cpus, 0.50),
+                'p90': _percentile(cpus, 0.90),
+                'p99': _percentile(cpus, 0.99),
+                'max': cpus[-1] if cpus else 0.0
+            },
+            'slowest': [
+                {'file': name, 'wall_seconds': wall, 'cpu_seconds': cpu}
+                for name, wall, cpu in sorted(self.files, key=lambda x: x[1], reverse=True)[:10]
+            ]
+        }
+
+        return {
+            'processor': self.name,
+            'generated_at': datetime.now().isoformat(),
+            'allocations_traced': self.trace_allocations,
+            'total': {'wall_seconds': total_wall, 'cpu_seconds': total_cpu},
+            'stages': stages,
+            'files': files
+        }
+
+    def write_report(self, path: str):
+        """レポートをJSONファイルに書き出し"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def timed_lines(stream: Iterable[str], record: Optional[Callable[[float, float], None]],
+                chunk_size: int = 1 << 16) -> Iterator[str]:
+    """
+    テキストストリームを一定量ずつ読みながら行を返す（全体を文字列や行のリストにしない）
+    読み込み（デコードを含む）の時間は一定量ごとに record(経過時間, CPU時間) に渡す（None なら計測しない）
+    """
+    if record is None:
+        yield from stream
+        return
+    while True:
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        lines = stream.readlines(chunk_size)
+        record(time.perf_counter() - wall_start, time.process_time() - cpu_start)
+        if not lines:
+            return
+        yield from lines
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser, default_output: str):
+    """--profile 関連のコマンドライン引数を追加"""
+    parser.add_argument('--profile', action='store_true',
+                        help='ステージ別の処理時間・CPU時間・メモリ割り当て量を計測する')
+    parser.add_argument('--profile-output', default=default_output,
+                        help=f'プロファイルレポート（JSON）の出力先（既定: {default_output}）')
+    parser.add_argument('--profile-no-alloc', action='store_true',
+                        help='tracemalloc によるメモリ割り当ての計測を行わない')
+    parser.add_argument('--cprofile', metavar='PATH',
+                        help='cProfile の統計（pstats形式。snakeviz / flameprof で可視化可能）を出力する')
+
+
+@contextlib.contextmanager
+def profile_session(args: argparse.Namespace, name: str):
+    """
+    コマンドライン引数に従ってプロファイラを用意する
+    プロファイル無効時は NULL_PROFILER を返す
+    """
+    profiler = StageProfiler(name, trace_allocations=not args.profile_no_alloc) if args.profile else NULL_PROFILER
+    cprofiler = cProfile.Profile() if args.cprofile else None
+
+    if cprofiler is not None:
+        cprofiler.enable()
+    try:
+        yield profiler
+    finally:
+        if cprofiler is not None:
+            cprofiler.disable()
+            cprofiler.dump_stats(args.cprofile)
+            print(f"cProfile統計を保存しました: {args.cprofile}")
+        if profiler.enabled:
+            profiler.write_report(args.profile_output)
+            print(f"プロファイルレポートを保存しました: {args.profile_output}")
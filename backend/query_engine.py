@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+/query エンドポイント用の列指向集計エンジン
+絞り込み・グループ化・集計・上位N件の指定を正規化したクエリプランに変換し、
+コード化した列配列（numpy）の上で実行します。プランと結果は件数上限付きのLRUキャッシュで保持します。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# グループ化キーと列名の対応（出力もこの列名を使う）
+GROUP_COLUMNS = OrderedDict([
+    ('disease', 'disease_name'),
+    ('category', 'category'),
+    ('year', 'year'),
+    ('week', 'week'),
+])
+AGGREGATIONS = ('sum', 'mean', 'max')
+MAX_WEEKS = 53
+MEAN_DECIMALS = 4
+
+
+class QueryPlan(NamedTuple):
+    """正規化したクエリプラン（同じ意味のクエリは同じ値になり、キャッシュキーに使える）"""
+    diseases: Tuple[str, ...]
+    categories: Tuple[str, ...]
+    start_year: Optional[int]
+    end_year: Optional[int]
+    start_week: Optional[int]
+    end_week: Optional[int]
+    group_by: Tuple[str, ...]
+    agg: str
+    top: Optional[int]
+
+    def to_dict(self) -> Dict:
+        return {
+            'diseases': list(self.diseases),
+            'categories': list(self.categories),
+            'start_year': self.start_year,
+            'end_year': self.end_year,
+            'start_week': self.start_week,
+            'end_week': self.end_week,
+            'group_by': list(self.group_by),
+            'agg': self.agg,
+            'top': self.top,
+        }
+
+
+def _split_values(values: Optional[Iterable[str]]) -> List[str]:
+    """繰り返し指定とカンマ区切りの両方を受け付ける"""
+    result = []
+    for value in values or []:
+        result.extend(v.strip() for v in value.split(',') if v.strip())
+    return result
+
+
+def normalize_plan(diseases: Optional[Iterable[str]] = None, categories: Optional[Iterable[str]] = None,
+                   start_year: Optional[int] = None, end_year: Optional[int] = None,
+                   start_week: Optional[int] = None, end_week: Optional[int] = None,
+                   group_by: Optional[Iterable[str]] = None, agg: str = 'sum',
+                   top: Optional[int] = None) -> QueryPlan:
+    """
+    リクエストのパラメータをクエリプランに正規化
+    不正な指定は ValueError（メッセージはそのままAPIのエラー詳細に使う）
+    """
+    keys = _split_values(group_by)
+    unknown = [k for k in keys if k not in GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"group_by に指定できない項目です: {', '.join(unknown)}（指定可能: {', '.join(GROUP_COLUMNS)}）")
+    agg = agg.lower()
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"agg に指定できない集計方法です: {agg}（指定可能: {', '.join(AGGREGATIONS)}）")
+    if start_year is not None and end_year is not None and start_year > end_year:
+        raise ValueError("start_year は end_year 以下を指定してください")
+    for week in (start_week, end_week):
+        if week is not None and not 1 <= week <= MAX_WEEKS:
+            raise ValueError(f"週番号は 1〜{MAX_WEEKS} の範囲で指定してください")
+    if start_week is not None and end_week is not None and start_week > end_week:
+        raise ValueError("start_week は end_week 以下を指定してください")
+    if top is not None and top < 1:
+        raise ValueError("top は1以上を指定してください")
+
+    return QueryPlan(
+        diseases=tuple(sorted(set(_split_values(diseases)))),
+        categories=tuple(sorted(set(_split_values(categories)))),
+        start_year=start_year,
+        end_year=end_year,
+        start_week=None if start_week == 1 else start_week,
+        end_week=None if end_week == MAX_WEEKS else end_week,
+        # グループ化キーは指定順によらず定義順に並べる
+        group_by=tuple(k for k in GROUP_COLUMNS if k in keys),
+        agg=agg,
+        top=top,
+    )
+
+
+def estimate_groups(plan: QueryPlan, dimensions: Dict) -> int:
+    """
+    結果のグループ数の上限を見積もる（コストガード用）
+    dimensions は {'disease': 疾病数, 'category': 分類数, 'years': [年, ...]}
+    """
+    groups = 1
+    for key in plan.group_by:
+        if key == 'disease':
+            groups *= len(plan.diseases) or dimensions['disease']
+        elif key == 'category':
+            groups *= len(plan.categories) or dimensions['category']
+        elif key == 'year':
+            groups *= sum(
+                1 for y in dimensions['years']
+                if (plan.start_year is None or y >= plan.start_year) and (plan.end_year is None or y <= plan.end_year)
+            )
+        elif key == 'week':
+            groups *= (plan.end_week or MAX_WEEKS) - (plan.start_week or 1) + 1
+    return groups
+
+
+def format_value(agg: str, value) -> float:
+    if agg == 'mean':
+        return round(float(value), MEAN_DECIMALS)
+    return int(value)
+
+
+class ColumnarTable:
+    """
+    コード化した列配列の集計テーブル
+    disease_name / category はコード表へのコード、year / week / count は整数列
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], code_tables: Dict[str, List[str]]):
+        self.columns = columns
+        self.code_tables = code_tables
+        self.rows = len(columns['count'])
+        self._code_index = {
+            name: {value: i for i, value in enumerate(code_tables[name])}
+            for name in ('disease_name', 'category')
+        }
+        self.years = np.unique(columns['year']).tolist() if self.rows else []
+
+    @classmethod
+    def from_dataframe(cls, df) -> "ColumnarTable":
+        """カテゴリ型のDataFrameから作成（コード列はコピーせずに参照）"""
+        columns = {}
+        code_tables = {}
+        for name in ('disease_name', 'category'):
+            values = df[name].astype('category')
+            columns[name] = values.cat.codes.to_numpy()
+            code_tables[name] = [str(v) for v in values.cat.categories]
+        for name in ('count', 'year', 'week'):
+            columns[name] = df[name].to_numpy()
+        return cls(columns, code_tables)
+
+    def dimensions(self) -> Dict:
+        return {
+            'disease': len(self.code_tables['disease_name']),
+            'category': len(self.code_tables['category']),
+            'years': self.years,
+        }
+
+    def weekly_totals(self, start_year: Optional[int] = None,
+                      end_year: Optional[int] = None) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """
+        疾病・年・週ごとの報告数の合計（/correlations 用）
+        (疾病名のコード表, {'disease': コード, 'year', 'week', 'total'}) を返す
+        """
+        names = self.code_tables['disease_name']
+        mask = np.ones(self.rows, dtype=bool)
+        if start_year is not None:
+            mask &= self.columns['year'] >= start_year
+        if end_year is not None:
+            mask &= self.columns['year'] <= end_year
+        if not mask.any():
+            return names, {name: np.zeros(0, dtype=np.int64) for name in ('disease', 'year', 'week', 'total')}
+        diseases = self.columns['disease_name'][mask].astype(np.int64)
+        years = self.columns['year'][mask].astype(np.int64)
+        weeks = self.columns['week'][mask].astype(np.int64)
+        first_year = int(years.min())
+        span = int(years.max()) - first_year + 1
+        key = (diseases * span + (years - first_year)) * (MAX_WEEKS + 1) + weeks
+        groups, inverse = np.unique(key, return_inverse=True)
+        totals = np.bincount(inverse.reshape(-1), weights=self.columns['count'][mask], minlength=len(groups))
+        return names, {
+            'disease': groups // ((MAX_WEEKS + 1) * span),
+            'year': (groups // (MAX_WEEKS + 1)) % span + first_year,
+            'week': groups % (MAX_WEEKS + 1),
+            'total': totals.astype(np.int64),
+        }
+
+    def _mask(self, plan: QueryPlan) -> Optional[np.ndarray]:
+        mask = np.ones(self.rows, dtype=bool)
+        for values, name in ((plan.diseases, 'disease_name'), (plan.categories, 'category')):
+            if values:
+                codes = [self._code_index[name][v] for v in values if v in self._code_index[name]]
+                if not codes:
+                    return None
+                mask &= np.isin(self.columns[name], codes)
+        for name, low, high in (('year', plan.start_year, plan.end_year), ('week', plan.start_week, plan.end_week)):
+            if low is not None:
+                mask &= self.columns[name] >= low
+            if high is not None:
+                mask &= self.columns[name] <= high
+        return mask
+
+    def execute(self, plan: QueryPlan) -> List[Dict]:
+        """クエリプランを実行して結果の行を返す"""
+        mask = self._mask(plan)
+        if mask is None or not mask.any():
+            return []
+        counts = self.columns['count'][mask].astype(np.int64)
+
+        # グループ化キーを混合基数の1つの整数キーにまとめる
+        key = np.zeros(len(counts), dtype=np.int64)
+        parts = []
+        for name in (GROUP_COLUMNS[k] for k in plan.group_by):
+            values = self.columns[name][mask].astype(np.int64)
+            base = int(values.min())
+            radix = int(values.max()) - base + 1
+            key = key * radix + (values - base)
+            parts.append((name, base, radix))
+        groups, inverse = np.unique(key, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        rows = np.bincount(inverse, minlength=len(groups))
+        if plan.agg == 'max':
+            order = np.argsort(inverse, kind='stable')
+            starts = np.concatenate(([0], np.cumsum(rows)[:-1]))
+            values = np.maximum.reduceat(counts[order], starts)
+        else:
+            values = np.bincount(inverse, weights=counts, minlength=len(groups))
+            if plan.agg == 'mean':
+                values = values / rows
+
+        # グループキーの昇順（上位N件指定時は値の降順、同値はキー順）
+        selected = np.arange(len(groups))
+        if plan.top is not None:
+            selected = np.argsort(-values, kind='stable')[:plan.top]
+
+        decoded = {}
+        remainder = groups[selected]
+        for name, base, radix in reversed(parts):
+            decoded[name] = remainder % radix + base
+            remainder = remainder // radix
+
+        result = []
+        for position, i in enumerate(selected.tolist()):
+            row = {}
+            for name, _, _ in parts:
+                code = int(decoded[name][position])
+                row[name] = self.code_tables[name][code] if name in self.code_tables else code
+            row['value'] = format_value(plan.agg, values[i])
+            row['rows'] = int(rows[i])
+            result.append(row)
+        return result
+
+
+class PlanCache:
+    """クエリプランをキーに結果を保持するLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: Dict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
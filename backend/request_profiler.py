@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+リクエスト単位のプロファイラ（本番環境での遅いリクエストの調査用）
+X-Profile-Token ヘッダーに設定済みのトークンを付けたリクエストだけを cProfile で計測し、
+時間の内訳（pandas / シリアライズ / フレームワーク / アプリ / 待ち）を X-Profile-Summary ヘッダーで返します。
+上位の関数を含む詳細は JSON と pstats 形式で保存し、X-Profile-Id で取得できます。
+トークンを設定しない場合はミドルウェア自体を組み込まないため、通常のリクエストへの影響はありません。
+"""
+
+import contextvars
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_HEADER = b"x-profile-token"
+TOP_FUNCTIONS = 25
+
+# 関数の定義元による分類（先に一致したものを使う）
+CATEGORY_PATTERNS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ('pandas', ('/pandas/', '/numpy/', '/pyarrow/', 'numpy.', 'pandas._libs')),
+    ('serialization', ('/json/', '/pydantic/', '/pydantic_core/', 'fastapi/encoders.py',
+                       'fastapi/routing.py:serialize_response', 'starlette/responses.py', '_json.', 'jsonable_encoder')),
+    ('wait', ("'poll' of 'select", "'select' of 'select", 'selectors.py', "'acquire' of '_thread", 'threading.py:wait')),
+    ('framework', ('/starlette/', '/fastapi/', '/anyio/', '/uvicorn/', '/asyncio/', '/h11/', '/httptools/', 'concurrent/futures')),
+)
+
+_current: "contextvars.ContextVar[Optional[RequestProfile]]" = contextvars.ContextVar("request_profile", default=None)
+
+
+def current_profile() -> Optional["RequestProfile"]:
+    """処理中のリクエストがプロファイル対象ならその RequestProfile（スレッドプールにも引き継がれる）"""
+    return _current.get()
+
+
+def _function_label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f"{filename}:{line}({name})"
+
+
+def _category(func: Tuple[str, int, str], app_dir: str) -> str:
+    filename, _, name = func
+    text = f"{filename}:{name}" if filename != '~' else name
+    for category, patterns in CATEGORY_PATTERNS:
+        if any(pattern in text for pattern in patterns):
+            return category
+    if filename.startswith(app_dir):
+        return 'app'
+    return 'other'
+
+
+class RequestProfile:
+    """1リクエスト分の計測（イベントループのスレッドと、スレッドプールで実行した処理を別々に計測する）"""
+
+    def __init__(self, method: str, path: str):
+        self.id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.loop_profiler = cProfile.Profile()
+        self.thread_profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def call(self, func, *args):
+        """スレッドプールのスレッドで func(*args) を計測しながら実行する"""
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.thread_profilers.append(profiler)
+        profiler.enable()
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.loop_profiler)
+        for profiler in self.thread_profilers:
+            stats.add(profiler)
+        return stats
+
+    def summarize(self, app_dir: str) -> Dict:
+        """分類ごとの自己時間（tottime）と、自己時間・累積時間の上位の関数"""
+        stats = self.stats()
+        categories: Dict[str, float] = {name: 0.0 for name, _ in CATEGORY_PATTERNS}
+        categories.update(app=0.0, other=0.0)
+        for func, (_, _, tottime, _, _) in stats.stats.items():
+            categories[_category(func, app_dir)] += tottime
+        by_self = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+        by_cumulative = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "generated_at": datetime.now().isoformat(),
+            "wall_ms": round(self.wall_seconds * 1000, 3),
+            "threads": 1 + len(self.thread_profilers),
+            "categories_ms": {name: round(seconds * 1000, 3) for name, seconds in categories.items()},
+            "top_self": [
+                {"function": _function_label(func), "category": _category(func, app_dir), "calls": nc,
+                 "self_ms": round(tottime * 1000, 3), "cumulative_ms": round(cumtime * 1000, 3)}
+                for func, (_, nc, tottime, cumtime, _) in by_self
+            ],
+            "top_cumulative": [
+                {"function": _function_label(func), "calls": nc, "cumulative_ms": round(cumtime * 1000, 3)}
+                for func, (_, nc, _, cumtime, _) in by_cumulative
+            ],
+        }
+
+
+def profiled_call(func, *args):
+    """プロファイル対象のリクエストなら計測しながら、そうでなければそのまま func(*args) を実行する"""
+    profile = _current.get()
+    if profile is None:
+        return func(*args)
+    return profile.call(func, *args)
+
+
+class RequestProfilerMiddleware:
+    """
+    X-Profile-Token ヘッダーのあるリクエストを計測するASGIミドルウェア
+    トークンが一致しなければ403。計測は同時に1件だけ（計測中に届いた別の計測リクエストは409）
+    レスポンスヘッダーの送信時点で計測を終える（ストリーミングの本文の送信時間は含まない）
+    イベントループのスレッドの計測には、計測中に同じループで処理された他のリクエストも含まれる
+    """
+
+    def __init__(self, app, token: str, output_dir: str, keep: int = 20, registry=None):
+        self.app = app
+        self.token = token.encode('utf-8')
+        self.output_dir = output_dir
+        self.keep = keep
+        self.registry = registry
+        self.app_dir = os.path.dirname(os.path.abspath(__file__))
+        self._busy = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = None
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                token = value
+                break
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not hmac.compare_digest(token, self.token):
+            await _send_error(send, 403, "プロファイル用のトークンが正しくありません")
+            return
+        if self._busy:
+            await _send_error(send, 409, "他のリクエストを計測中です。しばらくしてから再実行してください")
+            return
+
+        self._busy = True
+        profile = RequestProfile(scope["method"], scope["path"] + (f"?{scope['query_string'].decode('latin-1')}" if scope.get("query_string") else ""))
+        context_token = _current.set(profile)
+        finished = [False]
+
+        def finish() -> Dict:
+            profile.loop_profiler.disable()
+            finished[0] = True
+            profile.wall_seconds = time.perf_counter() - profile.started
+            return profile.summarize(self.app_dir)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and not finished[0]:
+                summary = finish()
+                self._save(profile, summary)
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile.id.encode('ascii')))
+                headers.append((b"x-profile-summary", _summary_header(summary).encode('ascii')))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        profile.loop_profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not finished[0]:
+                finish()
+            _current.reset(context_token)
+            self._busy = False
+
+    def _save(self, profile: RequestProfile, summary: Dict):
+        """計測結果を {id}.json と {id}.pstats に保存し、古いものは keep 件を残して削除する"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, f"{profile.id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        profile.stats().dump_stats(os.path.join(self.output_dir, f"{profile.id}.pstats"))
+        saved = sorted(name[:-len('.json')] for name in os.listdir(self.output_dir) if name.endswith('.json'))
+        for old in saved[:-self.keep]:
+            for suffix in ('.json', '.pstats'):
+                try:
+                    os.remove(os.path.join(self.output_dir, old + suffix))
+                except OSError:
+                    pass
+        if self.registry is not None:
+            self.registry.inc_counter("request_profiles_total", 1, "計測したリクエスト数")
+
+
+def _summary_header(summary: Dict) -> str:
+    parts = [f"total={summary['wall_ms']:.1f}ms"]
+    parts += [f"{name}={ms:.1f}ms" for name, ms in summary['categories_ms'].items()]
+    # ヘッダーには待ち時間以外で自己時間が最も長い関数を載せる
+    top = next((entry for entry in summary['top_self'] if entry['category'] != 'wait'), None)
+    if top is not None:
+        parts.append(f"top={os.path.basename(top['function']).encode('ascii', 'replace').decode('ascii')}")
+    return "; ".join(parts)
+
+
+async def _send_error(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode('ascii'))],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def load_profile(output_dir: str, profile_id: str) -> Optional[Dict]:
+    """保存済みの計測結果（id にパス区切りを含むものは受け付けない）"""
+    if not profile_id or os.path.basename(profile_id) != profile_id:
+        return None
+    try:
+        with open(os.path.join(output_dir, f"{profile_id}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
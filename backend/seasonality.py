@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+/seasonality/{disease} エンドポイント用の季節性キューブ
+疾病 × 年 × 週（ISO週番号 1〜53）の報告数を読み込み時に1度だけ作成し、
+年別の週ヒートマップと複数年の平均・パーセンタイル帯をキューブの切り出しで返します。
+"""
+
+import warnings
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from query_engine import MAX_WEEKS
+
+# 帯として返すパーセンタイル
+BAND_PERCENTILES = (10, 25, 50, 75, 90)
+BAND_DECIMALS = 2
+
+
+def _to_list(values: np.ndarray, decimals: Optional[int] = None) -> List[Optional[float]]:
+    """NaN（その週の報告がない）は None にする（decimals 省略時は整数）"""
+    if decimals is None:
+        return [None if v != v else int(v) for v in values.tolist()]
+    return [None if v != v else v for v in np.round(values, decimals).tolist()]
+
+
+class SeasonalityCube:
+    """
+    疾病 × 年 × 週の報告数
+    データに現れる (年, 週) で報告のなかった疾病は0、データにない (年, 週) は NaN
+    """
+
+    def __init__(self, names: Sequence[str], totals: Dict[str, Sequence[int]]):
+        diseases = np.asarray(totals['disease'], dtype=np.int64)
+        years = np.asarray(totals['year'], dtype=np.int64)
+        weeks = np.asarray(totals['week'], dtype=np.int64)
+        counts = np.asarray(totals['total'], dtype=np.float64)
+        valid = (weeks >= 1) & (weeks <= MAX_WEEKS)
+        diseases, years, weeks, counts = diseases[valid], years[valid], weeks[valid], counts[valid]
+
+        codes, disease_index = np.unique(diseases, return_inverse=True)
+        self.years, year_index = np.unique(years, return_inverse=True)
+        self.diseases: List[str] = [names[c] for c in codes.tolist()]
+        self._index = {name: i for i, name in enumerate(self.diseases)}
+
+        self.available = np.zeros((len(self.years), MAX_WEEKS), dtype=bool)
+        self.available[year_index.reshape(-1), weeks - 1] = True
+        self.values = np.full((len(self.diseases), len(self.years), MAX_WEEKS), np.nan)
+        self.values[:, self.available] = 0
+        self.values[disease_index.reshape(-1), year_index.reshape(-1), weeks - 1] = counts
+
+    def __contains__(self, disease_name: str) -> bool:
+        return disease_name in self._index
+
+    def nbytes(self) -> int:
+        return int(self.values.nbytes + self.available.nbytes)
+
+    def _aligned(self, disease_name: str, years: np.ndarray) -> np.ndarray:
+        """疾病の 年 × 週 の値を years（昇順）の並びにそろえる（ない年・疾病は NaN）"""
+        aligned = np.full((len(years), MAX_WEEKS), np.nan)
+        if disease_name in self._index:
+            aligned[np.searchsorted(years, self.years)] = self.values[self._index[disease_name]]
+        return aligned
+
+    def disease(self, disease_name: str, start_year: Optional[int] = None,
+                end_year: Optional[int] = None) -> Optional[Dict]:
+        """
+        疾病の年別ヒートマップと週ごとの平均・パーセンタイル帯（対象年がなければ None）
+        どの年にもない週（53週など）は末尾から除く
+        """
+        years = np.ones(len(self.years), dtype=bool)
+        if start_year is not None:
+            years &= self.years >= start_year
+        if end_year is not None:
+            years &= self.years <= end_year
+        if not years.any():
+            return None
+        weeks = int(np.flatnonzero(self.available[years].any(axis=0))[-1]) + 1
+        heatmap = self.values[self._index[disease_name], years, :weeks]
+
+        with warnings.catch_warnings():
+            # 対象年のどれにもない週は NaN のまま返す
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(heatmap, axis=0)
+            percentiles = np.nanpercentile(heatmap, BAND_PERCENTILES, axis=0)
+
+        bands = {'mean': _to_list(mean, BAND_DECIMALS)}
+        for percentile, values in zip(BAND_PERCENTILES, percentiles):
+            bands[f'p{percentile}'] = _to_list(values, BAND_DECIMALS)
+        return {
+            "years": self.years[years].tolist(),
+            "weeks": list(range(1, weeks + 1)),
+            "heatmap": [
+                {"year": year, "values": _to_list(row)}
+                for year, row in zip(self.years[years].tolist(), heatmap)
+            ],
+            "bands": bands,
+        }
+
+
+def changed_cells(previous: SeasonalityCube, current: SeasonalityCube) -> Tuple[List[str], List[Dict]]:
+    """2つのキューブで値が変わった（増えた・消えたを含む）疾病と (年, 週) の一覧"""
+    years = np.union1d(previous.years, current.years)
+    changed_weeks = np.zeros((len(years), MAX_WEEKS), dtype=bool)
+    diseases = []
+    for disease_name in sorted(set(previous.diseases) | set(current.diseases)):
+        before = previous._aligned(disease_name, years)
+        after = current._aligned(disease_name, years)
+        changed = (before != after) & ~(np.isnan(before) & np.isnan(after))
+        if changed.any():
+            diseases.append(disease_name)
+            changed_weeks |= changed
+    year_index, week_index = np.nonzero(changed_weeks)
+    weeks = [
+        {"year": int(years[y]), "week": int(w) + 1}
+        for y, w in zip(year_index.tolist(), week_index.tolist())
+    ]
+    return diseases, weeks
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+定点把握データの集計キューブ
+疾病 × 週 × 区分（年齢階級・地域など）の報告数を整数のnumpy配列（.npy）に保存し、
+軸のラベルはJSONのメタデータに保存します。APIはメモリマップで開き、
+週の範囲の集計は配列の切り出しと合計だけで求めます。
+"""
+
+import bisect
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+CUBE_FORMAT = 1
+AGE_CUBE_NAME = "sentinel_age_cube"
+REGION_CUBE_NAME = "sentinel_region_cube"
+
+# 二次保健医療圏 → 保健所（定点把握ファイルのヘッダーの表記）
+HEALTH_CENTER_DISTRICTS = {
+    '区中央部': ['千代田', '中央区', 'みなと', '文京', '台東'],
+    '区南部': ['品川区', '大田区'],
+    '区西南部': ['目黒区', '世田谷', '渋谷区'],
+    '区西部': ['新宿区', '中野区', '杉並'],
+    '区西北部': ['池袋', '北区', '板橋区', '練馬区'],
+    '区東北部': ['荒川区', '足立', '葛飾区'],
+    '区東部': ['墨田区', '江東区', '江戸川'],
+    '西多摩': ['西多摩'],
+    '南多摩': ['八王子市', '町田市', '南多摩'],
+    '北多摩西部': ['多摩立川'],
+    '北多摩南部': ['多摩府中'],
+    '北多摩北部': ['多摩小平'],
+    '島しょ': ['島しょ'],
+}
+# 対応表にない保健所をまとめる医療圏
+OTHER_DISTRICT = "その他"
+REGION_LEVELS = ('health_center', 'medical_district')
+
+_DISTRICT_BY_HEALTH_CENTER = {
+    health_center: district
+    for district, health_centers in HEALTH_CENTER_DISTRICTS.items()
+    for health_center in health_centers
+}
+
+
+def district_of(health_center: str) -> Optional[str]:
+    """保健所の属する二次保健医療圏（「港区」と「みなと」のような「区」の有無の違いは同じとみなす）"""
+    for candidate in (health_center, health_center + '区', health_center.rstrip('区')):
+        if candidate in _DISTRICT_BY_HEALTH_CENTER:
+            return _DISTRICT_BY_HEALTH_CENTER[candidate]
+    return None
+
+
+def order_by_district(values: np.ndarray, meta: Dict) -> Tuple[np.ndarray, Dict]:
+    """
+    保健所のキューブの区分軸を医療圏ごとに連続するよう並べ替え、階層をメタデータに加える
+    医療圏の集計は区分軸の連続した範囲の合計（np.add.reduceat）になる
+    """
+    groups: Dict[str, List[int]] = {district: [] for district in HEALTH_CENTER_DISTRICTS}
+    for i, label in enumerate(meta['labels']):
+        groups.setdefault(district_of(label) or OTHER_DISTRICT, []).append(i)
+    order = [i for indexes in groups.values() for i in indexes]
+    hierarchy = [
+        {'district': district, 'health_centers': [meta['labels'][i] for i in indexes]}
+        for district, indexes in groups.items() if indexes
+    ]
+    meta = dict(meta, labels=[meta['labels'][i] for i in order], hierarchy=hierarchy)
+    return np.ascontiguousarray(values[:, :, order]), meta
+
+
+class CubeBuilder:
+    """ファイルごとの行（疾病, 年, 週, {区分: 報告数}）を集めてキューブを作る"""
+
+    def __init__(self, axis: str):
+        self.axis = axis
+        self._diseases: Dict[str, int] = {}
+        self._labels: Dict[str, int] = {}
+        self._periods: Dict[int, int] = {}
+        self._cells: List[Tuple[int, int, int, int]] = []
+
+    def add(self, disease_name: str, year: int, week: int, counts: Iterable[Tuple[str, int]]):
+        disease = self._diseases.setdefault(disease_name, len(self._diseases))
+        period = self._periods.setdefault(year * 100 + week, len(self._periods))
+        for label, count in counts:
+            self._cells.append((disease, period, self._labels.setdefault(label, len(self._labels)), count))
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def build(self) -> Tuple[np.ndarray, Dict]:
+        """(疾病 × 週 × 区分の配列, メタデータ) を返す。週は昇順、疾病・区分は初出順"""
+        periods = sorted(self._periods)
+        period_order = np.empty(len(periods), dtype=np.int64)
+        for position, key in enumerate(periods):
+            period_order[self._periods[key]] = position
+        cells = np.array(self._cells, dtype=np.int64).reshape(-1, 4)
+        counts = cells[:, 3]
+        # 値域に収まる小さい整数型で持つ
+        dtype = np.uint16 if len(counts) == 0 or (counts.min() >= 0 and counts.max() <= np.iinfo(np.uint16).max) else np.int32
+        values = np.zeros((len(self._diseases), len(periods), len(self._labels)), dtype=dtype)
+        values[cells[:, 0], period_order[cells[:, 1]], cells[:, 2]] = counts
+        meta = {
+            'format': CUBE_FORMAT,
+            'axis': self.axis,
+            'diseases': list(self._diseases),
+            'periods': [[key // 100, key % 100] for key in periods],
+            'labels': list(self._labels),
+        }
+        return values, meta
+
+
+def write_cube(directory: str, name: str, values: np.ndarray, meta: Dict) -> str:
+    """キューブを {name}.npy と {name}.json に書き出す（一時ファイルから置き換える）"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.npy")
+    meta = dict(meta, shape=list(values.shape), dtype=str(values.dtype))
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, values)
+    with open(os.path.join(directory, f"{name}.json.tmp"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+    os.replace(os.path.join(directory, f"{name}.json.tmp"), os.path.join(directory, f"{name}.json"))
+    return path
+
+
+class SentinelCube:
+    """メモリマップしたキューブ（疾病 × 週 × 区分）"""
+
+    def __init__(self, values: np.ndarray, meta: Dict):
+        self.values = values
+        self.meta = meta
+        self.diseases: List[str] = meta['diseases']
+        self.labels: List[str] = meta['labels']
+        self.periods: List[int] = [year * 100 + week for year, week in meta['periods']]
+        self._disease_index = {name: i for i, name in enumerate(self.diseases)}
+        self._label_index = {label: i for i, label in enumerate(self.labels)}
+        # 上位の階層（医療圏）: 区分軸の連続した範囲 [offsets[k], offsets[k + 1])
+        hierarchy = meta.get('hierarchy') or []
+        self.groups: List[str] = [group['district'] for group in hierarchy]
+        sizes = [len(group['health_centers']) for group in hierarchy]
+        self._offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self._group_index = {name: i for i, name in enumerate(self.groups)}
+        self.parents: List[Optional[str]] = [None] * len(self.labels)
+        for k, group in enumerate(self.groups):
+            for i in range(self._offsets[k], self._offsets[k + 1]):
+                self.parents[i] = group
+
+    def __contains__(self, disease_name: str) -> bool:
+        return disease_name in self._disease_index
+
+    def nbytes(self) -> int:
+        return int(self.values.nbytes)
+
+    def disease(self, disease_name: str) -> int:
+        return self._disease_index[disease_name]
+
+    def label(self, label: str) -> Optional[int]:
+        return self._label_index.get(label)
+
+    def period_range(self, start_year: Optional[int] = None, start_week: Optional[int] = None,
+                     end_year: Optional[int] = None, end_week: Optional[int] = None) -> slice:
+        """(開始年, 開始週)〜(終了年, 終了週) に含まれる週の範囲（週は昇順なので連続した切り出しになる）"""
+        low = (start_year * 100 + (start_week or 1)) if start_year is not None else None
+        high = (end_year * 100 + (end_week or 53)) if end_year is not None else None
+        start = bisect.bisect_left(self.periods, low) if low is not None else 0
+        stop = bisect.bisect_right(self.periods, high) if high is not None else len(self.periods)
+        return slice(start, max(start, stop))
+
+    def period_index(self, year: int, week: int) -> Optional[int]:
+        key = year * 100 + week
+        i = bisect.bisect_left(self.periods, key)
+        return i if i < len(self.periods) and self.periods[i] == key else None
+
+    def region(self, name: str) -> Optional[Tuple[str, slice]]:
+        """地域名 → (階層, 区分軸の範囲)。保健所は1列、医療圏は属する保健所の列の範囲"""
+        if name in self._label_index:
+            i = self._label_index[name]
+            return 'health_center', slice(i, i + 1)
+        if name in self._group_index:
+            k = self._group_index[name]
+            return 'medical_district', slice(int(self._offsets[k]), int(self._offsets[k + 1]))
+        return None
+
+    def rollup(self, values: np.ndarray) -> np.ndarray:
+        """区分軸（最後の軸）を上位の階層ごとに合計する"""
+        if not self.groups:
+            return values[..., :0]
+        return np.add.reduceat(values, self._offsets[:-1], axis=-1)
+
+    def week_map(self, disease_name: str, period: int, level: str = 'health_center') -> List[int]:
+        """1週分の地域ごとの報告数（level が medical_district なら医療圏ごとに合計）"""
+        values = self.values[self._disease_index[disease_name], period, :].astype(np.int64)
+        return (self.rollup(values) if level == 'medical_district' else values).tolist()
+
+    def series(self, disease_name: str, columns: slice, periods: slice) -> List[int]:
+        """区分軸の範囲（地域）の週ごとの報告数"""
+        return self.values[self._disease_index[disease_name], periods, columns].sum(axis=1, dtype=np.int64).tolist()
+
+    def breakdown(self, disease_name: str, periods: slice) -> List[int]:
+        """疾病の区分ごとの報告数（週の範囲で合計）"""
+        return self.values[self._disease_index[disease_name], periods, :].sum(axis=0, dtype=np.int64).tolist()
+
+    def period_label(self, index: int) -> Dict:
+        key = self.periods[index]
+        return {"year": key // 100, "week": key % 100}
+
+
+def load_cube(path: str) -> SentinelCube:
+    """{name}.npy とメタデータ {name}.json をメモリマップで開く"""
+    with open(path[:-len('.npy')] + '.json', 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != CUBE_FORMAT:
+        raise ValueError(f"キューブの形式が異なります: {path}")
+    return SentinelCube(np.load(path, mmap_mode='r'), meta)
+
+
+def cube_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f"{name}.npy")
@@ -4,21 +4,30 @@
 Sentinel surveillance data processor for IDSC dashboard
 """
 
+import argparse
 import csv
+import io
 import json
 import os
 import re
+import time
 from datetime import datetime
 from collections import defaultdict
-import glob
+
+import numpy as np
+
+from input_sources import input_name, iter_input_files, pattern_matcher, read_input
+from profiling import NULL_PROFILER, add_profile_arguments, profile_session, timed_lines
+from sentinel_cube import AGE_CUBE_NAME, REGION_CUBE_NAME, CubeBuilder, SentinelCube, order_by_district, write_cube
 
 def parse_filename(filename):
     """
     ファイル名からメタデータを抽出
     例: sentinel_weekly_gender_2020_17_20250703_031821_raw.csv
+    （アーカイブのメンバーも受け付ける）
     """
     pattern = r'sentinel_weekly_(\w+)_(\d{4})_(\d+)_\d+_\d+_raw\.csv'
-    match = re.match(pattern, os.path.basename(filename))
+    match = re.match(pattern, input_name(filename))
     
     if match:
         data_type = match.group(1)  # gender, age, health_center, medical_district
@@ -31,21 +40,26 @@ def parse_filename(filename):
         }
     return None
 
-def read_sentinel_csv(filepath):
+def read_sentinel_csv(filepath, profiler=NULL_PROFILER):
     """
-    Shift-JISエンコードのSentinelCSVファイルを読み込み
+    Shift-JISエンコードのSentinelCSVファイル（パスまたはアーカイブのメンバー）を読み込み
     """
     try:
-        with open(filepath, 'r', encoding='shift-jis') as f:
-            reader = csv.reader(f)
-            rows = list(reader)
+        with profiler.stage('read'):
+            raw = read_input(filepath)
+        # デコードした全体の文字列は作らず、先頭から順にデコードしながら解析する
+        # （decode の時間は csv_parse のステージから除いて記録する）
+        with profiler.stage('csv_parse'):
+            stream = io.TextIOWrapper(io.BytesIO(raw), encoding='shift-jis', newline='')
+            rows = list(csv.reader(timed_lines(stream, profiler.timer('decode'))))
             
         # ヘッダー行を見つける
-        header_row_idx = -1
-        for i, row in enumerate(rows):
-            if len(row) > 0 and '疾病名' in row[0]:
-                header_row_idx = i
-                break
+        with profiler.stage('header_search'):
+            header_row_idx = -1
+            for i, row in enumerate(rows):
+                if len(row) > 0 and '疾病名' in row[0]:
+                    header_row_idx = i
+                    break
         
         if header_row_idx == -1:
             return None, None
@@ -54,14 +68,15 @@ def read_sentinel_csv(filepath):
         headers = rows[header_row_idx]
         
         # データ行を取得
-        data_rows = []
-        for i in range(header_row_idx + 1, len(rows)):
-            row = rows[i]
-            if len(row) > 0 and row[0].strip() and not row[0].startswith('"'):
-                # 空でない行のみを追加
-                cleaned_row = [cell.strip().replace('"', '') for cell in row]
-                if cleaned_row[0] and cleaned_row[0] != '疾病名':
-                    data_rows.append(cleaned_row)
+        with profiler.stage('row_clean'):
+            data_rows = []
+            for i in range(header_row_idx + 1, len(rows)):
+                row = rows[i]
+                if len(row) > 0 and row[0].strip() and not row[0].startswith('"'):
+                    # 空でない行のみを追加
+                    cleaned_row = [cell.strip().replace('"', '') for cell in row]
+                    if cleaned_row[0] and cleaned_row[0] != '疾病名':
+                        data_rows.append(cleaned_row)
         
         return headers, data_rows
         
@@ -69,27 +84,35 @@ def read_sentinel_csv(filepath):
         print(f"Error reading {filepath}: {e}")
         return None, None
 
-def process_gender_data():
+def process_gender_data(profiler=NULL_PROFILER):
     """
     男女別データを処理してインフルエンザなどの主要疾患を抽出
     """
     data_dir = '../csv_list'
-    gender_files = glob.glob(f'{data_dir}/sentinel_weekly_gender_*_raw.csv')
+    # ディレクトリ内のファイルと .zip / .tar.gz / .gz アーカイブの中を順に読む
+    gender_files = iter_input_files(data_dir, pattern_matcher('sentinel_weekly_gender_*_raw.csv'))
     
     processed_data = []
     diseases_found = set()
     
-    print(f"Processing {len(gender_files)} gender files...")
+    print(f"Processing gender files in {data_dir}...")
     
-    for i, filepath in enumerate(gender_files):
+    i = 0
+    while True:
+        with profiler.stage('list_files'):
+            filepath = next(gender_files, None)
+        if filepath is None:
+            break
         if i % 100 == 0:
-            print(f"Processed {i}/{len(gender_files)} files...")
+            print(f"Processed {i} files...")
+        i += 1
             
         metadata = parse_filename(filepath)
         if not metadata:
             continue
             
-        headers, data_rows = read_sentinel_csv(filepath)
+        file_start, file_cpu_start = time.perf_counter(), time.process_time()
+        headers, data_rows = read_sentinel_csv(filepath, profiler)
         if not headers or not data_rows:
             continue
             
@@ -98,45 +121,111 @@ def process_gender_data():
         if len(headers) < 4:
             continue
             
-        for row in data_rows:
-            if len(row) < 4:
-                continue
-                
-            disease_name = row[0].strip()
-            if not disease_name or disease_name == '疾病名':
-                continue
-                
-            diseases_found.add(disease_name)
-            
-            try:
-                male_count = int(row[1] or 0)
-                female_count = int(row[2] or 0)
-                total_count = int(row[3] or 0)
-                sentinel_points = int(row[4] or 0) if len(row) > 4 else 0
-                
-                # 疫学週から日付を計算
-                week_date = f"{metadata['year']}-W{metadata['week']:02d}"
+        with profiler.stage('record_build'):
+            for row in data_rows:
+                if len(row) < 4:
+                    continue
+                    
+                disease_name = row[0].strip()
+                if not disease_name or disease_name == '疾病名':
+                    continue
+                    
+                diseases_found.add(disease_name)
                 
-                processed_data.append({
-                    'disease_name': disease_name,
-                    'year': metadata['year'],
-                    'week': metadata['week'],
-                    'week_date': week_date,
-                    'male_count': male_count,
-                    'female_count': female_count,
-                    'total_count': total_count,
-                    'sentinel_points': sentinel_points,
-                    'data_type': 'gender'
-                })
-                
-            except (ValueError, IndexError):
-                continue
+                try:
+                    male_count = int(row[1] or 0)
+                    female_count = int(row[2] or 0)
+                    total_count = int(row[3] or 0)
+                    sentinel_points = int(row[4] or 0) if len(row) > 4 else 0
+                    
+                    # 疫学週から日付を計算
+                    week_date = f"{metadata['year']}-W{metadata['week']:02d}"
+                    
+                    processed_data.append({
+                        'disease_name': disease_name,
+                        'year': metadata['year'],
+                        'week': metadata['week'],
+                        'week_date': week_date,
+                        'male_count': male_count,
+                        'female_count': female_count,
+                        'total_count': total_count,
+                        'sentinel_points': sentinel_points,
+                        'data_type': 'gender'
+                    })
+                    
+                except (ValueError, IndexError):
+                    continue
+        profiler.record_file(input_name(filepath), time.perf_counter() - file_start, time.process_time() - file_cpu_start)
     
     print(f"Found {len(diseases_found)} unique diseases")
     print(f"Processed {len(processed_data)} records")
     
     return processed_data, list(diseases_found)
 
+def build_breakdown_cube(data_type, axis, profiler=NULL_PROFILER, data_dir='../csv_list'):
+    """
+    区分別（年齢階級・地域など）のファイルを 疾病 × 週 × 区分 のキューブにまとめる
+    区分はヘッダーの「疾病名」と「合計」以外の列（ファイルごとにヘッダーから読む）
+    """
+    builder = CubeBuilder(axis)
+    files = iter_input_files(data_dir, pattern_matcher(f'sentinel_weekly_{data_type}_*_raw.csv'))
+    file_count = 0
+    
+    while True:
+        with profiler.stage('list_files'):
+            filepath = next(files, None)
+        if filepath is None:
+            break
+        metadata = parse_filename(filepath)
+        if not metadata or metadata['data_type'] != data_type:
+            continue
+        
+        file_start, file_cpu_start = time.perf_counter(), time.process_time()
+        headers, data_rows = read_sentinel_csv(filepath, profiler)
+        if not headers or not data_rows:
+            continue
+        columns = [
+            (i, label.strip()) for i, label in enumerate(headers)
+            if i > 0 and label.strip() and label.strip() != '合計'
+        ]
+        
+        with profiler.stage('cube_build'):
+            for row in data_rows:
+                disease_name = row[0].strip()
+                counts = []
+                for i, label in columns:
+                    try:
+                        counts.append((label, int(row[i] or 0)))
+                    except (ValueError, IndexError):
+                        continue
+                builder.add(disease_name, metadata['year'], metadata['week'], counts)
+        file_count += 1
+        profiler.record_file(input_name(filepath), time.perf_counter() - file_start, time.process_time() - file_cpu_start)
+    
+    print(f"Processed {file_count} {data_type} files ({len(builder)} cells)")
+    return builder
+
+def check_district_rollup(region_cube, district_builder):
+    """
+    保健所から集計した医療圏ごとの合計と、医療圏別ファイルの合計を比べる
+    （保健所の対応表の漏れやファイルの欠けを見つけるため。差があれば表示する）
+    """
+    if not len(district_builder):
+        return
+    values, meta = district_builder.build()
+    reported = dict(zip(meta['labels'], values.sum(axis=(0, 1), dtype=np.int64).tolist()))
+    rolled_up = dict(zip(region_cube.groups, region_cube.rollup(region_cube.values.sum(axis=(0, 1), dtype=np.int64)).tolist()))
+    mismatches = [
+        (district, rolled_up.get(district), count)
+        for district, count in reported.items() if rolled_up.get(district) != count
+    ]
+    if mismatches:
+        print(f"Warning: {len(mismatches)} districts differ from the health-center roll-up:")
+        for district, rolled, count in mismatches:
+            print(f"  {district}: health centers {rolled}, district file {count}")
+    else:
+        print(f"District totals match the health-center roll-up ({len(reported)} districts)")
+
 def create_disease_summary(processed_data):
     """
     疾病別のサマリー統計を作成
@@ -180,7 +269,7 @@ def create_disease_summary(processed_data):
     # 辞書型に変換（JSONシリアライズ可能）
     return {disease: dict(stats) for disease, stats in disease_stats.items()}
 
-def main():
+def run(profiler=NULL_PROFILER):
     """
     メイン処理
     """
@@ -192,7 +281,26 @@ def main():
     
     # 男女別データの処理
     print("Processing gender-based data...")
-    processed_data, diseases = process_gender_data()
+    processed_data, diseases = process_gender_data(profiler)
+    
+    # 年齢階級別データ（疾病 × 週 × 年齢階級のキューブ）
+    print("Processing age-group data...")
+    age_builder = build_breakdown_cube('age', 'age_band', profiler)
+    if len(age_builder):
+        with profiler.stage('cube_write'):
+            values, meta = age_builder.build()
+            path = write_cube(output_dir, AGE_CUBE_NAME, values, meta)
+        print(f"Saved age cube: {path} {values.shape} {values.dtype}")
+    
+    # 保健所別データ（疾病 × 週 × 保健所のキューブ、保健所は二次保健医療圏ごとに並べる）
+    print("Processing regional data...")
+    region_builder = build_breakdown_cube('health_center', 'region', profiler)
+    if len(region_builder):
+        with profiler.stage('cube_write'):
+            values, meta = order_by_district(*region_builder.build())
+            path = write_cube(output_dir, REGION_CUBE_NAME, values, meta)
+        print(f"Saved region cube: {path} {values.shape} {values.dtype}")
+        check_district_rollup(SentinelCube(values, meta), build_breakdown_cube('medical_district', 'district', profiler))
     
     if not processed_data:
         print("No data processed. Exiting.")
@@ -200,7 +308,8 @@ def main():
     
     # 疾病別サマリーの作成
     print("Creating disease summaries...")
-    disease_summary = create_disease_summary(processed_data)
+    with profiler.stage('summary'):
+        disease_summary = create_disease_summary(processed_data)
     
     # 主要疾患のフィルタリング
     major_diseases = [
@@ -231,15 +340,17 @@ def main():
     ]
     
     # CSVファイルとして保存
-    with open(f'{output_dir}/sentinel_diseases_data.csv', 'w', encoding='utf-8', newline='') as f:
-        if major_disease_data:
-            writer = csv.DictWriter(f, fieldnames=major_disease_data[0].keys())
-            writer.writeheader()
-            writer.writerows(major_disease_data)
+    with profiler.stage('write_csv'):
+        with open(f'{output_dir}/sentinel_diseases_data.csv', 'w', encoding='utf-8', newline='') as f:
+            if major_disease_data:
+                writer = csv.DictWriter(f, fieldnames=major_disease_data[0].keys())
+                writer.writeheader()
+                writer.writerows(major_disease_data)
     
     # 疾病リストの保存
-    with open(f'{output_dir}/sentinel_disease_list.json', 'w', encoding='utf-8') as f:
-        json.dump(available_major_diseases, f, ensure_ascii=False, indent=2)
+    with profiler.stage('json_dump'):
+        with open(f'{output_dir}/sentinel_disease_list.json', 'w', encoding='utf-8') as f:
+            json.dump(available_major_diseases, f, ensure_ascii=False, indent=2)
     
     # 疾病別サマリーの保存（主要疾患のみ）
     major_disease_summary = {
@@ -248,17 +359,18 @@ def main():
         if disease in disease_summary
     }
     
-    with open(f'{output_dir}/sentinel_summary_statistics.json', 'w', encoding='utf-8') as f:
-        json.dump({
-            'total_records': len(major_disease_data),
-            'total_diseases': len(available_major_diseases),
-            'available_diseases': available_major_diseases,
-            'date_range': {
-                'start_year': min(record['year'] for record in major_disease_data) if major_disease_data else None,
-                'end_year': max(record['year'] for record in major_disease_data) if major_disease_data else None
-            },
-            'disease_statistics': major_disease_summary
-        }, f, ensure_ascii=False, indent=2)
+    with profiler.stage('json_dump'):
+        with open(f'{output_dir}/sentinel_summary_statistics.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'total_records': len(major_disease_data),
+                'total_diseases': len(available_major_diseases),
+                'available_diseases': available_major_diseases,
+                'date_range': {
+                    'start_year': min(record['year'] for record in major_disease_data) if major_disease_data else None,
+                    'end_year': max(record['year'] for record in major_disease_data) if major_disease_data else None
+                },
+                'disease_statistics': major_disease_summary
+            }, f, ensure_ascii=False, indent=2)
     
     print(f"Processing complete!")
     print(f"- Total records processed: {len(processed_data)}")
@@ -272,5 +384,16 @@ def main():
         stats = disease_summary.get(disease, {})
         print(f"  - {disease}: {stats.get('total_cases', 0)} cases, {stats.get('years_span', 0)} years")
 
+def main():
+    """
+    コマンドライン引数を解釈してメイン処理を実行
+    """
+    parser = argparse.ArgumentParser(description="定点サーベイランスデータ処理")
+    add_profile_arguments(parser, os.path.join("processed_data", "sentinel_profile_report.json"))
+    args = parser.parse_args()
+    
+    with profile_session(args, "sentinel_data_processor") as profiler:
+        run(profiler)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+複数ワーカーで共有するデータセット
+CSVを1度だけ数値列とコード表に変換してメモリマップファイル（既定は /dev/shm）に公開し、
+各ワーカーはコピーせずに読み取り専用でアタッチします。
+
+ディレクトリ構成:
+    lock                    公開処理の排他ロック
+    current.json            現在のセグメントを指すマニフェスト
+    <segment>.bin           列データ（64バイト境界に配置）
+    <segment>.json          列のdtype・オフセットとコード表
+    <segment>.refs/<pid>    アタッチ中のワーカー（参照がなくなった旧セグメントを削除する）
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT = 64
+# 列の構成やコード表を変えたら上げる（古い形式のセグメントは公開し直す）
+SEGMENT_FORMAT = 2
+MANIFEST_NAME = "current.json"
+LOCK_NAME = "lock"
+
+# 数値列のdtype（コード列はカテゴリ数に応じて決める）
+NUMERIC_COLUMNS = {
+    'count': np.int32,
+    'year': np.int16,
+    'week': np.int8,
+}
+# コード列（report_date は 'YYYY-MM-DD' の日付表へのコードとして保持する）
+CODED_COLUMNS = ('disease_name', 'category', 'report_date')
+COLUMN_ORDER = ['disease_name', 'count', 'year', 'week', 'report_date', 'category']
+
+
+def default_directory() -> str:
+    """共有セグメントの既定の置き場所（tmpfsがあればそちらを使う）"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "idsc_dataset")
+
+
+def source_fingerprint(path: str) -> str:
+    """元ファイルの変更検知用フィンガープリント"""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _code_dtype(n_categories: int):
+    if n_categories < np.iinfo(np.int8).max:
+        return np.int8
+    if n_categories < np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def write_json_atomic(path: str, payload: Dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def build_columns(source_path: str) -> Dict:
+    """CSVを列配列とコード表に変換"""
+    import pandas as pd
+
+    df = pd.read_csv(source_path)
+    columns: Dict[str, np.ndarray] = {}
+    code_tables: Dict[str, List[str]] = {}
+
+    for name in ('disease_name', 'category'):
+        codes, uniques = pd.factorize(df[name], sort=True)
+        columns[name] = codes.astype(_code_dtype(len(uniques)))
+        code_tables[name] = [str(u) for u in uniques]
+    for name, dtype in NUMERIC_COLUMNS.items():
+        columns[name] = df[name].to_numpy().astype(dtype)
+
+    # 日付は重複が多いため、一意な値だけを解析して日付表を作る
+    codes, uniques = pd.factorize(df['report_date'], sort=True)
+    normalized = pd.to_datetime(pd.Index(uniques)).strftime('%Y-%m-%d').to_numpy()
+    date_table, remap = np.unique(normalized, return_inverse=True)
+    columns['report_date'] = remap[codes].astype(_code_dtype(len(date_table)))
+    code_tables['report_date'] = date_table.tolist()
+
+    return {'rows': len(df), 'columns': columns, 'code_tables': code_tables}
+
+
+def write_segment(directory: str, segment: str, arrays: Dict[str, np.ndarray], meta: Dict) -> int:
+    """
+    配列をセグメントファイル（<segment>.bin）に書き出し、ヘッダー（<segment>.json）を保存
+    多次元配列は平坦化して書き出し、形状はヘッダーに記録する
+    """
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        layout.append({'name': name, 'dtype': array.dtype.str, 'offset': offset, 'shape': list(array.shape)})
+        offset += array.nbytes
+    total_bytes = max(offset, 1)
+
+    bin_path = os.path.join(directory, f"{segment}.bin")
+    buffer = np.memmap(bin_path, dtype=np.uint8, mode='w+', shape=(total_bytes,))
+    for entry in layout:
+        array = np.ascontiguousarray(arrays[entry['name']])
+        buffer[entry['offset']:entry['offset'] + array.nbytes] = array.reshape(-1).view(np.uint8)
+    buffer.flush()
+    del buffer
+
+    header = dict(meta)
+    header.update({'segment': segment, 'layout': layout, 'bytes': total_bytes})
+    write_json_atomic(os.path.join(directory, f"{segment}.json"), header)
+    return total_bytes
+
+
+def map_segment(directory: str, segment: str):
+    """セグメントを読み取り専用でメモリマップし、(ヘッダー, 配列の辞書) を返す"""
+    with open(os.path.join(directory, f"{segment}.json"), 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    buffer = np.memmap(os.path.join(directory, f"{segment}.bin"), dtype=np.uint8, mode='r')
+    arrays = {}
+    for entry in header['layout']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        start = entry['offset']
+        end = start + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        arrays[entry['name']] = buffer[start:end].view(dtype).reshape(shape)
+    return header, arrays
+
+
+def columns_to_dataframe(arrays: Dict[str, np.ndarray], code_tables: Dict[str, List[str]]):
+    """列配列とコード表からコピーなしでDataFrameを組み立てる（pandasはここで初めてimport）"""
+    import pandas as pd
+
+    data = {}
+    for name in COLUMN_ORDER:
+        if name == 'report_date':
+            data[name] = pd.Categorical.from_codes(
+                arrays[name], categories=pd.DatetimeIndex(pd.to_datetime(code_tables[name])), ordered=True
+            )
+        elif name in CODED_COLUMNS:
+            data[name] = pd.Categorical.from_codes(arrays[name], categories=code_tables[name])
+        else:
+            data[name] = arrays[name]
+    return pd.DataFrame(data, copy=False)
+
+
+@contextmanager
+def locked_directory(directory: str):
+    """ディレクトリ単位の排他ロック（複数ワーカー間）"""
+    with open(os.path.join(directory, LOCK_NAME), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SharedDataset:
+    """共有セグメントへのアタッチ（ワーカー1プロセス分）"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or default_directory()
+        self.segment: Optional[str] = None
+        self.header: Optional[Dict] = None
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(self.detach)
+
+    def _locked(self):
+        return locked_directory(self.directory)
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _refs_dir(self, segment: str) -> str:
+        return os.path.join(self.directory, f"{segment}.refs")
+
+    def _add_ref(self, segment: str):
+        refs = self._refs_dir(segment)
+        os.makedirs(refs, exist_ok=True)
+        open(os.path.join(refs, str(os.getpid())), 'w').close()
+
+    def _drop_ref(self, segment: str):
+        try:
+            os.remove(os.path.join(self._refs_dir(segment), str(os.getpid())))
+        except FileNotFoundError:
+            pass
+
+    def _live_refs(self, segment: str) -> int:
+        refs = self._refs_dir(segment)
+        live = 0
+        for entry in os.listdir(refs) if os.path.isdir(refs) else []:
+            if entry.isdigit() and _pid_alive(int(entry)):
+                live += 1
+            else:
+                # 異常終了したワーカーの参照は取り除く
+                try:
+                    os.remove(os.path.join(refs, entry))
+                except FileNotFoundError:
+                    pass
+        return live
+
+    def _retire_unreferenced(self, current: Optional[str]):
+        """現在のセグメント以外で参照のなくなったものを削除（ロック取得中に呼ぶ）"""
+        for entry in os.listdir(self.directory):
+            if not entry.endswith(".json") or entry == MANIFEST_NAME:
+                continue
+            segment = entry[:-len(".json")]
+            if segment == current or self._live_refs(segment) > 0:
+                continue
+            for suffix in (".bin", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, segment + suffix))
+                except FileNotFoundError:
+                    pass
+            shutil.rmtree(self._refs_dir(segment), ignore_errors=True)
+            logger.info(f"参照のなくなった共有セグメントを削除しました: {segment}")
+
+    def _publish(self, source_path: str, fingerprint: str, phases: Dict[str, float]) -> Dict:
+        phase_start = time.perf_counter()
+        built = build_columns(source_path)
+        phases['parse'] += time.perf_counter() - phase_start
+
+        segment = f"segment-{time.time_ns()}"
+        arrays = {name: built['columns'][name] for name in COLUMN_ORDER}
+        total_bytes = write_segment(self.directory, segment, arrays, {
+            'rows': built['rows'],
+            'fingerprint': fingerprint,
+            'code_tables': built['code_tables'],
+        })
+        manifest = {
+            'format': SEGMENT_FORMAT,
+            'segment': segment,
+            'fingerprint': fingerprint,
+            'source': os.path.abspath(source_path)
+        }
+        write_json_atomic(os.path.join(self.directory, MANIFEST_NAME), manifest)
+        logger.info(f"共有セグメントを公開しました: {segment} ({built['rows']} レコード, {total_bytes} バイト)")
+        return manifest
+
+    def is_stale(self, source_path: str) -> bool:
+        """公開済みセグメントまたは元ファイルがアタッチ後に更新されたか"""
+        manifest = self._read_manifest()
+        if manifest is None or manifest.get('segment') != self.segment:
+            return True
+        try:
+            return manifest.get('fingerprint') != source_fingerprint(source_path)
+        except OSError:
+            return False
+
+    def attach(self, source_path: str, phases: Optional[Dict[str, float]] = None) -> Dict:
+        """
+        最新のセグメントにアタッチする
+        元ファイルが更新されていれば（最初に気づいたワーカーが1度だけ）変換して公開する
+        """
+        if phases is None:
+            phases = {'read': 0.0, 'parse': 0.0}
+        with self._locked():
+            fingerprint = source_fingerprint(source_path)
+            manifest = self._read_manifest()
+            if (manifest is None or manifest.get('fingerprint') != fingerprint
+                    or manifest.get('format') != SEGMENT_FORMAT
+                    or not os.path.exists(os.path.join(self.directory, f"{manifest['segment']}.bin"))):
+                manifest = self._publish(source_path, fingerprint, phases)
+
+            phase_start = time.perf_counter()
+            segment = manifest['segment']
+            header, arrays = map_segment(self.directory, segment)
+
+            previous = self.segment
+            self._add_ref(segment)
+            self.segment, self.header, self._arrays = segment, header, arrays
+            if previous is not None and previous != segment:
+                self._drop_ref(previous)
+            self._retire_unreferenced(segment)
+            phases['read'] += time.perf_counter() - phase_start
+        return header
+
+    def detach(self):
+        """参照を外し、不要になったセグメントを片付ける"""
+        if self.segment is None:
+            return
+        segment = self.segment
+        self.segment, self.header, self._arrays = None, None, None
+        try:
+            with self._locked():
+                self._drop_ref(segment)
+                manifest = self._read_manifest()
+                self._retire_unreferenced(manifest.get('segment') if manifest else None)
+        except OSError:
+            pass
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """セグメント上の列配列（読み取り専用ビュー）"""
+        return dict(self._arrays)
+
+    def to_dataframe(self):
+        """列配列をコピーせずにDataFrameとして参照"""
+        return columns_to_dataframe(self._arrays, self.header['code_tables'])
+
+    def nbytes(self) -> int:
+        return int(self.header['bytes']) if self.header else 0
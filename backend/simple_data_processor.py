@@ -4,23 +4,155 @@
 標準ライブラリのみを使用してCSVファイルを処理します。
 """
 
+import argparse
+import io
 import os
 import csv
 import json
 import re
+import time
 from datetime import datetime, timedelta
 from collections import defaultdict
 import logging
 
+from input_sources import input_name, iter_input_files, read_input
+from partitions import PARTITION_DIR_NAME, PartitionedWriter
+from profiling import NULL_PROFILER, add_profile_arguments, profile_session, timed_lines
+from sqlite_store import SQLITE_FILE_NAME, SQLiteWriter
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CSV_FIELDNAMES = ['disease_name', 'count', 'year', 'week', 'report_date', 'category']
+
+class CsvSink:
+    """レコードをメインデータセットのCSVに書き出す（一時ファイルに書いてから置き換える）"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._tmp_path = path + ".tmp"
+        self._file = open(self._tmp_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=CSV_FIELDNAMES)
+        self._writer.writeheader()
+    
+    def write(self, records):
+        self._writer.writerows(records)
+    
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+    
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+class SQLiteSink:
+    """レコードをSQLiteデータベースに書き出す（APIサーバーの STORAGE_BACKEND=sqlite 用）"""
+    
+    def __init__(self, path):
+        self._writer = SQLiteWriter(path)
+    
+    def write(self, records):
+        self._writer.write_many(
+            (d['disease_name'], d['count'], d['year'], d['week'], d['report_date'][:10], d['category'])
+            for d in records
+        )
+    
+    def close(self):
+        self._writer.close()
+    
+    def abort(self):
+        self._writer.abort()
+
+class PartitionSink:
+    """レコードを年別（任意で分類別）のパーティションに書き出す"""
+    
+    def __init__(self, directory, by_category=False):
+        self._writer = PartitionedWriter(directory, by_category)
+    
+    def write(self, records):
+        self._writer.write_many(
+            (d['disease_name'], d['count'], d['year'], d['week'], d['report_date'], d['category'])
+            for d in records
+        )
+    
+    def close(self):
+        self._writer.close()
+    
+    def abort(self):
+        self._writer.abort()
+
+class SummaryAggregator:
+    """
+    サマリー統計と疾病リストを1回の走査で求める
+    保持するのは疾病・分類・年ごとの集計値のみで、レコード数には比例しない
+    """
+    
+    def __init__(self):
+        self.record_count = 0
+        self.years = set()
+        self.min_date = None
+        self.max_date = None
+        self.category_totals = defaultdict(int)
+        self.disease_totals = defaultdict(int)
+        self.yearly_totals = defaultdict(int)
+    
+    def write(self, records):
+        category_totals = self.category_totals
+        disease_totals = self.disease_totals
+        yearly_totals = self.yearly_totals
+        for record in records:
+            count = record['count']
+            category_totals[record['category']] += count
+            disease_totals[record['disease_name']] += count
+            yearly_totals[str(record['year'])] += count
+            self.years.add(record['year'])
+            report_date = record['report_date']
+            if self.min_date is None or report_date < self.min_date:
+                self.min_date = report_date
+            if self.max_date is None or report_date > self.max_date:
+                self.max_date = report_date
+        self.record_count += len(records)
+    
+    def close(self):
+        pass
+    
+    def abort(self):
+        pass
+    
+    def summary(self):
+        if not self.record_count:
+            return {}
+        
+        # 上位10疾病を取得
+        top_diseases_sorted = dict(sorted(self.disease_totals.items(), key=lambda x: x[1], reverse=True)[:10])
+        
+        return {
+            'total_records': self.record_count,
+            'date_range': {
+                'start': self.min_date,
+                'end': self.max_date
+            },
+            'years_covered': sorted(self.years),
+            'total_diseases': len(self.disease_totals),
+            'disease_categories': dict(self.category_totals),
+            'top_diseases': top_diseases_sorted,
+            'yearly_totals': dict(self.yearly_totals)
+        }
+    
+    def disease_list(self):
+        return sorted(self.disease_totals)
+
 class SimpleDataProcessor:
-    def __init__(self, csv_dir: str = "../csv_list", output_dir: str = "processed_data"):
+    def __init__(self, csv_dir: str = "../csv_list", output_dir: str = "processed_data", profiler=None,
+                 partition_by_category: bool = False):
         self.csv_dir = csv_dir
         self.output_dir = output_dir
         self.disease_categories = self._load_disease_categories()
+        self.profiler = profiler or NULL_PROFILER
+        self.partition_by_category = partition_by_category
         
         # 出力ディレクトリ作成
         os.makedirs(self.output_dir, exist_ok=True)
@@ -74,12 +206,11 @@ class SimpleDataProcessor:
         return None
     
     def _week_to_date(self, year, week):
-        """年と週番号から日付を計算"""
-        jan1 = datetime(year, 1, 1)
-        days_to_first_monday = (7 - jan1.weekday()) % 7
-        first_monday = jan1 + timedelta(days=days_to_first_monday)
-        target_date = first_monday + timedelta(weeks=week-1)
-        return target_date.isoformat()
+        """年とISO週番号から、その週の月曜日の日付を計算"""
+        # 第1週は1月4日を含む週（月曜始まり）
+        jan4 = datetime(year, 1, 4)
+        week1_monday = jan4 - timedelta(days=jan4.weekday())
+        return (week1_monday + timedelta(weeks=week-1)).isoformat()
     
     def _get_disease_category(self, disease_name):
         """疾病名から法定分類を取得"""
@@ -89,9 +220,9 @@ class SimpleDataProcessor:
         return "その他"
     
     def process_csv_file(self, filepath):
-        """単一のCSVファイルを処理"""
+        """単一のCSVファイル（パスまたはアーカイブのメンバー）を処理"""
         try:
-            filename = os.path.basename(filepath)
+            filename = input_name(filepath)
             date_info = self._extract_date_from_filename(filename)
             if not date_info:
                 logger.warning(f"日付情報を抽出できませんでした: {filename}")
@@ -101,41 +232,53 @@ class SimpleDataProcessor:
             report_date = self._week_to_date(year, week)
             
             # CSVファイルを読み込み（Shift-JIS エンコーディング）
-            with open(filepath, 'r', encoding='shift_jis') as f:
-                lines = f.readlines()
+            with self.profiler.stage('read'):
+                raw = read_input(filepath)
+            # 全体を文字列や行のリストにせず、先頭から順にデコードしながら読む
+            # （decode の時間はヘッダー探索・行の解析のステージから除いて記録する）
+            lines = timed_lines(io.TextIOWrapper(io.BytesIO(raw), encoding='shift_jis'), self.profiler.timer('decode'))
             
             # 疾病データの開始行を見つける
-            data_start = None
-            for i, line in enumerate(lines):
-                if '疾病名' in line and '報告数' in line:
-                    data_start = i + 1
-                    break
+            with self.profiler.stage('header_search'):
+                data_start = None
+                for i, line in enumerate(lines):
+                    if '疾病名' in line and '報告数' in line:
+                        data_start = i + 1
+                        break
             
             if data_start is None:
                 logger.warning(f"疾病データが見つかりませんでした: {filename}")
                 return []
             
             # 疾病データを抽出
-            disease_data = []
-            for line in lines[data_start:]:
-                line = line.strip()
-                if line and ',' in line:
-                    parts = line.split(',')
-                    if len(parts) >= 2:
-                        disease_name = parts[0].strip('"')
-                        try:
-                            count = int(parts[1].strip('"'))
-                            if disease_name:
-                                disease_data.append({
-                                    'disease_name': disease_name,
-                                    'count': count,
-                                    'year': year,
-                                    'week': week,
-                                    'report_date': report_date,
-                                    'category': self._get_disease_category(disease_name)
-                                })
-                        except ValueError:
-                            continue
+            # 分類の判定は行ごとに stage() で囲むと計測の負荷で結果が歪むため、時間を合計してファイルごとに記録する
+            # （row_parse の中で記録し、row_parse の時間からは除く）
+            categorize_seconds = 0.0
+            with self.profiler.stage('row_parse'):
+                disease_data = []
+                for line in lines:
+                    line = line.strip()
+                    if line and ',' in line:
+                        parts = line.split(',')
+                        if len(parts) >= 2:
+                            disease_name = parts[0].strip('"')
+                            try:
+                                count = int(parts[1].strip('"'))
+                                if disease_name:
+                                    categorize_start = time.perf_counter()
+                                    category = self._get_disease_category(disease_name)
+                                    categorize_seconds += time.perf_counter() - categorize_start
+                                    disease_data.append({
+                                        'disease_name': disease_name,
+                                        'count': count,
+                                        'year': year,
+                                        'week': week,
+                                        'report_date': report_date,
+                                        'category': category
+                                    })
+                            except ValueError:
+                                continue
+                self.profiler.add_time('categorize', categorize_seconds)
             
             return disease_data
                 
@@ -143,131 +286,149 @@ class SimpleDataProcessor:
             logger.error(f"ファイル処理中にエラーが発生しました {filepath}: {str(e)}")
             return []
     
-    def process_all_files(self):
-        """すべてのCSVファイルを処理"""
+    def iter_file_records(self):
+        """
+        すべてのCSVファイルを処理し、ファイルごとのレコードのリストを順に返す
+        全ファイル分のレコードを保持しないため、メモリ使用量はファイル1つ分で済む
+        """
         logger.info("CSVファイルの処理を開始します...")
         
-        csv_files = [f for f in os.listdir(self.csv_dir) if f.endswith('_raw.csv') and f.startswith('notifiable_weekly_')]
-        logger.info(f"処理対象ファイル数: {len(csv_files)}")
+        # アーカイブ内のメンバーは展開せずに順に読み込むため、件数は処理しながら数える
+        csv_files = iter_input_files(
+            self.csv_dir, lambda name: name.endswith('_raw.csv') and name.startswith('notifiable_weekly_')
+        )
         
-        all_data = []
         processed_count = 0
+        record_count = 0
+        file_count = 0
         
-        for filename in csv_files:
-            filepath = os.path.join(self.csv_dir, filename)
-            data = self.process_csv_file(filepath)
+        while True:
+            with self.profiler.stage('list_files'):
+                source = next(csv_files, None)
+            if source is None:
+                break
+            file_count += 1
+            file_start, file_cpu_start = time.perf_counter(), time.process_time()
+            data = self.process_csv_file(source)
+            self.profiler.record_file(input_name(source), time.perf_counter() - file_start, time.process_time() - file_cpu_start)
             if data:
-                all_data.extend(data)
                 processed_count += 1
+                record_count += len(data)
+                yield data
                 
                 if processed_count % 100 == 0:
-                    logger.info(f"処理済み: {processed_count}/{len(csv_files)}")
+                    logger.info(f"処理済み: {processed_count}")
         
-        logger.info(f"統合完了: {len(all_data)} レコード")
+        logger.info(f"処理対象ファイル数: {file_count}")
+        logger.info(f"統合完了: {record_count} レコード")
+    
+    def process_all_files(self):
+        """すべてのCSVファイルを処理（全レコードのリストを返す）"""
+        all_data = []
+        for data in self.iter_file_records():
+            all_data.extend(data)
         return all_data
     
     def generate_summary_statistics(self, data):
         """サマリー統計を生成"""
-        if not data:
-            return {}
-        
-        # 基本統計
-        years = set(d['year'] for d in data)
-        diseases = set(d['disease_name'] for d in data)
-        categories = defaultdict(int)
-        top_diseases = defaultdict(int)
-        yearly_totals = defaultdict(int)
-        
-        min_date = min(d['report_date'] for d in data)
-        max_date = max(d['report_date'] for d in data)
-        
-        for record in data:
-            categories[record['category']] += record['count']
-            top_diseases[record['disease_name']] += record['count']
-            yearly_totals[str(record['year'])] += record['count']
+        aggregator = SummaryAggregator()
+        aggregator.write(data)
+        return aggregator.summary()
+    
+    def save_processed_data(self, data):
+        """
+        処理済みデータを保存
+        data はレコードのリスト、またはレコードのリストを順に返すイテラブル（iter_file_records）
+        レコードは1回だけ走査し、CSV・SQLite・パーティションへの書き出しと集計を同時に行う
+        戻り値はサマリー統計
+        """
+        batches = [data] if isinstance(data, list) else data
         
-        # 上位10疾病を取得
-        top_diseases_sorted = dict(sorted(top_diseases.items(), key=lambda x: x[1], reverse=True)[:10])
+        main_file = os.path.join(self.output_dir, 'infectious_diseases_data.csv')
+        sqlite_file = os.path.join(self.output_dir, SQLITE_FILE_NAME)
+        partition_dir = os.path.join(self.output_dir, PARTITION_DIR_NAME)
+        aggregator = SummaryAggregator()
+        sinks = [
+            ('write_main_csv', CsvSink(main_file)),
+            ('summary', aggregator),
+            ('sqlite', SQLiteSink(sqlite_file)),
+            ('partitions', PartitionSink(partition_dir, self.partition_by_category)),
+        ]
         
-        summary = {
-            'total_records': len(data),
-            'date_range': {
-                'start': min_date,
-                'end': max_date
-            },
-            'years_covered': sorted(list(years)),
-            'total_diseases': len(diseases),
-            'disease_categories': dict(categories),
-            'top_diseases': top_diseases_sorted,
-            'yearly_totals': dict(yearly_totals)
-        }
+        try:
+            for batch in batches:
+                for stage, sink in sinks:
+                    with self.profiler.stage(stage):
+                        sink.write(batch)
+        except BaseException:
+            for _, sink in sinks:
+                sink.abort()
+            raise
         
-        return summary
-    
-    def save_processed_data(self, data):
-        """処理済みデータを保存"""
-        if not data:
+        if aggregator.record_count == 0:
+            for _, sink in sinks:
+                sink.abort()
             logger.error("保存するデータがありません")
-            return
+            return {}
         
-        # メインデータセットを保存（CSV形式）
-        main_file = os.path.join(self.output_dir, 'infectious_diseases_data.csv')
-        with open(main_file, 'w', newline='', encoding='utf-8') as f:
-            fieldnames = ['disease_name', 'count', 'year', 'week', 'report_date', 'category']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
+        for stage, sink in sinks:
+            with self.profiler.stage(stage):
+                sink.close()
         logger.info(f"メインデータセットを保存しました: {main_file}")
+        logger.info(f"SQLiteデータベースを保存しました: {sqlite_file}")
+        logger.info(f"パーティションを保存しました: {partition_dir}")
         
         # サマリー統計を保存
-        summary = self.generate_summary_statistics(data)
+        summary = aggregator.summary()
         summary_file = os.path.join(self.output_dir, 'summary_statistics.json')
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2)
+        with self.profiler.stage('json_dump'):
+            with open(summary_file, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
         logger.info(f"サマリー統計を保存しました: {summary_file}")
         
         # 疾病リストを保存
-        disease_list = sorted(list(set(d['disease_name'] for d in data)))
+        with self.profiler.stage('disease_list'):
+            disease_list = aggregator.disease_list()
         disease_file = os.path.join(self.output_dir, 'disease_list.json')
-        with open(disease_file, 'w', encoding='utf-8') as f:
-            json.dump(disease_list, f, ensure_ascii=False, indent=2)
+        with self.profiler.stage('json_dump'):
+            with open(disease_file, 'w', encoding='utf-8') as f:
+                json.dump(disease_list, f, ensure_ascii=False, indent=2)
         logger.info(f"疾病リストを保存しました: {disease_file}")
         
         logger.info("データ処理が完了しました")
+        return summary
 
 def main():
     """メイン実行関数"""
-    processor = SimpleDataProcessor()
+    parser = argparse.ArgumentParser(description="簡易版データ処理")
+    parser.add_argument('--partition-by-category', action='store_true',
+                        help='パーティションを年に加えて感染症分類でも分割する')
+    add_profile_arguments(parser, os.path.join("processed_data", "profile_report.json"))
+    args = parser.parse_args()
     
-    # すべてのファイルを処理
-    data = processor.process_all_files()
-    
-    # 処理済みデータを保存
-    processor.save_processed_data(data)
+    with profile_session(args, "simple_data_processor") as profiler:
+        processor = SimpleDataProcessor(profiler=profiler, partition_by_category=args.partition_by_category)
+        
+        # ファイルごとに処理しながら保存（全レコードをメモリに保持しない）
+        summary = processor.save_processed_data(processor.iter_file_records())
     
     print("\n=== 処理結果 ===")
-    if data:
-        print(f"総レコード数: {len(data):,}")
+    if summary:
+        print(f"総レコード数: {summary['total_records']:,}")
         
-        years = set(d['year'] for d in data)
+        years = summary['years_covered']
         print(f"期間: {min(years)} - {max(years)}")
         
-        diseases = set(d['disease_name'] for d in data)
-        print(f"疾病数: {len(diseases)}")
+        print(f"疾病数: {summary['total_diseases']}")
         
         print(f"対象年数: {len(years)}")
         
         # 上位疾病を表示
-        disease_counts = defaultdict(int)
-        for d in data:
-            disease_counts[d['disease_name']] += d['count']
-        
-        top_diseases = sorted(disease_counts.items(), key=lambda x: x[1], reverse=True)[:10]
         print("\n主要疾病（報告数上位10）:")
-        for disease, count in top_diseases:
+        for disease, count in summary['top_diseases'].items():
             print(f"  {disease}: {count:,}")
     else:
         print("処理可能なデータがありませんでした")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,17 +4,29 @@
 標準ライブラリのみを使用したシンプル版
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
 import json
 import csv
 import os
-from typing import Dict, List, Optional
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
 from pydantic import BaseModel
 import logging
 
+from export import EXPORT_FORMATS, batched, export_metrics_recorder, export_sort_key, stream_export
+from metrics import MetricsMiddleware, MetricsRegistry
+from partitions import (
+    PARTITION_DIR_NAME, partition_paths, read_partition_index, resolve_year_range, select_partitions
+)
+from profiling import timed_lines
+from sqlite_store import SQLITE_FILE_NAME, SQLiteStore, StoreBusyError
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,16 +46,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# メトリクス収集
+metrics = MetricsRegistry()
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
+@app.exception_handler(StoreBusyError)
+async def store_busy_handler(request: Request, exc: StoreBusyError):
+    """SQLiteの接続プールが空かないときは503を返す"""
+    metrics.inc_counter("sqlite_pool_timeouts_total", 1, "SQLiteの接続プールの空き待ちがタイムアウトした件数")
+    logger.warning(f"SQLiteの接続待ちがタイムアウトしました: {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "データベースが混み合っています。しばらくしてから再実行してください"},
+        headers={"Retry-After": "1"}
+    )
+
 # データファイルのパス
 DATA_DIR = "processed_data"
 MAIN_DATA_FILE = os.path.join(DATA_DIR, "infectious_diseases_data.csv")
 SUMMARY_FILE = os.path.join(DATA_DIR, "summary_statistics.json")
 DISEASE_LIST_FILE = os.path.join(DATA_DIR, "disease_list.json")
+SQLITE_FILE = os.path.join(DATA_DIR, SQLITE_FILE_NAME)
+PARTITION_DIR = os.path.join(DATA_DIR, PARTITION_DIR_NAME)
+# CSVを読み込む単位（この量ずつ読みながら解析し、ファイル全体は保持しない）
+READ_CHUNK_BYTES = 1 << 20
+
+# ストレージバックエンド（memory: 全件をリストで保持 / sqlite: SQLiteを読み取り専用で参照）
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+
+# 読み込む期間（指定するとパーティションインデックスを参照し、期間にかかるパーティションだけを読み込む）
+DATA_START_YEAR = int(os.environ["DATA_START_YEAR"]) if os.environ.get("DATA_START_YEAR") else None
+DATA_END_YEAR = int(os.environ["DATA_END_YEAR"]) if os.environ.get("DATA_END_YEAR") else None
+DATA_RECENT_YEARS = int(os.environ["DATA_RECENT_YEARS"]) if os.environ.get("DATA_RECENT_YEARS") else None
 
 # グローバルデータ変数
 main_data: List[Dict] = []
 summary_stats: Optional[Dict] = None
 disease_list: Optional[List[str]] = None
+dataset_memory_bytes: int = 0
+sqlite_store: Optional[SQLiteStore] = None
+# 再読み込みを1つずつ行う
+data_load_lock = asyncio.Lock()
 
 # Pydanticモデル
 class DiseaseData(BaseModel):
@@ -72,55 +115,159 @@ class SummaryResponse(BaseModel):
     top_diseases: Dict[str, int]
     yearly_totals: Dict[str, int]
 
-def load_data():
-    """データファイルを読み込み"""
-    global main_data, summary_stats, disease_list
+def _estimate_records_bytes(records: List[Dict]) -> int:
+    """レコードリストのおおよそのメモリ使用量（バイト）"""
+    total = sys.getsizeof(records)
+    for record in records:
+        total += sys.getsizeof(record)
+        for value in record.values():
+            total += sys.getsizeof(value)
+    return total
+
+def _open_sqlite_store() -> Optional[SQLiteStore]:
+    """
+    SQLiteストアを開く（置き換えは load_data で行う）
+    旧ストアは閉じずに参照を外すだけにする（スレッドプールで実行中のクエリが旧ストアの接続を使い終えた時点で、
+    参照カウントが0になり接続も閉じられる）
+    """
+    if not os.path.exists(SQLITE_FILE):
+        logger.warning(f"SQLiteデータベースが見つかりません: {SQLITE_FILE}")
+        return None
+    store = SQLiteStore(SQLITE_FILE)
+    logger.info(f"SQLiteデータベースを開きました: {store.record_count} レコード")
+    metrics.set_gauge("sqlite_file_bytes", store.file_size(), "SQLiteデータベースのファイルサイズ（バイト）")
+    return store
+
+def _records_count() -> int:
+    """読み込み済みレコード数"""
+    if sqlite_store is not None:
+        return sqlite_store.record_count
+    return len(main_data)
+
+def _parse_records(lines: Iterable[str]) -> List[Dict]:
+    """CSVの行をレコードのリストに変換"""
+    records = []
+    reader = csv.DictReader(lines)
+    for row in reader:
+        row['count'] = int(row['count'])
+        row['year'] = int(row['year'])
+        row['week'] = int(row['week'])
+        records.append(row)
+    return records
+
+def _read_records(path: str, phases: Dict[str, float]) -> List[Dict]:
+    """CSVファイルを全体を保持せずに読み込んで解析（読み込みと解析の時間を分けて phases に加算）"""
+    def add_read(wall_seconds: float, cpu_seconds: float):
+        phases['read'] += wall_seconds
     
-    try:
-        # CSVデータを読み込み
-        if os.path.exists(MAIN_DATA_FILE):
-            main_data = []
-            with open(MAIN_DATA_FILE, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    row['count'] = int(row['count'])
-                    row['year'] = int(row['year'])
-                    row['week'] = int(row['week'])
-                    main_data.append(row)
-            logger.info(f"メインデータを読み込みました: {len(main_data)} レコード")
-        else:
-            logger.warning(f"メインデータファイルが見つかりません: {MAIN_DATA_FILE}")
-            main_data = []
-        
-        # サマリー統計を読み込み
-        if os.path.exists(SUMMARY_FILE):
-            with open(SUMMARY_FILE, 'r', encoding='utf-8') as f:
-                summary_stats = json.load(f)
-            logger.info("サマリー統計を読み込みました")
-        else:
-            logger.warning(f"サマリーファイルが見つかりません: {SUMMARY_FILE}")
-            summary_stats = {}
-        
-        # 疾病リストを読み込み
-        if os.path.exists(DISEASE_LIST_FILE):
-            with open(DISEASE_LIST_FILE, 'r', encoding='utf-8') as f:
-                disease_list = json.load(f)
-            logger.info(f"疾病リストを読み込みました: {len(disease_list)} 疾病")
-        else:
-            logger.warning(f"疾病リストファイルが見つかりません: {DISEASE_LIST_FILE}")
-            disease_list = []
-            
-    except Exception as e:
-        logger.error(f"データ読み込みエラー: {str(e)}")
-        main_data = []
-        summary_stats = {}
-        disease_list = []
+    read_before = phases['read']
+    phase_start = time.perf_counter()
+    with open(path, 'r', encoding='utf-8') as f:
+        records = _parse_records(timed_lines(f, add_read, READ_CHUNK_BYTES))
+    phases['parse'] += time.perf_counter() - phase_start - (phases['read'] - read_before)
+    return records
+
+def _read_data() -> Tuple[Dict[str, float], Dict]:
+    """
+    データファイルを読み込み、置き換え後の状態を作る（フェーズ別の所要時間と状態を返す）
+    スレッドプールで実行するため、応答に使うグローバル変数はここでは書き換えない
+    """
+    phases = {'read': 0.0, 'parse': 0.0, 'metadata': 0.0}
+    store = None
+    records: List[Dict] = []
+    
+    partition_index = None
+    if STORAGE_BACKEND != "sqlite" and (DATA_START_YEAR or DATA_END_YEAR or DATA_RECENT_YEARS):
+        partition_index = read_partition_index(PARTITION_DIR)
+        if partition_index is None:
+            logger.warning(f"パーティションインデックスが見つからないため全期間を読み込みます: {PARTITION_DIR}")
+    
+    # CSVデータを読み込み
+    if STORAGE_BACKEND == "sqlite":
+        # レコードはSQLiteから都度参照するため、メモリには読み込まない
+        phase_start = time.perf_counter()
+        store = _open_sqlite_store()
+        phases['read'] = time.perf_counter() - phase_start
+    elif partition_index is not None:
+        # 対象期間にかかるパーティションだけを読み込む
+        start_year, end_year = resolve_year_range(partition_index, DATA_START_YEAR, DATA_END_YEAR, DATA_RECENT_YEARS)
+        entries = select_partitions(partition_index, start_year, end_year)
+        for path in partition_paths(PARTITION_DIR, entries):
+            records.extend(_read_records(path, phases))
+        metrics.set_gauge("dataset_partitions_loaded", len(entries), "読み込んだパーティション数")
+        logger.info(
+            f"パーティションを読み込みました: {len(entries)}/{len(partition_index['partitions'])} "
+            f"({start_year or '-'}〜{end_year or '-'}年, {len(records)} レコード)"
+        )
+    elif os.path.exists(MAIN_DATA_FILE):
+        records = _read_records(MAIN_DATA_FILE, phases)
+        logger.info(f"メインデータを読み込みました: {len(records)} レコード")
+    else:
+        logger.warning(f"メインデータファイルが見つかりません: {MAIN_DATA_FILE}")
+    
+    phase_start = time.perf_counter()
+    # サマリー統計を読み込み
+    if os.path.exists(SUMMARY_FILE):
+        with open(SUMMARY_FILE, 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+        logger.info("サマリー統計を読み込みました")
+    else:
+        logger.warning(f"サマリーファイルが見つかりません: {SUMMARY_FILE}")
+        summary = {}
+    
+    # 疾病リストを読み込み
+    if os.path.exists(DISEASE_LIST_FILE):
+        with open(DISEASE_LIST_FILE, 'r', encoding='utf-8') as f:
+            diseases = json.load(f)
+        logger.info(f"疾病リストを読み込みました: {len(diseases)} 疾病")
+    else:
+        logger.warning(f"疾病リストファイルが見つかりません: {DISEASE_LIST_FILE}")
+        diseases = []
+    phases['metadata'] = time.perf_counter() - phase_start
+    
+    return phases, {
+        'main_data': records,
+        'sqlite_store': store,
+        'summary_stats': summary,
+        'disease_list': diseases,
+        # メモリ使用量はスクレイプごとではなく読み込み時に一度だけ計測する
+        'dataset_memory_bytes': _estimate_records_bytes(records),
+    }
+
+async def load_data():
+    """
+    データファイルを読み込み
+    読み込みはスレッドプールで行い、読み込みが終わってからグローバル変数をまとめて置き換える
+    （置き換えの間に await を挟まないため、応答中のリクエストから新旧の混ざった状態は見えない）
+    読み込みに失敗した場合は例外を送出し、読み込み済みのデータをそのまま使い続ける
+    """
+    global main_data, summary_stats, disease_list, dataset_memory_bytes, sqlite_store
+    
+    async with data_load_lock:
+        try:
+            phases, state = await run_in_threadpool(_read_data)
+        except Exception as e:
+            logger.error(f"データ読み込みエラー: {str(e)}")
+            raise
+        main_data = state['main_data']
+        sqlite_store = state['sqlite_store']
+        summary_stats = state['summary_stats']
+        disease_list = state['disease_list']
+        dataset_memory_bytes = state['dataset_memory_bytes']
+    
+    metrics.record_load_phases(phases)
+    metrics.set_gauge("dataset_records", _records_count(), "読み込み済みレコード数")
+    metrics.set_gauge("dataset_memory_bytes", dataset_memory_bytes, "読み込み済みデータセットのメモリ使用量（バイト）")
 
 @app.on_event("startup")
 async def startup_event():
     """アプリケーション起動時の処理"""
     logger.info("アプリケーションを開始しています...")
-    load_data()
+    try:
+        await load_data()
+    except Exception:
+        # エラーは load_data で記録済み。データなしで起動し、/reload-data で読み込み直せるようにする
+        pass
 
 @app.get("/")
 async def root():
@@ -132,11 +279,17 @@ async def health_check():
     """ヘルスチェックエンドポイント"""
     return {
         "status": "healthy",
-        "data_loaded": len(main_data) > 0,
-        "records_count": len(main_data),
+        "data_loaded": _records_count() > 0,
+        "records_count": _records_count(),
+        "storage_backend": STORAGE_BACKEND,
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus形式のメトリクスを取得"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/summary")
 async def get_summary():
     """サマリー統計を取得"""
@@ -160,6 +313,20 @@ async def get_disease_timeseries(
     end_year: Optional[int] = Query(None, description="終了年")
 ):
     """特定疾病の時系列データを取得"""
+    # SQLiteへの問い合わせはイベントループを止めないようスレッドプールで実行する
+    store = sqlite_store
+    if store is not None:
+        if not await run_in_threadpool(store.disease_exists, disease_name):
+            raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' のデータが見つかりません")
+        timeseries_data = await run_in_threadpool(store.disease_timeseries, disease_name, start_year, end_year)
+        if not timeseries_data:
+            raise HTTPException(status_code=404, detail="指定された条件のデータが見つかりません")
+        return {
+            "disease_name": disease_name,
+            "data": timeseries_data,
+            "total_records": len(timeseries_data)
+        }
+    
     if not main_data:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
@@ -201,6 +368,17 @@ async def get_top_diseases(
     year: Optional[int] = Query(None, description="対象年")
 ):
     """報告数上位の疾病を取得"""
+    store = sqlite_store
+    if store is not None:
+        result = await run_in_threadpool(store.top_diseases, limit, year)
+        if year and not result:
+            raise HTTPException(status_code=404, detail=f"{year}年のデータが見つかりません")
+        return {
+            "top_diseases": result,
+            "year": year,
+            "total_diseases": len(result)
+        }
+    
     if not main_data:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
@@ -243,6 +421,10 @@ async def get_top_diseases(
 @app.get("/categories")
 async def get_categories():
     """感染症分類別統計を取得"""
+    store = sqlite_store
+    if store is not None:
+        return {"categories": await run_in_threadpool(store.categories)}
+    
     if not main_data:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
@@ -273,6 +455,10 @@ async def get_categories():
 @app.get("/yearly-trends")
 async def get_yearly_trends():
     """年別感染症発生動向を取得"""
+    store = sqlite_store
+    if store is not None:
+        return {"yearly_trends": await run_in_threadpool(store.yearly_trends)}
+    
     if not main_data:
         raise HTTPException(status_code=404, detail="データが見つかりません")
     
@@ -292,14 +478,50 @@ async def get_yearly_trends():
     
     return {"yearly_trends": result}
 
+@app.get("/export")
+async def export_records(
+    export_format: str = Query("csv", alias="format", description="出力形式（csv, ndjson）"),
+    disease_name: Optional[str] = Query(None, description="疾病名（省略時は全疾病）"),
+    start_year: Optional[int] = Query(None, description="開始年"),
+    end_year: Optional[int] = Query(None, description="終了年")
+):
+    """レコードをCSVまたはNDJSONでストリーミング出力"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"出力形式は {', '.join(EXPORT_FORMATS)} のいずれかを指定してください")
+    
+    store = sqlite_store
+    if store is not None:
+        if disease_name is not None and not await run_in_threadpool(store.disease_exists, disease_name):
+            raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' のデータが見つかりません")
+        batches = store.iter_records(disease_name, start_year, end_year)
+    else:
+        if not main_data:
+            raise HTTPException(status_code=404, detail="データが見つかりません")
+        if disease_name is not None and disease_name not in (disease_list or []):
+            raise HTTPException(status_code=404, detail=f"疾病 '{disease_name}' のデータが見つかりません")
+        # SQLite と同じ 疾病名 → 報告日 の順で出力する
+        batches = batched(sorted((
+            (d['disease_name'], d['count'], d['year'], d['week'], d['report_date'][:10], d['category'])
+            for d in main_data
+            if (disease_name is None or d['disease_name'] == disease_name)
+            and (not start_year or d['year'] >= start_year)
+            and (not end_year or d['year'] <= end_year)
+        ), key=export_sort_key))
+    
+    return StreamingResponse(
+        stream_export(batches, export_format, export_metrics_recorder(metrics, export_format)),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="infectious_diseases.{export_format}"'}
+    )
+
 @app.get("/reload-data")
 async def reload_data():
     """データの再読み込み"""
     try:
-        load_data()
+        await load_data()
         return {
             "message": "データを再読み込みしました",
-            "records_count": len(main_data),
+            "records_count": _records_count(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
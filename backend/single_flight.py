@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+同一リクエストの同時実行をまとめる（single-flight）
+キー（ルート・正規化したパラメータ・データの版）が同じ計算が実行中なら新たに実行せず、
+実行中の計算の完了を待って同じ結果（または同じ例外）を受け取ります。
+計算はスレッドプールで実行するため、待っている間もイベントループは他のリクエストを処理できます。
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, Hashable
+
+from fastapi.concurrency import run_in_threadpool
+
+
+class SingleFlight:
+    """
+    実行中の計算をキーごとに1つだけ保持する
+    結果は待っていたリクエストすべてで共有するため、呼び出し側で変更しないこと
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _record(self, route: str, coalesced: bool):
+        if self.registry is None:
+            return
+        if coalesced:
+            self.registry.inc_counter(
+                "singleflight_coalesced_total", 1, "実行中の同一計算の結果を共有したリクエスト数", route=route
+            )
+        else:
+            self.registry.inc_counter(
+                "singleflight_executions_total", 1, "single-flight で実際に実行した計算の数", route=route
+            )
+
+    async def run(self, route: str, key: Hashable, func: Callable[..., Any], *args) -> Any:
+        """key の計算が実行中ならその結果を待ち、なければ func(*args) をスレッドプールで実行する"""
+        call_key = (route, key)
+        future = self._calls.get(call_key)
+        if future is not None:
+            self._record(route, True)
+            # 待っている側が切断されても実行中の計算は取り消さない
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_key] = future
+        self._record(route, False)
+        try:
+            result = await run_in_threadpool(func, *args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 待っているリクエストがない場合に「例外が取り出されなかった」警告を出さない
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[call_key]
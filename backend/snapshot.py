@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+APIサーバー起動用のバイナリスナップショット
+メインデータを疾病・日付順の列配列に変換し、疾病別の行範囲インデックスと集計値を合わせて保存します。
+スナップショットは元CSVのSHA-256で管理され、起動時はメモリマップするだけで応答できます。
+（pandasは不要。DataFrameが必要になった時点で初めてimportします）
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from export import iter_coded_batches, record_order
+from shared_dataset import (
+    COLUMN_ORDER, build_columns, locked_directory,
+    map_segment, write_json_atomic, write_segment
+)
+
+logger = logging.getLogger(__name__)
+
+# 配列構成を変えたら上げる（古い形式のスナップショットは作り直す）
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_DIR_NAME = ".snapshot"
+MANIFEST_NAME = "current.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_snapshot_arrays(source_path: str) -> Dict:
+    """元CSVから、並べ替え済みの列配列・インデックス・集計値を作成"""
+    built = build_columns(source_path)
+    columns = built['columns']
+    n_diseases = len(built['code_tables']['disease_name'])
+    n_categories = len(built['code_tables']['category'])
+
+    valid = (columns['disease_name'] >= 0) & (columns['category'] >= 0)
+    order = record_order(columns)
+    order = order[valid[order]]
+    arrays = {name: columns[name][order] for name in COLUMN_ORDER}
+
+    disease = arrays['disease_name'].astype(np.int64)
+    category = arrays['category'].astype(np.int64)
+    counts = arrays['count'].astype(np.int64)
+
+    # 疾病ごとの行範囲（disease_offsets[i]:disease_offsets[i + 1]）
+    rows_per_disease = np.bincount(disease, minlength=n_diseases)
+    disease_offsets = np.zeros(n_diseases + 1, dtype=np.int64)
+    np.cumsum(rows_per_disease, out=disease_offsets[1:])
+
+    years = np.unique(arrays['year']).astype(np.int16)
+    year_index = np.searchsorted(years, arrays['year']).astype(np.int64)
+    cell = disease * len(years) + year_index
+    shape = (n_diseases, len(years))
+
+    disease_category = np.full(n_diseases, -1, dtype=np.int16)
+    present = rows_per_disease > 0
+    disease_category[present] = category[disease_offsets[:-1][present]]
+
+    pairs = np.unique(category * n_diseases + disease)
+
+    arrays.update({
+        'disease_offsets': disease_offsets,
+        'disease_totals': np.bincount(disease, weights=counts, minlength=n_diseases).astype(np.int64),
+        'disease_category': disease_category,
+        'years': years,
+        'disease_year_totals': np.bincount(cell, weights=counts, minlength=shape[0] * shape[1]).astype(np.int64).reshape(shape),
+        'disease_year_rows': np.bincount(cell, minlength=shape[0] * shape[1]).astype(np.int32).reshape(shape),
+        'category_totals': np.bincount(category, weights=counts, minlength=n_categories).astype(np.int64),
+        'category_disease_counts': np.bincount(pairs // n_diseases, minlength=n_categories).astype(np.int32),
+    })
+    return {'rows': int(len(order)), 'arrays': arrays, 'code_tables': built['code_tables']}
+
+
+class StartupSnapshot:
+    """メモリマップしたスナップショット（SQLiteStore と同じ問い合わせメソッドを持つ）"""
+
+    def __init__(self, directory: str, segment: str):
+        self.directory = directory
+        self.segment = segment
+        self.header, self.arrays = map_segment(directory, segment)
+        self.record_count = int(self.header['rows'])
+        self.sha256 = self.header['source_sha256']
+        self.version = self.sha256[:12]
+        self.code_tables: Dict[str, List[str]] = self.header['code_tables']
+        self._disease_index = {name: i for i, name in enumerate(self.code_tables['disease_name'])}
+        self._date_table = np.array(self.code_tables['report_date'])
+        self._year_index = {int(year): i for i, year in enumerate(self.arrays['years'])}
+
+    def nbytes(self) -> int:
+        return int(self.header['bytes'])
+
+    def disease_exists(self, disease_name: str) -> bool:
+        code = self._disease_index.get(disease_name)
+        return code is not None and self.arrays['disease_offsets'][code + 1] > self.arrays['disease_offsets'][code]
+
+    def disease_timeseries(self, disease_name: str, start_year: Optional[int] = None,
+                           end_year: Optional[int] = None) -> List[Dict]:
+        """疾病の時系列（日付順）。行範囲インデックスのスライスのみで求める"""
+        code = self._disease_index.get(disease_name)
+        if code is None:
+            return []
+        offsets = self.arrays['disease_offsets']
+        rows = slice(int(offsets[code]), int(offsets[code + 1]))
+        years = self.arrays['year'][rows]
+        mask = np.ones(len(years), dtype=bool)
+        if start_year:
+            mask &= years >= start_year
+        if end_year:
+            mask &= years <= end_year
+        dates = self._date_table[self.arrays['report_date'][rows][mask]]
+        values = self.arrays['count'][rows][mask]
+        return [{"date": d, "value": v} for d, v in zip(dates.tolist(), values.tolist())]
+
+    def iter_records(self, disease_name: Optional[str] = None, start_year: Optional[int] = None,
+                     end_year: Optional[int] = None, category: Optional[str] = None):
+        """レコードをバッチ単位で返す（/export 用。疾病指定時はその行範囲だけを走査する）"""
+        start, stop = 0, self.record_count
+        category_code = None
+        if category is not None:
+            if category not in self.code_tables['category']:
+                return iter(())
+            category_code = self.code_tables['category'].index(category)
+        if disease_name is not None:
+            code = self._disease_index.get(disease_name)
+            if code is None:
+                return iter(())
+            offsets = self.arrays['disease_offsets']
+            start, stop = int(offsets[code]), int(offsets[code + 1])
+        return iter_coded_batches(self.arrays, self.code_tables, start, stop, category_code=category_code,
+                                  start_year=start_year, end_year=end_year)
+
+    def top_diseases(self, limit: int, year: Optional[int] = None) -> List[Dict]:
+        """報告数上位の疾病"""
+        if year:
+            column = self._year_index.get(int(year))
+            if column is None:
+                return []
+            totals = self.arrays['disease_year_totals'][:, column]
+            candidates = np.flatnonzero(self.arrays['disease_year_rows'][:, column] > 0)
+        else:
+            totals = self.arrays['disease_totals']
+            candidates = np.flatnonzero(np.diff(self.arrays['disease_offsets']) > 0)
+        ranked = candidates[np.argsort(-totals[candidates], kind='stable')][:max(limit, 0)]
+        names = self.code_tables['disease_name']
+        categories = self.code_tables['category']
+        disease_category = self.arrays['disease_category']
+        return [
+            {
+                "disease_name": names[i],
+                "total_count": int(totals[i]),
+                "category": categories[disease_category[i]]
+            }
+            for i in ranked.tolist()
+        ]
+
+    def categories(self) -> List[Dict]:
+        """感染症分類別統計"""
+        totals = self.arrays['category_totals']
+        disease_counts = self.arrays['category_disease_counts']
+        return [
+            {"category": name, "total_count": int(totals[i]), "disease_count": int(disease_counts[i])}
+            for i, name in enumerate(self.code_tables['category'])
+            if disease_counts[i] > 0
+        ]
+
+    def yearly_trends(self) -> List[Dict]:
+        """年別合計"""
+        totals = self.arrays['disease_year_totals'].sum(axis=0)
+        return [
+            {"year": int(year), "total_count": int(total)}
+            for year, total in zip(self.arrays['years'].tolist(), totals.tolist())
+        ]
+
+
+def _read_manifest(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_other_snapshots(directory: str, keep: str):
+    """古いスナップショットを削除（マップ中のプロセスはそのまま参照を続けられる）"""
+    for entry in os.listdir(directory):
+        if entry.startswith("snapshot-") and not entry.startswith(keep + "."):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except FileNotFoundError:
+                pass
+
+
+def load_or_build(source_path: str, directory: str, phases: Optional[Dict[str, float]] = None) -> StartupSnapshot:
+    """
+    元CSVに対応するスナップショットを開く（なければ作成する）
+    サイズと更新時刻が記録と一致すればハッシュ計算も省略する
+    """
+    if phases is None:
+        phases = {}
+    os.makedirs(directory, exist_ok=True)
+    with locked_directory(directory):
+        stat = os.stat(source_path)
+        manifest = _read_manifest(directory)
+        usable = (
+            manifest is not None
+            and manifest.get('format') == SNAPSHOT_FORMAT
+            and os.path.exists(os.path.join(directory, f"{manifest['segment']}.bin"))
+        )
+
+        if not (usable and manifest['size'] == stat.st_size and manifest['mtime_ns'] == stat.st_mtime_ns):
+            phase_start = time.perf_counter()
+            sha256 = file_sha256(source_path)
+            phases['hash'] = phases.get('hash', 0.0) + time.perf_counter() - phase_start
+
+            if not (usable and manifest['sha256'] == sha256):
+                phase_start = time.perf_counter()
+                built = build_snapshot_arrays(source_path)
+                segment = f"snapshot-{sha256[:16]}"
+                write_segment(directory, segment, built['arrays'], {
+                    'format': SNAPSHOT_FORMAT,
+                    'rows': built['rows'],
+                    'code_tables': built['code_tables'],
+                    'source_sha256': sha256,
+                })
+                phases['build'] = phases.get('build', 0.0) + time.perf_counter() - phase_start
+                logger.info(f"起動用スナップショットを作成しました: {segment} ({built['rows']} レコード)")
+                manifest = {'format': SNAPSHOT_FORMAT, 'segment': segment, 'sha256': sha256}
+                _remove_other_snapshots(directory, segment)
+
+            manifest.update({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+            write_json_atomic(os.path.join(directory, MANIFEST_NAME), manifest)
+
+        phase_start = time.perf_counter()
+        snapshot = StartupSnapshot(directory, manifest['segment'])
+        phases['map'] = phases.get('map', 0.0) + time.perf_counter() - phase_start
+    return snapshot
+
+
+def main():
+    """スナップショットを事前に作成（コンテナイメージのビルド時などに実行）"""
+    logging.basicConfig(level=logging.INFO)
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "processed_data"
+    source = os.path.join(data_dir, "infectious_diseases_data.csv")
+    phases: Dict[str, float] = {}
+    snapshot = load_or_build(source, os.path.join(data_dir, SNAPSHOT_DIR_NAME), phases)
+    print(f"スナップショット: {snapshot.segment} ({snapshot.record_count:,} レコード, {snapshot.nbytes():,} バイト)")
+    print("所要時間: " + ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in phases.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+SQLiteによるインデックス付きデータストア
+データ処理スクリプトがデータベースを出力し、APIサーバーは読み取り専用接続で参照します。
+複数ワーカーでもOSのページキャッシュを共有できるため、ワーカーごとにデータを複製しません。
+"""
+
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+SQLITE_FILE_NAME = "infectious_diseases.sqlite"
+
+# ワーカーごとの読み取り専用接続数
+DEFAULT_POOL_SIZE = 4
+# 接続プールの空きを待つ最大秒数（超えたら StoreBusyError）
+POOL_TIMEOUT_SECONDS = 5.0
+# 読み取り時にmmapする最大サイズ（ページキャッシュを直接参照する）
+MMAP_SIZE = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE records (
+    id INTEGER PRIMARY KEY,
+    disease_name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    report_date TEXT NOT NULL,
+    category TEXT NOT NULL
+);
+CREATE TABLE metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# 集計テーブル（レコード投入後に作成する）
+AGGREGATES = """
+CREATE INDEX idx_records_disease_year_week ON records (disease_name, year, week);
+CREATE INDEX idx_records_category_year ON records (category, year);
+
+CREATE TABLE disease_year_totals AS
+    SELECT disease_name, MIN(category) AS category, year, SUM(count) AS total_count
+    FROM records GROUP BY disease_name, year;
+CREATE INDEX idx_disease_year_totals_year ON disease_year_totals (year, total_count DESC);
+
+CREATE TABLE disease_totals AS
+    SELECT disease_name, MIN(category) AS category, SUM(count) AS total_count
+    FROM records GROUP BY disease_name;
+CREATE INDEX idx_disease_totals_total ON disease_totals (total_count DESC);
+
+CREATE TABLE category_totals AS
+    SELECT category, SUM(count) AS total_count, COUNT(DISTINCT disease_name) AS disease_count
+    FROM records GROUP BY category;
+
+CREATE TABLE yearly_totals AS
+    SELECT year, SUM(count) AS total_count
+    FROM records GROUP BY year;
+"""
+
+# (disease_name, count, year, week, report_date 'YYYY-MM-DD', category)
+RecordTuple = Tuple[str, int, int, int, str, str]
+
+
+class SQLiteWriter:
+    """
+    レコードを追記してSQLiteデータベースを作成する
+    一時ファイルに書き出し、close() で集計テーブルを作成してから置き換えるため、参照中のワーカーには影響しない
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp_path = path + ".tmp"
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self._conn = sqlite3.connect(self._tmp_path)
+        self._conn.execute("PRAGMA journal_mode = OFF")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.executescript(SCHEMA)
+
+    def write_many(self, records: Iterable[RecordTuple]):
+        self._conn.executemany(
+            "INSERT INTO records (disease_name, count, year, week, report_date, category) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            records
+        )
+
+    def close(self) -> int:
+        """集計テーブルとインデックスを作成して出力先を置き換え、レコード数を返す"""
+        conn = self._conn
+        try:
+            conn.executescript(AGGREGATES)
+            record_count = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO metadata (key, value) VALUES (?, ?)",
+                [("record_count", str(record_count)), ("generated_at", datetime.now().isoformat())]
+            )
+            conn.commit()
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+
+        os.replace(self._tmp_path, self.path)
+        return record_count
+
+    def abort(self):
+        """書き込みを中止して一時ファイルを削除（出力先は変更しない）"""
+        self._conn.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def write_sqlite_database(path: str, records: Iterable[RecordTuple]) -> int:
+    """レコードからSQLiteデータベースを作成"""
+    writer = SQLiteWriter(path)
+    writer.write_many(records)
+    return writer.close()
+
+
+class StoreBusyError(RuntimeError):
+    """接続プールの空きを待つ間にタイムアウトした（APIは503を返す）"""
+
+
+class SQLiteStore:
+    """読み取り専用接続のプールを使ってクエリに応答するストア"""
+
+    def __init__(self, path: str, pool_size: int = DEFAULT_POOL_SIZE,
+                 pool_timeout: float = POOL_TIMEOUT_SECONDS):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.pool_timeout = pool_timeout
+        self._uri = Path(path).resolve().as_uri() + "?mode=ro"
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=pool_size)
+        self._connections: List[sqlite3.Connection] = []
+        for _ in range(pool_size):
+            conn = self._connect()
+            self._connections.append(conn)
+            self._pool.put(conn)
+        self.record_count = int(self._metadata("record_count", "0"))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get(timeout=self.pool_timeout)
+        except queue.Empty:
+            raise StoreBusyError(f"SQLiteの接続プールに {self.pool_timeout} 秒以内に空きができませんでした")
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        """接続をすべて閉じる（使用中の接続があれば、その処理は失敗する。再読み込み時は参照を外すだけにすること）"""
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+
+    def file_size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def _metadata(self, key: str, default: str) -> str:
+        with self.connection() as conn:
+            row = conn.execute("SELECT value FROM metadata WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def disease_exists(self, disease_name: str) -> bool:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM disease_totals WHERE disease_name = ?", (disease_name,)
+            ).fetchone()
+        return row is not None
+
+    def disease_timeseries(self, disease_name: str, start_year: Optional[int] = None,
+                           end_year: Optional[int] = None) -> List[Dict]:
+        """疾病の時系列（日付順）"""
+        sql = "SELECT report_date, count FROM records WHERE disease_name = ?"
+        params: list = [disease_name]
+        if start_year:
+            sql += " AND year >= ?"
+            params.append(start_year)
+        if end_year:
+            sql += " AND year <= ?"
+            params.append(end_year)
+        sql += " ORDER BY year, week"
+        with self.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [{"date": report_date, "value": count} for report_date, count in rows]
+
+    def top_diseases(self, limit: int, year: Optional[int] = None) -> List[Dict]:
+        """報告数上位の疾病"""
+        with self.connection() as conn:
+            if year:
+                rows = conn.execute(
+                    "SELECT disease_name, total_count, category FROM disease_year_totals "
+                    "WHERE year = ? ORDER BY total_count DESC LIMIT ?",
+                    (year, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT disease_name, total_count, category FROM disease_totals "
+                    "ORDER BY total_count DESC LIMIT ?",
+                    (limit,)
+                ).fetchall()
+        return [
+            {"disease_name": name, "total_count": int(total), "category": category}
+            for name, total, category in rows
+        ]
+
+    def categories(self) -> List[Dict]:
+        """感染症分類別統計"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT category, total_count, disease_count FROM category_totals ORDER BY category"
+            ).fetchall()
+        return [
+            {"category": category, "total_count": int(total), "disease_count": int(diseases)}
+            for category, total, diseases in rows
+        ]
+
+    def yearly_trends(self) -> List[Dict]:
+        """年別合計"""
+        with self.connection() as conn:
+            rows = conn.execute("SELECT year, total_count FROM yearly_totals ORDER BY year").fetchall()
+        return [{"year": int(year), "total_count": int(total)} for year, total in rows]
+
+    def iter_records(self, disease_name: Optional[str] = None, start_year: Optional[int] = None,
+                     end_year: Optional[int] = None, category: Optional[str] = None,
+                     batch_size: int = 5000) -> Iterator[List[RecordTuple]]:
+        """
+        レコードをバッチ単位で返す（/export 用。取り出しながら送信するため全件を保持しない）
+        送信が終わるまで接続を使い続けるため、プールの接続は使わず専用の接続を開く
+        並びは他のバックエンドと同じ 疾病名 → 報告日（報告日は年・週から決まるため索引順で取り出せる）
+        """
+        sql = "SELECT disease_name, count, year, week, report_date, category FROM records"
+        conditions = []
+        params: list = []
+        if disease_name is not None:
+            conditions.append("disease_name = ?")
+            params.append(disease_name)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if start_year:
+            conditions.append("year >= ?")
+            params.append(start_year)
+        if end_year:
+            conditions.append("year <= ?")
+            params.append(end_year)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY disease_name, year, week, rowid"
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            conn.close()
+
+    def weekly_totals(self, start_year: Optional[int] = None,
+                      end_year: Optional[int] = None) -> Tuple[List[str], Dict[str, List[int]]]:
+        """
+        疾病・年・週ごとの報告数の合計（/correlations 用）
+        (疾病名の一覧, {'disease': 一覧の位置, 'year', 'week', 'total'}) を返す
+        """
+        sql = "SELECT disease_name, year, week, SUM(count) FROM records"
+        conditions = []
+        params: list = []
+        if start_year is not None:
+            conditions.append("year >= ?")
+            params.append(start_year)
+        if end_year is not None:
+            conditions.append("year <= ?")
+            params.append(end_year)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " GROUP BY disease_name, year, week ORDER BY disease_name, year, week"
+        with self.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        names: List[str] = []
+        index: Dict[str, int] = {}
+        columns: Dict[str, List[int]] = {'disease': [], 'year': [], 'week': [], 'total': []}
+        for name, year, week, total in rows:
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+            columns['disease'].append(index[name])
+            columns['year'].append(year)
+            columns['week'].append(week)
+            columns['total'].append(int(total))
+        return names, columns
+
+    def dimensions(self) -> Dict:
+        """疾病数・分類数・年の一覧（/query のコスト見積もり用）"""
+        with self.connection() as conn:
+            diseases = conn.execute("SELECT COUNT(*) FROM disease_totals").fetchone()[0]
+            categories = conn.execute("SELECT COUNT(*) FROM category_totals").fetchone()[0]
+            years = [row[0] for row in conn.execute("SELECT year FROM yearly_totals ORDER BY year")]
+        return {'disease': int(diseases), 'category': int(categories), 'years': years}
+
+    def execute(self, plan) -> List[Dict]:
+        """/query のクエリプラン（query_engine.QueryPlan）をSQLで実行"""
+        from query_engine import GROUP_COLUMNS, format_value
+        
+        columns = [GROUP_COLUMNS[k] for k in plan.group_by]
+        function = {'sum': 'SUM', 'mean': 'AVG', 'max': 'MAX'}[plan.agg]
+        conditions = []
+        params: list = []
+        for values, column in ((plan.diseases, 'disease_name'), (plan.categories, 'category')):
+            if values:
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        for column, low, high in (('year', plan.start_year, plan.end_year), ('week', plan.start_week, plan.end_week)):
+            if low is not None:
+                conditions.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{column} <= ?")
+                params.append(high)
+        
+        sql = f"SELECT {''.join(c + ', ' for c in columns)}{function}(count) AS value, COUNT(*) AS rows FROM records"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if columns:
+            sql += " GROUP BY " + ", ".join(columns)
+        if plan.top is not None:
+            sql += " ORDER BY value DESC" + "".join(", " + c for c in columns) + " LIMIT ?"
+            params.append(plan.top)
+        elif columns:
+            sql += " ORDER BY " + ", ".join(columns)
+        
+        with self.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        result = []
+        for row in rows:
+            if row[-1] == 0:
+                continue
+            record = dict(zip(columns, row))
+            record['value'] = format_value(plan.agg, row[-2])
+            record['rows'] = int(row[-1])
+            result.append(record)
+        return result